@@ -1,31 +1,145 @@
 # Imports de libs padrao
 import os
 import sys
-
-# Imports de libs especificos para manipulacao de dados
-import numpy as np
-import pandas as pd
-import torch
-
-# Import das libs para execucao de LLM's
-from langchain.llms import LlamaCpp
-
-# Import das libs para RAG
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain_core.output_parsers import StrOutputParser
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain.document_loaders import DirectoryLoader
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.prompts import ChatPromptTemplate
+import json
+import shutil
+import hashlib
+import time
+import fnmatch
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# As libs pesadas (torch, numpy, langchain, FAISS e llama.cpp) sao importadas
+# dentro dos metodos que as utilizam, entao o import deste modulo e rapido
+# (health checks, CLIs e workers de vida curta) e cada caminho so paga pelo
+# que utiliza. O tempo do import e verificado no rag_benchmark (--import-budget)
 
 # Import de libs utils para informacao de hardware
 from custom_libs.ds_utils import hardware_info
 
+# Import de libs utils para controle da base de vetores
+from custom_libs.rag_storage import EMBEDDING_CACHE_DIR, Storage_Manifest, Chunk_Store, file_hash, chunk_id, index_version
+
+# Import de libs utils para os tipos de indice FAISS
+from custom_libs.rag_index import Index_Config, INDEX_REPORT_FILE, build_index, recall_report, set_search_params, read_index, write_index
+
+# Import de libs utils para gerenciamento das LLMs
+from custom_libs.llm_runtime import LLM_Pool, LlamaCpp_Config, Prompt_Prefix_Cache
+
+# Import de libs utils para particoes da base por metadados
+from custom_libs.rag_partitions import Partitioned_Index, extract_metadata
+
+# Import de libs utils para bases divididas em shards
+from custom_libs.rag_shards import SHARDS_DIR, Sharded_Store, shard_name, shard_path, save_shard_config, load_shard_config
+
+# Import de libs utils para busca lexica (BM25)
+from custom_libs.rag_lexical import BM25_Index, reciprocal_rank_fusion
+
+# Import de libs utils para montagem do contexto
+from custom_libs.rag_context import Context_Packer, llm_token_counter
+
+# Import de libs utils para instrumentacao por etapa
+from custom_libs.rag_metrics import Pipeline_Metrics
+
+# Import de libs utils para cache de respostas
+from custom_libs.rag_cache import Answer_Cache, Retrieval_Cache, normalize_question
+
+# Import de libs utils para o snapshot de warm start
+from custom_libs.rag_snapshot import Warm_Snapshot, data_fingerprint, storage_version, file_identity
+
+
+# Modelo de embedding padrao (o mesmo padrao do HuggingFaceEmbeddings)
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+# Registro de modelos de embedding compartilhado por todo o processo,
+# chave (nome do modelo, device) -> HuggingFaceEmbeddings ja carregado
+_embedding_models = {}
+_embedding_models_lock = threading.Lock()
+
+# Chaves do registro preenchidas pelo register_embedding_model (e nao
+# carregadas do HuggingFace), os workers de embedding nao conseguem
+# carregar esses modelos pelo nome
+_registered_embedding_models = set()
+
+
+def get_embedding_model(model_name = DEFAULT_EMBEDDING_MODEL, device = "cpu"):
+    """Retorna o modelo de embedding do processo, carregando os pesos do
+    sentence-transformer apenas na primeira chamada. Criacao da base,
+    consultas e todas as instancias de LLM_With_Rag reaproveitam o
+    mesmo objeto.
+
+    Args:
+        model_name (str, optional): Nome do modelo no HuggingFace.
+        device (str, optional): Device ja resolvido ("cpu" ou "cuda"). Padrao "cpu".
+
+    Returns:
+        HuggingFaceEmbeddings: Modelo de embedding carregado
+    """
+
+    key = (model_name, device)
+
+    with _embedding_models_lock:
+        if key not in _embedding_models:
+            from langchain.embeddings import HuggingFaceEmbeddings
+
+            _embedding_models[key] = HuggingFaceEmbeddings(model_name=model_name,
+                                                           model_kwargs={'device': device})
+
+        return _embedding_models[key]
+
+
+def register_embedding_model(model_name, embedding_function, device = "cpu"):
+    """Registra um modelo de embedding ja instanciado no registro do
+    processo, utilizado no lugar do HuggingFaceEmbeddings por todas as
+    instancias que pedirem esse nome (ex: embedder deterministico do
+    benchmark, sem download de pesos)
+
+    Args:
+        model_name (str): Nome utilizado no parametro 'embedding_model'
+        embedding_function (Embeddings): Modelo de embedding
+        device (str, optional): Device ja resolvido. Padrao "cpu".
+    """
+
+    with _embedding_models_lock:
+        _embedding_models[(model_name, device)] = embedding_function
+        _registered_embedding_models.add((model_name, device))
+
+
+def registered_embedding_model(model_name, device = "cpu"):
+    """Retorna o modelo registrado com register_embedding_model
+
+    Args:
+        model_name (str): Nome utilizado no parametro 'embedding_model'
+        device (str, optional): Device ja resolvido. Padrao "cpu".
+
+    Returns:
+        Embeddings: Modelo registrado ou None caso o nome seja de um modelo do HuggingFace
+    """
+
+    with _embedding_models_lock:
+        if (model_name, device) not in _registered_embedding_models:
+            return None
+
+        return _embedding_models[(model_name, device)]
+
+
+# Template do prompt RAG utilizado nas respostas
+PROMPT_TEMPLATE = """
+        ### [INST] 
+        Instructions: Answer in portuguese, and take the following context in mind:
+
+        {context}
+
+        ### Question to answer:
+        {question} 
+
+        [/INST]
+        """
+
+
+# Marca o fim do stream de tokens entre a thread de geracao e o event loop
+_STREAM_END = object()
 
 
 class suppress_stdout_stderr(object):
@@ -81,10 +195,29 @@ class LLM_With_Rag:
     Utilize a flag 'create_storage_db' para especificar quando criar
     essa base de dados em memoria.
 
+    Com a flag 'incremental_db' a base nao e recriada do zero: um
+    manifesto com o hash de cada arquivo fica ao lado do index.faiss
+    e apenas arquivos novos ou alterados sao embedados, os vetores de
+    arquivos removidos sao apagados e o restante fica intocado.
+
     O embedding criado e o padrao do HuggingFaces (pode melhorar)
 
+    A ingestao dos documentos e feita em streaming: um arquivo por vez
+    e lido, dividido em chunks e embedado em janelas de 'ingest_window'
+    chunks, entao os arquivos lidos e os lotes de embedding nunca ficam
+    todos em memoria. O que vai para a base cresce com a quantidade de
+    chunks ate a gravacao: vetores no indice FAISS, textos e metadados no
+    docstore em memoria (copiados para o Chunk_Store no final) e o BM25.
+
     A base de dados escolhida para armazenar os embeddings e o FAISS
     (muitas oportunidades de melhoria de DB e tipo de armazenamento)
+
+    Com a flag 'warm_snapshot' (desligada por padrao) cada start_model
+    grava um snapshot no storage. Em um restart sem mudancas na
+    configuracao, nos documentos e na base, a criacao da base e pulada
+    mesmo com new_db=True (start_stats["snapshot_hit"]) e o estado do
+    prefixo do prompt e lido do disco, o tempo ate ficar pronto fica em
+    start_stats.
     """
 
     def __init__(self,
@@ -93,7 +226,43 @@ class LLM_With_Rag:
                  models_path = "./01_models",
                  rag_data_path = "./02_transcript_data",
                  results_path = "./03_results",
+                 embedding_model = DEFAULT_EMBEDDING_MODEL,
                  create_storage_db = True,
+                 incremental_db = False,
+                 embedding_cache = True,
+                 embed_batch_size = 64,
+                 embed_workers = 1,
+                 ingest_window = 512,
+                 document_loader = None,
+                 index_config = None,
+                 mmap_index = False,
+                 shards = None,
+                 shard_by = "file",
+                 shard_workers = None,
+                 rag_files = None,
+                 answer_cache = False,
+                 answer_cache_threshold = 0.92,
+                 answer_cache_ttl = 3600,
+                 answer_cache_size = 1024,
+                 answer_cache_path = None,
+                 top_k = 4,
+                 retrieval_mode = "vector",
+                 lexical_shortcut = 2.0,
+                 auto_filter = False,
+                 retrieval_cache_size = 2048,
+                 context_packing = False,
+                 context_candidates = 16,
+                 context_token_budget = None,
+                 context_dedupe_threshold = 0.9,
+                 async_queue_size = 64,
+                 async_retrieval_workers = 4,
+                 llm_memory_budget = None,
+                 llm_max_models = None,
+                 llm_config = None,
+                 prefix_cache = False,
+                 prefix_cache_bytes = 2 << 30,
+                 metrics = True,
+                 warm_snapshot = False,
                  device = "cpu", # Aceita cpu, gpu e auto para gpu se possivel
                  save_results = False,
                  assist_log = False,
@@ -114,16 +283,185 @@ class LLM_With_Rag:
         # [ATRIB] Variavel com a localizacao de eventuais resultados
         self.results_path = results_path
 
+        # [ATRIB] Variavel com o nome do modelo de embedding (HuggingFace)
+        self.embedding_model = embedding_model
+
         # [ATRIB] [FAISS] Variavel por indicar se o banco de arquivos deve ser
         # recriado ou nao. Essa variavel e muito importante caso nao queiramos
         # recriar o bando vetorizado para o RAG. Caso o banco ja exista e nao
         # precise ser atualizado nao e recomendado que o recrie, basta utiliza-lo.
         self.create_storage_db = create_storage_db
 
+        # [ATRIB] [FAISS] Variavel que indica se a criacao do banco deve ser
+        # incremental, ou seja, reaproveitar o indice existente e embedar
+        # somente arquivos novos ou alterados (controlado pelo manifesto)
+        self.incremental_db = incremental_db
+
+        # [ATRIB] [FAISS] Variavel que indica se os embeddings dos chunks devem
+        # ser guardados em um cache em disco (chave: modelo + hash do texto),
+        # assim uma re-indexacao so paga pelo texto que ainda nao foi visto
+        self.embedding_cache = embedding_cache
+
+        # [ATRIB] [FAISS] Quantidade de chunks por lote no pipeline de embedding
+        self.embed_batch_size = embed_batch_size
+
+        # [ATRIB] [FAISS] Quantidade de processos que embedam os lotes em
+        # paralelo (utilizado somente quando o device e CPU). Modelos do
+        # register_embedding_model sao enviados prontos aos workers (pickle)
+        self.embed_workers = embed_workers
+
+        # [ATRIB] [FAISS] Quantidade maxima de chunks aguardando o embedding
+        # durante a ingestao, a pasta de documentos e lida, embedada e
+        # indexada em janelas desse tamanho
+        self.ingest_window = ingest_window
+
+        # [ATRIB] [FAISS] Classe que le cada arquivo da pasta de documentos,
+        # loader(path).load() -> Documents (None = UnstructuredFileLoader)
+        self.document_loader = document_loader
+
+        # [ATRIB] Estatisticas de vazao da ultima ingestao (chunks/s)
+        self.ingest_stats = {}
+
+        # [ATRIB] [FAISS] Tipo e parametros do indice (flat, ivf_flat, ivf_pq, hnsw).
+        # Aceita um Index_Config, um dict com os parametros, o nome do tipo ou
+        # None (configuracao gravada no storage, flat caso nao exista)
+        if isinstance(index_config, str):
+            index_config = Index_Config(index_type=index_config)
+        elif isinstance(index_config, dict):
+            index_config = Index_Config(**index_config)
+        elif index_config is None:
+            index_config = Index_Config.load(storage_path) or Index_Config()
+        self.index_config = index_config
+
+        # [ATRIB] Relatorio recall x latencia do indice (gravado na criacao da base)
+        self.index_report = None
+
+        # [ATRIB] Arquivos da pasta de documentos que entram na base (None = todos os .txt)
+        self.rag_files = rag_files
+
+        # [ATRIB] [SHARDS] Base dividida em shards independentes (uma base completa
+        # por shard em 00_storage/shards). Com shard_by="file" os arquivos sao
+        # divididos em 'shards' partes pelo hash do nome, com shard_by="product"
+        # cada produto tem o seu shard e 'shards' so liga a divisao (True ou
+        # qualquer inteiro positivo, a quantidade sai dos produtos). None utiliza
+        # a divisao gravada no storage (base sem shards caso nao exista). As
+        # buscas rodam em paralelo em ate 'shard_workers' threads (None = uma por shard)
+        shard_config = load_shard_config(storage_path) if shards is None else None
+        if shard_config:
+            shards, shard_by = shard_config["n_shards"], shard_config["shard_by"]
+
+        if shard_by not in ("file", "product"):
+            raise ValueError(f"""shard_by deve ser file ou product, recebido: {shard_by}""")
+
+        if shards and (not isinstance(shards, int) or shards < 1
+                       or (shard_by == "file" and isinstance(shards, bool))):
+            raise ValueError(f"""shards deve ser um inteiro positivo (ou True com shard_by=product), recebido: {shards}""")
+
+        self.shards = shards
+        self.shard_by = shard_by
+        self.shard_workers = shard_workers
+
+        # [ATRIB] [SHARDS] Shards carregados (nome -> LLM_With_Rag do shard) e
+        # executor da busca em paralelo, criados no __get_db
+        self.shard_stores = {}
+        self.shard_executor = None
+        self.shards_lock = threading.Lock()
+
+        # [ATRIB] [FAISS] Variavel que indica se o indice FAISS deve ser aberto via
+        # memory-map somente leitura (os chunks sempre sao), assim varios processos
+        # (ex: workers do gunicorn) compartilham as mesmas paginas e o tempo de
+        # carga nao depende do tamanho da base
+        self.mmap_index = mmap_index
+
+        # [ATRIB] [CACHE] Variavel que indica se as respostas devem ser cacheadas,
+        # perguntas iguais (normalizadas) ou parecidas (similaridade do embedding
+        # acima de 'answer_cache_threshold') nao passam de novo pela LLM
+        self.use_answer_cache = answer_cache
+        self.answer_cache_threshold = answer_cache_threshold
+
+        # [ATRIB] [CACHE] Tempo de vida (s), tamanho maximo (LRU) e arquivo json de
+        # persistencia do cache de respostas (None = somente em memoria). Cada
+        # resposta guarda a versao da base e so vale para a mesma versao
+        self.answer_cache_ttl = answer_cache_ttl
+        self.answer_cache_size = answer_cache_size
+        self.answer_cache_path = answer_cache_path
+
+        # [ATRIB] [CACHE] Cache de respostas, criado no start_model
+        self.answer_cache = None
+
+        # [ATRIB] Quantidade de chunks recuperados como contexto de cada pergunta
+        self.top_k = top_k
+
+        # [ATRIB] Tipo de busca: "vector" (FAISS), "lexical" (BM25) ou "hybrid"
+        # (as duas unidas por reciprocal rank fusion)
+        if retrieval_mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"""retrieval_mode deve ser vector, lexical ou hybrid, recebido: {retrieval_mode}""")
+        self.retrieval_mode = retrieval_mode
+
+        # [ATRIB] No modo hybrid, perguntas em que o melhor chunk do BM25 contem
+        # todos os termos raros e tem score 'lexical_shortcut' vezes maior que o
+        # segundo sao respondidas sem o modelo de embedding (None = desligado)
+        self.lexical_shortcut = lexical_shortcut
+
+        # [ATRIB] Indice invertido BM25 da base (carregado no __get_db)
+        self.lexical_index = None
+
+        # [ATRIB] Indices por particao de metadados (produto e tipo de documento),
+        # carregados no __get_db e utilizados nas buscas com filtro
+        self.partitions = None
+
+        # [ATRIB] Variavel que indica se perguntas que citam um unico produto da
+        # base devem ser buscadas somente na particao desse produto
+        self.auto_filter = auto_filter
+
+        # [ATRIB] [CACHE] Cache pergunta -> ids dos chunks recuperados, invalidado
+        # automaticamente quando a versao da base muda (0 desliga o cache)
+        self.retrieval_cache = Retrieval_Cache(max_size=retrieval_cache_size)
+
+        # [ATRIB] Versao da base carregada (calculada no __get_db)
+        self.index_version = None
+
+        # [ATRIB] [CONTEXTO] Variavel que indica se o contexto deve ser empacotado:
+        # sao recuperados 'context_candidates' chunks, quase duplicatas (acima de
+        # 'context_dedupe_threshold') sao descartadas, vizinhos do mesmo arquivo
+        # sao unidos e o contexto e preenchido ate 'context_token_budget' tokens
+        # (None = o que sobra do n_ctx depois do prompt e da resposta). Desligado
+        # por padrao, mantendo os 'top_k' chunks do retrieve como contexto
+        self.context_packing = context_packing
+        self.context_candidates = context_candidates
+        self.context_token_budget = context_token_budget
+        self.context_dedupe_threshold = context_dedupe_threshold
+
+        # [ATRIB] [WARM] Snapshot do ultimo start_model (configuracao resolvida,
+        # versao dos documentos e da base e estado do prefixo do prompt). Com ele
+        # um processo reiniciado pula a criacao da base quando nada mudou e
+        # restaura o prefixo do disco (None = desligado). Desligado por padrao,
+        # assim start_model(new_db=True) sempre recria a base
+        self.warm_snapshot = Warm_Snapshot(storage_path) if warm_snapshot else None
+        if self.warm_snapshot:
+            self.warm_snapshot.load()
+
+        # [ATRIB] [WARM] Parametros pedidos que dependem do hardware, a resolucao
+        # gravada no snapshot e reaproveitada enquanto eles e a maquina nao mudarem
+        self.requested_config = {"device": device, "model_name": model_name,
+                                 "llm_config": llm_config if llm_config == "auto" else None}
+        resolved = self.warm_snapshot.resolved(self.requested_config) if self.warm_snapshot else None
+
+        # [ATRIB] [WARM] Tempos do ultimo start_model (time-to-ready)
+        self.start_stats = {}
+
         # [ATRIB] Tenta forcar o tipo de device que vamos utilizar dentro do
         # processamento (GPU ou CPU)
         # Recomenda-se GPU apenas no LINUX (MAC NAO E LINUX)
-        self.device = device
+        # O device e resolvido ja aqui para que a criacao da base e as
+        # consultas utilizem o mesmo modelo de embedding ("cuda" = ja resolvido)
+        if device in ("cpu", "cuda"):
+            self.device = device
+        elif resolved:
+            self.device = resolved["device"]
+        else:
+            import torch
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
         # [ATRIB] Variavel com a opcao de salvar os prompts e suas respostas
         self.save_results = save_results
@@ -142,13 +480,93 @@ class LLM_With_Rag:
             # Captura e exibe as informacoes em saida de terminal
             hi.get_info()
 
-        # Inicializa objeto de retriever e vectorstorage
+        # Inicializa objeto de retriever, vectorstorage e LLM
         self.retriever = None
         self.vectorstore = None
+        self.llm = None
+
+        # Cadeia RAG montada sob demanda e os objetos com que foi montada,
+        # trocar a LLM ou a vectorstore invalida a cadeia
+        self.rag_chain = None
+        self.chain_llm = None
+        self.chain_vectorstore = None
+
+        # O llama.cpp nao aceita duas geracoes ao mesmo tempo no mesmo modelo
+        self.llm_lock = threading.Lock()
+
+        # [ATRIB] [ASYNC] Tamanho da fila de perguntas do aanswer e quantidade de
+        # threads que recuperam contexto em paralelo com a geracao
+        self.async_queue_size = async_queue_size
+        self.async_retrieval_workers = async_retrieval_workers
+
+        # [ATRIB] [LLM] Parametros de execucao do llama.cpp (threads, batch,
+        # contexto, mmap/mlock, rope, camadas na GPU). Aceita um LlamaCpp_Config,
+        # um dict com os parametros, "auto" (escolhe pelo hardware) ou None
+        # (configuracao historica da lib)
+        if llm_config == "auto" and resolved:
+            llm_config = LlamaCpp_Config(**resolved["llm_config"])
+        elif llm_config == "auto":
+            llm_config = LlamaCpp_Config.auto(device=self.device,
+                                              model_path=f"""{self.models_path}/{self.model_name}""")
+        elif isinstance(llm_config, dict):
+            llm_config = LlamaCpp_Config(**llm_config)
+        elif llm_config is None:
+            llm_config = LlamaCpp_Config()
+        self.llm_config = llm_config
+
+        if self.assist_log:
+            print(f"""Configuracao do llama.cpp: {self.llm_config}""")
+
+        # [ATRIB] [LLM] Pool de modelos carregados sob demanda (mmap), o modelo
+        # menos utilizado e descarregado quando a memoria residente passa de
+        # 'llm_memory_budget' bytes ou a quantidade passa de 'llm_max_models'
+        # (None = sem limite). Sem o psutil o orcamento de memoria vira um
+        # limite de quantidade (ver LLM_Pool)
+        self.llm_pool = LLM_Pool(self.__load_llm, memory_budget=llm_memory_budget,
+                                 assist_log=assist_log, on_evict=self.__drop_model_chain,
+                                 max_models=llm_max_models)
+
+        # [ATRIB] [LLM] Cadeias dos modelos do pool, nome -> (LLM, cadeia)
+        self.model_chains = {}
+
+        # [ATRIB] [LLM] Cache do estado do llama.cpp para o prefixo fixo do prompt
+        # (instrucoes antes do {context}), cada pergunta so avalia os tokens novos.
+        # 'prefix_cache_bytes' limita o LlamaRAMCache de cada modelo. Desligado por
+        # padrao: o Llama.generate ja reaproveita o prefixo comum com o prompt
+        # anterior e o cache grava o estado completo depois de cada resposta
+        self.prefix_cache = (Prompt_Prefix_Cache(PROMPT_TEMPLATE[:PROMPT_TEMPLATE.index("{context}")],
+                                                 capacity_bytes=prefix_cache_bytes)
+                             if prefix_cache else None)
+
+        # [ATRIB] [LLM] Tempos da ultima geracao: tokens do prompt, tokens do prefixo
+        # reaproveitados, avaliacao do prompt (s), geracao (s) e tokens gerados
+        self.last_timings = {}
+
+        # [ATRIB] [METRICAS] Tempo por etapa (embedding, search, retrieval,
+        # prompt_build, prompt_eval, generation, total), tokens/s, tokens e chunks
+        # de cada chamada, com histogramas para p50/p95/p99 (summary/prometheus)
+        self.metrics = Pipeline_Metrics(enabled=metrics)
+
+        # [ATRIB] [ASYNC] Worker, fila e executores, criados no start_async_worker
+        # no event loop em 'async_loop' (um asyncio.run novo cria outros)
+        self.async_worker = None
+        self.async_loop = None
+        self.request_queue = None
+        self.retrieval_executor = None
+        self.llm_executor = None
+        self.in_flight = None
+
+        # [ATRIB] [ASYNC] Perguntas em andamento, referencias fortes para que as
+        # tasks nao sejam coletadas pelo garbage collector antes de terminar
+        self.async_tasks = set()
 
         # Grava o parametro verbose de inicializacao do modelo
         self.llm_verbose = llm_verbose
 
+        # [ATRIB] Divisor de texto utilizado para quebrar os documentos em chunks
+        # (criado na primeira ingestao)
+        self.text_splitter = None
+
 
     def __create_db(self,):
         """Caso a execucao precise criar uma base de dados com os
@@ -166,46 +584,59 @@ class LLM_With_Rag:
             criacao do banco local de arquivos
         """
 
+        # Base dividida em shards, cada shard e criado de forma independente
+        if self.shards:
+            return self.__create_sharded_db()
+
         # Variavel de retorno inicialziada como falsa por padrao
         # e so e atualziada caso tenhamos sucesso na criacao da
         # base de dados FAISS com os arquivos para RAG
         sucess = False
 
-        try:
-            # Cria objeto de leitura
-            loader = DirectoryLoader(self.rag_data_path, glob="*.txt")
-
-            # Cria objeto com os arquivos de leitura
-            documents = loader.load()
-
-            # Caso o log esteja ligado mostra os documentos carregados
-            if self.assist_log:
-                print(f"""Total de documentos encontrados: {len(documents)} """)
-                print("Indexando...")
-
-            # Divide os arquivos txt em chunks
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=120, chunk_overlap=0)
-            texts = text_splitter.split_documents(documents)
-
-            # Carrega modelo de embedding
-            embedding_function = HuggingFaceEmbeddings(model_kwargs={'device': self.device})
-            embedding_function.embed_query(texts[0].page_content)
-
-            # Cria e persiste um base FAISS
-            vector_database = FAISS.from_documents(texts, embedding_function)
-
-            # Tenta persistir a base de vetores
-            vector_database.save_local(self.storage_path)
-
-            # Caso o log esteja ligado avisa sobre a persistencia do vetor
-            if self.assist_log:
-                print("Base de dados criada em: ", self.storage_path)
-                return True
-
+        # Pipeline de embedding, guardado para encerrar os workers no final
+        parallel_function = None
 
-            # Caso todos os passos tenham sido completados com sucesso grava sucesso
-            # na variavel de retorno
-            sucess = True
+        try:
+            from custom_libs.rag_embeddings import Parallel_Embeddings, Cached_Embeddings
+
+            # Carrega modelo de embedding dentro do pipeline em lotes, com
+            # varios processos apenas quando rodando somente em CPU
+            parallel_function = Parallel_Embeddings(
+                get_embedding_model(self.embedding_model, self.device),
+                self.embedding_model,
+                batch_size=self.embed_batch_size,
+                workers=self.embed_workers if self.device == "cpu" else 1,
+                worker_model=registered_embedding_model(self.embedding_model, self.device),
+                )
+            embedding_function = parallel_function
+
+            # Consulta o cache em disco antes de embedar cada chunk
+            if self.embedding_cache:
+                embedding_function = Cached_Embeddings(embedding_function, self.storage_path)
+
+            # Carrega o manifesto com o hash de cada arquivo ja indexado, um
+            # manifesto de outro modelo de embedding ou chunking nao e carregado
+            manifest = Storage_Manifest(self.storage_path, settings=self.__ingest_settings())
+
+            # No modo incremental, caso ja exista uma base com manifesto
+            # valido, atualiza apenas o que mudou na pasta de documentos
+            # Indices aproximados sao sempre recriados (o HNSW nao aceita
+            # remocao e o IVF precisa de treino), o cache de embeddings evita
+            # re-embedar os chunks que ja existiam
+            stored_config = Index_Config.load(self.storage_path) or Index_Config()
+            flat_index = self.index_config.index_type == stored_config.index_type == "flat"
+
+            if self.incremental_db and flat_index and self.__storage_exists() and manifest.load():
+                sucess = self.__update_db(embedding_function, manifest)
+            else:
+                sucess = self.__build_db(embedding_function, manifest)
+
+            # Persiste os vetores novos no cache de embeddings
+            if self.embedding_cache:
+                embedding_function.save()
+
+                if self.assist_log:
+                    print(f"""Cache de embeddings: {embedding_function.hits} hits | {embedding_function.misses} misses""")
         
         except Exception as e:
 
@@ -232,160 +663,1999 @@ class LLM_With_Rag:
                   {e}
                   """)
 
+        finally:
+            # Encerra os workers de embedding
+            if parallel_function is not None:
+                parallel_function.close()
+
         return sucess
 
 
-    def __get_db(self,):
-        """Traz para memoria e deixa disponivel para a LLM ler
-        os arquivos indexados dentro do banco de dados local
+    def __storage_exists(self,):
+        """Verifica se ja existe uma base FAISS persistida na pasta de storage
 
         Returns:
-            _type_: _description_
+            bool: True caso o index.faiss e os chunks (Chunk_Store ou index.pkl) existam
         """
 
-        try:
-            # Carrega o modelo de embeddings
-            embeddings = HuggingFaceEmbeddings()
+        return (os.path.isfile(os.path.join(self.storage_path, "index.faiss"))
+                and (Chunk_Store.exists(self.storage_path)
+                     or os.path.isfile(os.path.join(self.storage_path, "index.pkl"))))
 
-            # Carrega a base FAISS
-            self.vectorstore = FAISS.load_local(self.storage_path, embeddings)
 
+    def __list_rag_files(self,):
+        """Lista os arquivos .txt da pasta de documentos do RAG
+
+        Returns:
+            list: Nomes dos arquivos em ordem alfabetica (somente os de
+            'rag_files', caso informado)
+        """
+
+        return sorted(name for name in os.listdir(self.rag_data_path)
+                      if fnmatch.fnmatch(name, "*.txt")
+                      and (self.rag_files is None or name in self.rag_files)
+                      and os.path.isfile(os.path.join(self.rag_data_path, name)))
+
+
+    def __shard_groups(self,):
+        """Divide os arquivos da pasta de documentos entre os shards
+
+        Returns:
+            dict: Nome do shard -> nomes dos arquivos
+        """
+
+        groups = {}
+        for file_name in self.__list_rag_files():
+            groups.setdefault(shard_name(file_name, self.shard_by, self.shards), []).append(file_name)
+
+        return groups
+
+
+    def __new_shard(self, name, files = None, storage_path = None):
+        """Cria o objeto de um shard: uma base completa (indice, chunks,
+        BM25, particoes) com os mesmos parametros de ingestao e busca do
+        objeto principal, restrita aos arquivos do shard
+
+        Args:
+            name (str): Nome do shard
+            files (list, optional): Arquivos do shard (None = nao vai criar a base). Padrao None.
+            storage_path (str, optional): Pasta da base, None utiliza a pasta
+                gravada na configuracao dos shards (ver shard_path). Padrao None.
+
+        Returns:
+            LLM_With_Rag: Objeto do shard (sem LLM)
+        """
+
+        # Device e configuracao ja resolvidos pelo objeto principal, o log do
+        # hardware e da configuracao nao e repetido a cada shard
+        shard = LLM_With_Rag(
+            model_name=self.model_name,
+            storage_path=storage_path or shard_path(self.storage_path, name, load_shard_config(self.storage_path)),
+            models_path=self.models_path,
+            rag_data_path=self.rag_data_path,
+            results_path=self.results_path,
+            embedding_model=self.embedding_model,
+            incremental_db=self.incremental_db,
+            embedding_cache=self.embedding_cache,
+            embed_batch_size=self.embed_batch_size,
+            embed_workers=self.embed_workers,
+            ingest_window=self.ingest_window,
+            document_loader=self.document_loader,
+            index_config=Index_Config(**self.index_config.to_dict()),
+            mmap_index=self.mmap_index,
+            rag_files=files,
+            top_k=self.top_k,
+            retrieval_mode=self.retrieval_mode,
+            lexical_shortcut=self.lexical_shortcut,
+            retrieval_cache_size=0,
+            prefix_cache=False,
+            llm_config=self.llm_config,
+            warm_snapshot=False,
+            device=self.device,
+            assist_log=False,
+            llm_verbose=self.llm_verbose,
+            )
+        shard.assist_log = self.assist_log
+
+        return shard
+
+
+    def __create_sharded_db(self,):
+        """Cria (ou atualiza) cada shard de forma independente e apaga os
+        shards que ficaram sem arquivos
+
+        Returns:
+            bool: True caso todos os shards tenham sido criados
+        """
+
+        groups = self.__shard_groups()
+        shard_config = load_shard_config(self.storage_path)
+        paths = shard_config["paths"] if shard_config else {}
+        sucess = True
+
+        for name, files in sorted(groups.items()):
             if self.assist_log:
-                # Caso log esteja ligado avisa sobre o carregamento com sucesso
-                print("VectorStore carregado a partir de:"+ self.storage_path)
-                # print(f"""Vector storage: {self.vectorstore}""") for debug
+                print(f"""Shard {name}: {len(files)} arquivos""")
 
-            # Retorna objeto de vetores previamente carregado no disco
-            return self.vectorstore
+            storage_path = shard_path(self.storage_path, name, shard_config)
+            sucess = self.__new_shard(name, files, storage_path=storage_path).__create_db() and sucess
 
-        except Exception as e:
+        # Pastas fora da configuracao (shards sem arquivos, ex: produto
+        # removido, e sobras de rebuild_shard) sao apagadas
+        folders = {paths.get(name, name) for name in groups}
+        shards_path = os.path.join(self.storage_path, SHARDS_DIR)
+        for folder in os.listdir(shards_path) if os.path.isdir(shards_path) else []:
+            if folder not in folders:
+                shutil.rmtree(os.path.join(shards_path, folder))
 
-            print(f""" --- Error reading documents or DB store ---
-                  (EN)
-                  Check your pip to understand if you have all langchain
-                  and llama CPP are installed correctly.
-                  
-                  On Windows systems is particulary complicated to install
-                  beautifulsoap4 and install llama-cpp-python, you may have
-                  to run CMAKE or install microsoft visual studio stuff
-                  
-                  (PT-BR)
-                  Verifique atraves do seu PIP se voce tem todos os imports
-                  de langchain e llama CPP instalados corretamente.
-                  
-                  No Windows temos problemas bem latentes e particulares
-                  para instalar o beuatifullsouap4 e o llama-cpp-python,
-                  voce provavelmente vai precisar rodar o CMAKE ou instalar
-                  as bibliotecas adicionas do microsoft visual studio
+        save_shard_config(self.storage_path, self.shard_by, self.shards, groups, paths)
 
-                  The raised error is:
-                  O erro encontrado e:
-                  {e}
-                  """)
+        return sucess
 
-            return False
 
+    def __get_sharded_db(self,):
+        """Carrega todos os shards gravados e monta a vectorstore dividida
 
-    def __generate_model(self,):
-        """Gera resposta utilizando o modelo escolhido e o contexto
-        RAG apresentado
+        Returns:
+            Sharded_Store: Vectorstore com os shards carregados
+        """
+
+        shard_config = load_shard_config(self.storage_path)
+
+        if shard_config is None:
+            raise ValueError(f"""Base sem shards em {self.storage_path}, crie a base com start_model(new_db=True)""")
+
+        shards = {}
+        for name in shard_config["names"]:
+            shard = self.__new_shard(name, storage_path=shard_path(self.storage_path, name, shard_config))
+            if shard.__get_db() is False:
+                raise ValueError(f"""Erro ao carregar o shard {name}""")
+            shards[name] = shard
+
+        with self.shards_lock:
+            self.shard_stores = shards
+            self.vectorstore = Sharded_Store(shards, self.shard_by, self.shards,
+                                             get_embedding_model(self.embedding_model, self.device))
+            self.index_version = self.__shards_version()
+
+        if self.shard_executor is None:
+            self.shard_executor = ThreadPoolExecutor(max_workers=self.shard_workers or max(1, len(shards)))
+
+        return self.vectorstore
+
+
+    def __shards_version(self,):
+        """Versao da base dividida: muda quando qualquer shard muda"""
+
+        digest = hashlib.sha256()
+        for name, shard in sorted(self.shard_stores.items()):
+            digest.update(f"""{name}:{shard.index_version};""".encode("utf-8"))
+
+        return digest.hexdigest()[:16]
+
+
+    def rebuild_shard(self, name):
+        """Recria um unico shard sem tirar a base do ar: o shard novo e
+        criado em uma pasta nova (reaproveitando o cache de embeddings do
+        atual), carregado dessa pasta e so entao entra no lugar do antigo.
+        Os arquivos do shard antigo nunca sao trocados enquanto ele esta em
+        uso: a pasta antiga so e apagada quando o objeto antigo e liberado
+        (buscas em andamento terminam no shard antigo).
+
+        Args:
+            name (str): Nome do shard (ver shard_stores)
 
         Returns:
-            str: Retorna um prompt em stream de uma pergunta feita 
-            ao modelo
+            bool: True caso o shard tenha sido recriado
         """
 
-        try:
-            self.llm = LlamaCpp(
-                #model_path = "./01_models/llama-2-7b-chat.Q5_K_M.gguf"
-                model_path = f"""{self.models_path}/{self.model_name}""", 
-                n_gpu_layers=1,
-                n_batch=2048,
-                n_ctx=2048,
-                f16_kv=True,
-                callback_manager=CallbackManager([StreamingStdOutCallbackHandler()]),
-                verbose=self.llm_verbose,
-                )
+        files = self.__shard_groups().get(name)
 
-            if self.device != "cpu":
-                # Variavel de utilizacao de GPU ou nao
-                self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if not files:
+            raise ValueError(f"""Shard sem arquivos: {name}""")
 
-            # Avisa sobre o modelo para o log
-            if self.assist_log: 
-                print("Modelo carregado e instanciado com sucesso")
+        shard_config = load_shard_config(self.storage_path)
+        current_path = shard_path(self.storage_path, name, shard_config)
 
-            return True
+        folder = f"""{name}.{time.strftime("%Y%m%d%H%M%S")}.{os.urandom(4).hex()}"""
+        building_path = os.path.join(self.storage_path, SHARDS_DIR, folder)
 
-        except Exception as e:
-            # Estamos capturando excessoes genericas de proposito
-            #nosso objetivo e que as excessoes estourem mesmo.
+        # Reaproveita os vetores ja calculados pelo shard atual
+        cache_path = os.path.join(current_path, EMBEDDING_CACHE_DIR)
+        if os.path.isdir(cache_path):
+            shutil.copytree(cache_path, os.path.join(building_path, EMBEDDING_CACHE_DIR))
 
-            print(e)
+        shard = self.__new_shard(name, files, storage_path=building_path)
+        shard.incremental_db = False
 
+        if not shard.__create_db():
+            shutil.rmtree(building_path, ignore_errors=True)
             return False
 
+        shard = self.__new_shard(name, storage_path=building_path)
+        if shard.__get_db() is False:
+            shutil.rmtree(building_path, ignore_errors=True)
+            return False
 
-    def start_model(self, new_db = True):
-        """Responsavel por inicializar o modelo de dados
+        # A configuracao aponta para a pasta nova antes da troca, assim um
+        # novo processo ja carrega o shard novo (e o shard novo, ex: produto
+        # adicionado, entra na lista de shards)
+        names = shard_config["names"] if shard_config else []
+        paths = dict(shard_config["paths"]) if shard_config else {}
+        paths[name] = folder
+        save_shard_config(self.storage_path, self.shard_by, self.shards, sorted(set(names) | {name}), paths)
+
+        with self.shards_lock:
+            old_shard = self.shard_stores.get(name)
+            self.shard_stores[name] = shard
+            self.index_version = self.__shards_version()
+
+        # A pasta antiga e apagada quando ninguem mais utiliza o shard antigo
+        if old_shard is not None:
+            weakref.finalize(old_shard, shutil.rmtree, current_path, True)
+        elif os.path.isdir(current_path):
+            shutil.rmtree(current_path, ignore_errors=True)
+
+        if self.assist_log:
+            print(f"""Shard {name} recriado""")
+
+        return True
+
+
+    def __fan_out(self, search, k, fuse = False):
+        """Roda uma busca em todos os shards em paralelo e une os top-k
 
         Args:
-            new_db (bool, optional): Cria banco de dados de documentos caso True. Padrao True.
+            search (function): search(shard) -> [(id, score), ...]
+            k (int): Quantidade de chunks
+            fuse (bool, optional): Une as listas de cada shard pela posicao
+                (reciprocal rank fusion), para scores que nao sao comparaveis
+                entre shards (BM25, o IDF e de cada shard). False ordena pela
+                distancia do FAISS. Padrao False.
+
+        Returns:
+            list: [(id, score), ...] dos k melhores entre todos os shards
         """
 
-        # Avisa o log sobre inicio do processo
-        if self.assist_log: 
-            print("Ligando os motores...")
+        with self.shards_lock:
+            shards = list(self.shard_stores.values())
 
-        # Constroi o banco de dados vetorizado
-        if new_db:
-            self.__create_db()
+        rankings = list(self.shard_executor.map(search, shards))
 
-        # Gera objeto da vector store
-        self.__get_db()
+        if fuse:
+            return reciprocal_rank_fusion(rankings, k)
 
-        # Cria modelo da LLM escolhida
-        self.__generate_model()
+        return sorted((item for ranking in rankings for item in ranking), key=lambda item: item[1])[:k]
 
-        # Devolve o banco em um objeto retriever
-        # retriever = self.vectorstore.as_retriver()
 
-        if self.assist_log:
-            print("Warmup do motor finalizado")
+    def __get_text_splitter(self,):
+        """Divisor de texto da ingestao, criado na primeira utilizacao
 
-        return self.vectorstore
+        Returns:
+            TextSplitter: Divisor de texto
+        """
 
+        if self.text_splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=120, chunk_overlap=0)
 
-    def answer_me(self,question):
-        """Metodo responsavel por responder perguntas"""
+        return self.text_splitter
 
-        prompt_template= """
-        ### [INST] 
-        Instructions: Answer in portuguese, and take the following context in mind:
 
-        {context}
+    def __ingest_settings(self,):
+        """Configuracoes da ingestao que definem os vetores da base,
+        gravadas no manifesto (mudar qualquer uma exige recriar a base)
 
-        ### Question to answer:
-        {question} 
+        Returns:
+            dict: Modelo de embedding, tamanho e sobreposicao dos chunks
+        """
 
-        [/INST]
+        text_splitter = self.__get_text_splitter()
+
+        return {"embedding_model": self.embedding_model,
+                "text_splitter": type(text_splitter).__name__,
+                "chunk_size": getattr(text_splitter, "_chunk_size", None),
+                "chunk_overlap": getattr(text_splitter, "_chunk_overlap", None)}
+
+
+    def __iter_chunks(self, file_names, manifest, hashes = None):
+        """Gerador que le um arquivo por vez e devolve os seus chunks um a
+        um, assim o texto lido de todos os arquivos nunca fica em memoria
+        de uma vez. Ao terminar
+        cada arquivo o hash e os ids dos chunks sao gravados no manifesto.
+
+        Args:
+            file_names (list): Nomes dos arquivos dentro da pasta de documentos
+            manifest (Storage_Manifest): Manifesto que vai ser preenchido
+            hashes (dict, optional): Hash ja calculado de cada arquivo. Padrao None.
+
+        Yields:
+            tuple: (chunk, id) com o Document do chunk e o seu id estavel
         """
 
-        # Abstraction of Prompt
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        #output_parser = StrOutputParser()
+        # Leitor e divisor de texto padrao, importados somente na ingestao. O
+        # atributo nao e alterado: ele faz parte da configuracao da base (snapshot)
+        # e e repassado para os shards
+        document_loader = self.document_loader
+        if document_loader is None:
+            from langchain.document_loaders import UnstructuredFileLoader
+            document_loader = UnstructuredFileLoader
 
-        # Criando a cadeia LLM
-        llm_chain = LLMChain(llm=self.llm, prompt=prompt)
+        self.__get_text_splitter()
 
-        # Cadeia de resposta RAG
-        rag_chain = ( 
-        {"context": self.vectorstore.as_retriever(), "question": RunnablePassthrough()}
-            | llm_chain
-        )
-        print("====================================")
-        print(question)
-        rag_chain.invoke(question)
-        print("\n====================================\n")
+        for file_name in file_names:
+            path = os.path.join(self.rag_data_path, file_name)
+            content_hash = hashes[file_name] if hashes else file_hash(path)
+
+            # Mesmo leitor utilizado por padrao pelo DirectoryLoader
+            loader = document_loader(path)
+
+            # Metadados estruturados do arquivo (produto, tipo de documento)
+            file_metadata = extract_metadata(file_name)
+
+            # Divide cada documento do arquivo em chunks, gerando ids estaveis
+            ids = []
+            for document in loader.load():
+                for text in self.text_splitter.split_documents([document]):
+                    text.metadata.update(file_metadata)
+
+                    # Posicao do chunk no arquivo, utilizada para unir vizinhos
+                    text.metadata["chunk"] = len(ids)
+                    ids.append(chunk_id(file_name, content_hash, len(ids)))
+                    yield text, ids[-1]
+
+            manifest.set_file(file_name, content_hash, ids)
+
+
+    def __iter_windows(self, chunks):
+        """Agrupa o gerador de chunks em janelas de tamanho limitado
+
+        Args:
+            chunks (iterable): Gerador de (chunk, id)
+
+        Yields:
+            list: Janela com ate 'ingest_window' pares (chunk, id)
+        """
+
+        window = []
+        for item in chunks:
+            window.append(item)
+            if len(window) >= self.ingest_window:
+                yield window
+                window = []
+
+        if window:
+            yield window
+
+
+    def __index_chunks(self, vector_database, embedding_function, chunks, lexical_index = None):
+        """Pipeline leitor -> divisor -> embedding -> indice em janelas de
+        tamanho limitado: cada janela e embedada em lotes e inserida no
+        FAISS de uma vez, depois descartada. A janela limita somente os
+        textos aguardando o embedding e os vetores de cada chamada ao
+        modelo, a base em si (indice, InMemoryDocstore com todos os chunks
+        e BM25) cresce com a pasta de documentos ate o __save_db.
+
+        Args:
+            vector_database (FAISS): Base existente ou None para criar uma nova
+            embedding_function: Modelo (ou pipeline) de embedding
+            chunks (iterable): Gerador de (chunk, id)
+            lexical_index (BM25_Index, optional): Indice lexico atualizado junto. Padrao None.
+
+        Returns:
+            tuple: (base FAISS, quantidade de chunks indexados)
+        """
+
+        from langchain.vectorstores import FAISS
+        from custom_libs.rag_embeddings import Cached_Embeddings
+
+        n_chunks = 0
+        elapsed = 0.0
+
+        for window in self.__iter_windows(chunks):
+            texts = [text.page_content for text, _ in window]
+            metadatas = [text.metadata for text, _ in window]
+            ids = [chunk for _, chunk in window]
+
+            # Embeda a janela em lotes
+            start = time.perf_counter()
+            vectors = embedding_function.embed_documents(texts)
+            elapsed += time.perf_counter() - start
+
+            # Insere a janela inteira no indice
+            if vector_database is None:
+                vector_database = FAISS.from_embeddings(list(zip(texts, vectors)), embedding_function,
+                                                        metadatas=metadatas, ids=ids)
+            else:
+                vector_database.add_embeddings(list(zip(texts, vectors)),
+                                               metadatas=metadatas, ids=ids)
+
+            # Indexa os mesmos chunks no indice lexico
+            if lexical_index is not None:
+                lexical_index.add(ids, texts)
+
+            # Descarrega os vetores novos do cache de embeddings a cada janela
+            if isinstance(embedding_function, Cached_Embeddings):
+                embedding_function.save()
+
+            n_chunks += len(window)
+
+        # Guarda a vazao da ultima ingestao
+        self.ingest_stats = {"chunks": n_chunks,
+                             "seconds": elapsed,
+                             "chunks_per_second": n_chunks / elapsed if elapsed else 0.0}
+
+        if self.assist_log and n_chunks:
+            print(f"""Embeddings: {n_chunks} chunks em {elapsed:.2f}s ({self.ingest_stats['chunks_per_second']:.1f} chunks/s)""")
+
+        return vector_database, n_chunks
+
+
+    def __build_db(self, embedding_function, manifest):
+        """Cria a base FAISS do zero com todos os arquivos da pasta de
+        documentos, gravando tambem o manifesto da base
+
+        Args:
+            embedding_function: Modelo de embedding utilizado na base
+            manifest (Storage_Manifest): Manifesto que vai ser preenchido
+
+        Returns:
+            bool: True caso a base tenha sido criada
+        """
+
+        # Lista os arquivos que vao ser lidos
+        file_names = self.__list_rag_files()
+
+        # Caso o log esteja ligado mostra os documentos carregados
+        if self.assist_log:
+            print(f"""Total de documentos encontrados: {len(file_names)} """)
+            print("Indexando...")
+
+        # Le, divide, embeda e indexa os arquivos em janelas (FAISS e BM25)
+        lexical_index = BM25_Index()
+        vector_database, n_chunks = self.__index_chunks(None, embedding_function,
+                                                        self.__iter_chunks(file_names, manifest),
+                                                        lexical_index)
+
+        if vector_database is None:
+            raise ValueError(f"""Nenhum chunk encontrado em {self.rag_data_path}""")
+
+        # Troca o indice flat da ingestao pelo indice configurado, treinado em
+        # uma amostra dos vetores, e compara os dois (recall x latencia)
+        flat_index = vector_database.index
+
+        if self.index_config.index_type != "flat":
+            vector_database.index = build_index(flat_index, self.index_config)
+
+            self.index_report = recall_report(flat_index, vector_database.index, self.index_config)
+
+            os.makedirs(self.storage_path, exist_ok=True)
+            with open(os.path.join(self.storage_path, INDEX_REPORT_FILE), "w", encoding="utf-8") as f:
+                json.dump(self.index_report, f, indent=1)
+
+            if self.assist_log:
+                for row in self.index_report:
+                    print(f"""Indice {row['param']}={row['value']}: recall {row['recall']:.3f} | {row['ms_per_query']:.3f} ms/consulta""")
+
+        # Base flat nao tem relatorio, descarta o de uma base anterior
+        elif os.path.isfile(os.path.join(self.storage_path, INDEX_REPORT_FILE)):
+            os.remove(os.path.join(self.storage_path, INDEX_REPORT_FILE))
+
+        # Tenta persistir a base de vetores, o tipo do indice e o manifesto
+        self.__save_db(vector_database, flat_index)
+        lexical_index.save(self.storage_path)
+        self.index_config.save(self.storage_path, ntotal=vector_database.index.ntotal,
+                               factory=self.index_config.factory_string(vector_database.index.ntotal))
+        manifest.save()
 
-        #return rag_chain
+        # Caso o log esteja ligado avisa sobre a persistencia do vetor
+        if self.assist_log:
+            print("Base de dados criada em: ", self.storage_path)
+
+        return True
+
+
+    def __update_db(self, embedding_function, manifest):
+        """Atualiza a base FAISS existente de forma incremental: arquivos
+        novos ou alterados sao embedados e inseridos, vetores de arquivos
+        alterados ou removidos sao apagados e o restante nao e tocado.
+
+        Args:
+            embedding_function: Modelo de embedding utilizado na base
+            manifest (Storage_Manifest): Manifesto ja carregado do disco
+
+        Returns:
+            bool: True caso a base tenha sido atualizada
+        """
+
+        # Calcula o hash atual de cada arquivo da pasta de documentos
+        current_hashes = {name: file_hash(os.path.join(self.rag_data_path, name))
+                          for name in self.__list_rag_files()}
+
+        # Compara com o manifesto para saber o que mudou
+        new_files, changed_files, removed_files = manifest.diff(current_hashes)
+
+        if self.assist_log:
+            print(f"""Arquivos novos: {len(new_files)} | alterados: {len(changed_files)} | removidos: {len(removed_files)}""")
+
+        # Nada mudou, a base em disco continua valida
+        if not (new_files or changed_files or removed_files):
+            if self.assist_log:
+                print("Base de dados ja esta atualizada em: ", self.storage_path)
+            return True
+
+        # Carrega a base FAISS existente
+        vector_database = self.__load_db(embedding_function, writable=True)
+
+        # Carrega o indice lexico, bases criadas antes dele sao indexadas aqui
+        lexical_index = BM25_Index.load(self.storage_path)
+        if lexical_index is None:
+            lexical_index = BM25_Index()
+            ids = list(vector_database.index_to_docstore_id.values())
+            lexical_index.add(ids, [vector_database.docstore.search(doc_id).page_content for doc_id in ids])
+
+        # Apaga os vetores de arquivos alterados ou removidos
+        stale_ids = []
+        for file_name in changed_files + removed_files:
+            stale_ids.extend(manifest.remove_file(file_name))
+
+        if stale_ids:
+            vector_database.delete(stale_ids)
+            lexical_index.remove(stale_ids)
+
+        # Embeda e insere somente os chunks de arquivos novos ou alterados
+        vector_database, n_chunks = self.__index_chunks(
+            vector_database, embedding_function,
+            self.__iter_chunks(new_files + changed_files, manifest, current_hashes),
+            lexical_index)
+
+        # Persiste a base atualizada, o indice lexico e o manifesto
+        self.__save_db(vector_database)
+        lexical_index.save(self.storage_path)
+        manifest.save()
+
+        if self.assist_log:
+            print(f"""Base de dados atualizada em: {self.storage_path} ({n_chunks} chunks novos, {len(stale_ids)} removidos)""")
+
+        return True
+
+
+    def __get_db(self,):
+        """Traz para memoria e deixa disponivel para a LLM ler
+        os arquivos indexados dentro do banco de dados local
+
+        Returns:
+            _type_: _description_
+        """
+
+        try:
+            # Base dividida em shards, carrega cada shard
+            if self.shards:
+                self.__get_sharded_db()
+
+                if self.assist_log:
+                    print(f"""VectorStore carregado a partir de {len(self.shard_stores)} shards em: {self.storage_path}""")
+
+                return self.vectorstore
+
+            # Carrega o modelo de embeddings (compartilhado com a criacao da base)
+            embeddings = get_embedding_model(self.embedding_model, self.device)
+
+            # Carrega a base FAISS
+            self.vectorstore = self.__load_db(embeddings)
+
+            # Versao da base carregada, utilizada como chave do cache de recuperacao
+            self.index_version = index_version(self.storage_path)
+
+            # Indices das particoes, bases antigas nao aceitam filtros
+            self.partitions = (Partitioned_Index(self.storage_path, mmap=self.mmap_index)
+                               if Partitioned_Index.exists(self.storage_path) else None)
+
+            # Indice lexico, carregado somente quando a busca utiliza o BM25
+            if self.retrieval_mode != "vector":
+                self.lexical_index = BM25_Index.load(self.storage_path)
+
+                if self.lexical_index is None:
+                    print("Indice BM25 nao encontrado, recrie a base para a busca lexica. Utilizando somente a busca vetorial")
+
+            # Parametros de busca do indice (nprobe no IVF, ef_search no HNSW)
+            set_search_params(self.vectorstore.index, self.index_config.nprobe, self.index_config.ef_search)
+
+            if self.assist_log:
+                # Caso log esteja ligado avisa sobre o carregamento com sucesso
+                print("VectorStore carregado a partir de:"+ self.storage_path)
+                # print(f"""Vector storage: {self.vectorstore}""") for debug
+
+            # Retorna objeto de vetores previamente carregado no disco
+            return self.vectorstore
+
+        except Exception as e:
+
+            print(f""" --- Error reading documents or DB store ---
+                  (EN)
+                  Check your pip to understand if you have all langchain
+                  and llama CPP are installed correctly.
+                  
+                  On Windows systems is particulary complicated to install
+                  beautifulsoap4 and install llama-cpp-python, you may have
+                  to run CMAKE or install microsoft visual studio stuff
+                  
+                  (PT-BR)
+                  Verifique atraves do seu PIP se voce tem todos os imports
+                  de langchain e llama CPP instalados corretamente.
+                  
+                  No Windows temos problemas bem latentes e particulares
+                  para instalar o beuatifullsouap4 e o llama-cpp-python,
+                  voce provavelmente vai precisar rodar o CMAKE ou instalar
+                  as bibliotecas adicionas do microsoft visual studio
+
+                  The raised error is:
+                  O erro encontrado e:
+                  {e}
+                  """)
+
+            return False
+
+
+    def __save_db(self, vector_database, flat_index = None):
+        """Persiste a base: indice FAISS no index.faiss, chunks no
+        armazenamento colunar (Chunk_Store), sem pickle, e um indice por
+        particao de metadados
+
+        Args:
+            vector_database (FAISS): Base de vetores
+            flat_index (faiss.Index, optional): Indice flat com os vetores
+                originais, None quando o indice da base ja e flat. Padrao None.
+        """
+
+        os.makedirs(self.storage_path, exist_ok=True)
+
+        write_index(vector_database.index, os.path.join(self.storage_path, "index.faiss"))
+        Chunk_Store.write(self.storage_path, vector_database)
+        Partitioned_Index.write(self.storage_path, flat_index or vector_database.index,
+                                Chunk_Store(self.storage_path))
+
+        # O docstore pickled de bases antigas deixa de ser utilizado
+        if os.path.isfile(os.path.join(self.storage_path, "index.pkl")):
+            os.remove(os.path.join(self.storage_path, "index.pkl"))
+
+
+    def __load_db(self, embeddings, writable = False):
+        """Carrega a base FAISS com o Chunk_Store como docstore: os chunks
+        sao lidos via memory-map e os Documents so sao criados para os
+        chunks recuperados. Com 'mmap_index' o indice tambem e lido via
+        memory-map somente leitura (ver rag_index.read_index).
+
+        Bases antigas (docstore pickled no index.pkl) sao carregadas pelo
+        load_local do langchain.
+
+        Args:
+            embeddings: Modelo de embedding da base
+            writable (bool, optional): Carrega um docstore editavel, utilizado
+                na atualizacao incremental. Padrao False.
+
+        Returns:
+            FAISS: Base de vetores
+        """
+
+        from langchain.vectorstores import FAISS
+
+        if not Chunk_Store.exists(self.storage_path):
+            if self.assist_log:
+                print("Base no formato antigo (index.pkl), recrie a base para utilizar o Chunk_Store")
+            return FAISS.load_local(self.storage_path, embeddings)
+
+        index = read_index(os.path.join(self.storage_path, "index.faiss"),
+                           mmap=self.mmap_index and not writable)
+        chunk_store = Chunk_Store(self.storage_path)
+
+        # Armazenamento de chunks fora de sincronia com o indice
+        if len(chunk_store) != index.ntotal:
+            raise ValueError(f"""Chunk_Store com {len(chunk_store)} chunks e indice com {index.ntotal} vetores, recrie a base""")
+
+        if writable:
+            from langchain.docstore.in_memory import InMemoryDocstore
+
+            documents, index_to_docstore_id = chunk_store.to_dict()
+            return FAISS(embeddings, index, InMemoryDocstore(documents), index_to_docstore_id)
+
+        if self.assist_log and self.mmap_index:
+            print(f"""Base aberta via memory-map: {index.ntotal} vetores""")
+
+        return FAISS(embeddings, index, chunk_store, chunk_store.index_to_docstore_id())
+
+
+    def __generate_model(self,):
+        """Gera resposta utilizando o modelo escolhido e o contexto
+        RAG apresentado
+
+        Returns:
+            str: Retorna um prompt em stream de uma pergunta feita 
+            ao modelo
+        """
+
+        try:
+            # Modelo padrao do objeto, fixado no pool para nunca ser descarregado
+            self.llm = self.llm_pool.get(self.model_name, pin=True)
+
+            # Avalia o prefixo fixo do prompt uma unica vez na carga do modelo
+            # (ou restaura o estado gravado no snapshot de warm start)
+            if self.prefix_cache:
+                self.start_stats["prefix_state"] = self.__warm_prefix(self.llm)
+
+            # Avisa sobre o modelo para o log
+            if self.assist_log: 
+                print("Modelo carregado e instanciado com sucesso")
+
+            return True
+
+        except Exception as e:
+            # Estamos capturando excessoes genericas de proposito
+            #nosso objetivo e que as excessoes estourem mesmo.
+
+            print(e)
+
+            return False
+
+
+    def __load_llm(self, model_name, params):
+        """Carrega um modelo GGUF com o llama.cpp (factory do pool de LLMs)
+
+        Args:
+            model_name (str): Nome do arquivo do modelo dentro da pasta de modelos
+            params (dict): Parametros de carga que sobrescrevem os padroes
+
+        Returns:
+            LlamaCpp: Modelo carregado
+        """
+
+        from langchain.llms import LlamaCpp
+
+        # Parametros de execucao do objeto, sobrescritos pelos do pool
+        load_params = self.llm_config.to_params()
+        load_params.update(params)
+
+        return LlamaCpp(
+            #model_path = "./01_models/llama-2-7b-chat.Q5_K_M.gguf"
+            model_path = f"""{self.models_path}/{model_name}""",
+            verbose=self.llm_verbose,
+            **load_params,
+            )
+
+
+    def __warm_prefix(self, llm):
+        """Restaura o estado do prefixo gravado no snapshot de warm start,
+        caso seja do mesmo modelo e configuracao, ou avalia o prefixo
+
+        Args:
+            llm: LLM do langchain
+
+        Returns:
+            str: "restored", "evaluated" ou None caso o modelo nao exponha o
+            estado do llama.cpp
+        """
+
+        if not self.prefix_cache.supports(llm):
+            return None
+
+        if self.warm_snapshot and self.warm_snapshot.prefix_fresh(self.__prefix_key()):
+            try:
+                if self.prefix_cache.load_state(llm, self.warm_snapshot.prefix_path):
+                    return "restored"
+            except Exception as e:
+                print(f"""Estado do prefixo nao restaurado, avaliando novamente: {e}""")
+
+        self.prefix_cache.warm(llm)
+
+        return "evaluated"
+
+
+    def __prefix_key(self,):
+        """Chave do estado do prefixo: arquivo do modelo, parametros do
+        llama.cpp, texto do prefixo e versao do llama-cpp-python"""
+
+        return {"model_name": self.model_name,
+                "model_file": file_identity(f"""{self.models_path}/{self.model_name}"""),
+                "llm_config": self.llm_config.to_params(),
+                "prefix": self.prefix_cache.prefix,
+                "llama_cpp": getattr(sys.modules.get("llama_cpp"), "__version__", None)}
+
+
+    def __db_config(self,):
+        """Configuracao que define o conteudo da base, mudar qualquer valor
+        exige recriar a base"""
+
+        return {"embedding_model": self.embedding_model,
+                "index_config": self.index_config.to_dict(),
+                "shards": self.shards,
+                "shard_by": self.shard_by,
+                "rag_files": sorted(self.rag_files) if self.rag_files is not None else None,
+                "document_loader": self.document_loader}
+
+
+    def __save_snapshot(self, db_config, data_version, ready_seconds):
+        """Grava o snapshot de warm start e, caso ainda nao esteja no disco,
+        o estado do prefixo do modelo padrao
+
+        Args:
+            db_config (dict): Saida do __db_config
+            data_version (str): Versao dos documentos lida antes da criacao da base
+            ready_seconds (float): Tempo do start_model (s)
+        """
+
+        llm_key = None
+
+        if self.prefix_cache and self.llm is not None and self.prefix_cache.supports(self.llm):
+            llm_key = self.__prefix_key()
+
+            if not self.warm_snapshot.prefix_fresh(llm_key):
+                try:
+                    saved = self.prefix_cache.save_state(self.llm, self.warm_snapshot.prefix_path)
+                except Exception as e:
+                    print(f"""Erro ao gravar o estado do prefixo: {e}""")
+                    saved = False
+
+                llm_key = llm_key if saved else None
+
+        try:
+            self.warm_snapshot.save(requested=self.requested_config,
+                                    resolved={"device": self.device, "llm_config": self.llm_config.to_dict()},
+                                    db_config=db_config,
+                                    data_version=data_version,
+                                    db_version=storage_version(self.storage_path),
+                                    llm_key=llm_key,
+                                    ready_seconds=ready_seconds)
+        except OSError as e:
+            print(f"""Erro ao gravar o snapshot de warm start: {e}""")
+
+
+    def start_model(self, new_db = True, force_rebuild = False):
+        """Responsavel por inicializar o modelo de dados
+
+        Com o 'warm_snapshot' ligado a criacao da base e pulada quando a
+        configuracao da base, os documentos (nome, tamanho e data) e a base
+        gravada sao os mesmos do ultimo start. Os tempos de cada fase e o
+        tempo ate ficar pronto (ready_seconds) ficam em start_stats.
+
+        Args:
+            new_db (bool, optional): Cria banco de dados de documentos caso True. Padrao True.
+                Com 'incremental_db' ligado a base existente e apenas atualizada.
+            force_rebuild (bool, optional): Cria a base mesmo com o snapshot valido
+                (implica new_db). Padrao False.
+        """
+
+        start = time.perf_counter()
+        self.start_stats = {}
+
+        # Avisa o log sobre inicio do processo
+        if self.assist_log: 
+            print("Ligando os motores...")
+
+        # Compara o snapshot com a configuracao, os documentos e a base atuais
+        # (somente stats de arquivos, nada e lido ou embedado)
+        db_config = self.__db_config()
+        data_version = (data_fingerprint(self.rag_data_path, self.__list_rag_files())
+                        if self.warm_snapshot and os.path.isdir(self.rag_data_path) else None)
+        snapshot_hit = (bool(self.warm_snapshot) and not force_rebuild
+                        and self.warm_snapshot.is_fresh(db_config, data_version,
+                                                        storage_version(self.storage_path)))
+        new_db = new_db or force_rebuild
+
+        # Constroi o banco de dados vetorizado, a menos que nada tenha mudado.
+        # Sem criar a base, nada garante que ela corresponde aos documentos
+        # atuais, entao o snapshot so e gravado depois de uma criacao com
+        # sucesso ou quando o snapshot ja era valido
+        db_created = False
+        if new_db and snapshot_hit:
+            if self.assist_log:
+                print("Criacao da base pulada: snapshot de warm start valido "
+                      "(configuracao, documentos e base sem mudancas), use force_rebuild=True para recriar")
+        elif new_db:
+            phase = time.perf_counter()
+            db_created = self.__create_db()
+            self.start_stats["create_db_seconds"] = time.perf_counter() - phase
+
+        # Gera objeto da vector store
+        phase = time.perf_counter()
+        self.__get_db()
+        self.start_stats["load_db_seconds"] = time.perf_counter() - phase
+
+        # Cria modelo da LLM escolhida
+        phase = time.perf_counter()
+        self.__generate_model()
+        self.start_stats["load_llm_seconds"] = time.perf_counter() - phase
+
+        # Monta a cadeia RAG uma unica vez (reaproveitada em answer_me)
+        if self.vectorstore and self.llm:
+            self.__get_chain()
+
+        # Cria o cache de respostas com o mesmo modelo de embedding da base
+        if self.use_answer_cache and self.answer_cache is None:
+            self.answer_cache = Answer_Cache(
+                embedding_function=get_embedding_model(self.embedding_model, self.device),
+                threshold=self.answer_cache_threshold,
+                ttl=self.answer_cache_ttl,
+                max_size=self.answer_cache_size,
+                path=self.answer_cache_path,
+                )
+
+        ready_seconds = time.perf_counter() - start
+        self.start_stats.update({"ready_seconds": ready_seconds,
+                                 "snapshot_hit": snapshot_hit,
+                                 "db_rebuilt": new_db and not snapshot_hit})
+        self.metrics.observe("ready_seconds", ready_seconds)
+
+        # Grava o snapshot somente de um start com a base criada (ou ja valida) e carregada
+        if self.warm_snapshot and (db_created or snapshot_hit) and self.vectorstore is not None:
+            self.__save_snapshot(db_config, data_version, ready_seconds)
+
+        if self.assist_log:
+            print(f"""Warmup do motor finalizado, pronto em {ready_seconds:.2f}s (snapshot: {"hit" if snapshot_hit else "miss"})""")
+
+        return self.vectorstore
+
+
+    def set_search_params(self, nprobe = None, ef_search = None):
+        """Ajusta em tempo de consulta o compromisso recall x latencia do
+        indice: listas visitadas no IVF e candidatos visitados no HNSW
+
+        Args:
+            nprobe (int, optional): Listas visitadas nos indices IVF. Padrao None.
+            ef_search (int, optional): Candidatos visitados no HNSW. Padrao None.
+        """
+
+        if nprobe is not None:
+            self.index_config.nprobe = nprobe
+        if ef_search is not None:
+            self.index_config.ef_search = ef_search
+        self.index_config.validate()
+
+        if self.shards:
+            for shard in self.shard_stores.values():
+                shard.set_search_params(nprobe, ef_search)
+        elif self.vectorstore:
+            set_search_params(self.vectorstore.index, nprobe, ef_search)
+
+        # Buscas guardadas com os parametros antigos deixam de valer
+        self.retrieval_cache.clear()
+
+
+    def get_index_report(self,):
+        """Relatorio recall x latencia da ultima criacao da base
+
+        Returns:
+            list: [{"param", "value", "recall", "ms_per_query"}, ...] ou None
+            caso o indice seja flat
+        """
+
+        path = os.path.join(self.storage_path, INDEX_REPORT_FILE)
+
+        if self.index_report is None and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.index_report = json.load(f)
+
+        return self.index_report
+
+
+    def get_metrics(self, format = "summary"):
+        """Percentis de cada etapa das chamadas feitas ate agora
+
+        Args:
+            format (str, optional): "summary" (dict com count, mean, p50, p95,
+                p99 e max por etapa) ou "prometheus" (texto de exposicao). Padrao "summary".
+
+        Returns:
+            dict | str: Metricas no formato pedido
+        """
+
+        if format == "prometheus":
+            return self.metrics.prometheus()
+
+        if format != "summary":
+            raise ValueError(f"""format deve ser "summary" ou "prometheus", recebido: {format}""")
+
+        return self.metrics.summary()
+
+
+    def __search(self, question, k, filters = None, vector = None):
+        """Busca os k chunks da pergunta conforme o 'retrieval_mode'. No
+        modo hybrid a busca lexica roda primeiro: caso a resposta seja
+        obvia (is_exact_match) o modelo de embedding nem e chamado, senao
+        as duas listas sao unidas por reciprocal rank fusion.
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks recuperados
+            filters (dict, optional): Metadado -> valor (ou lista de valores). Padrao None.
+            vector (np.ndarray, optional): Pergunta ja embedada, shape (1, dim). Padrao None.
+
+        Returns:
+            list: [(id, score), ...] em ordem de relevancia
+        """
+
+        if self.shards:
+            lexical_ready = any(shard.lexical_index is not None for shard in self.shard_stores.values())
+        else:
+            lexical_ready = self.lexical_index is not None
+
+        if self.retrieval_mode == "vector" or not lexical_ready:
+            return self.__vector_search(question, k, filters, vector)
+
+        lexical = self.__lexical_search(question, k, filters)
+
+        if self.retrieval_mode == "lexical":
+            return lexical
+
+        if self.lexical_shortcut and self.__is_exact_match(question, lexical, filters):
+            return lexical
+
+        return reciprocal_rank_fusion([self.__vector_search(question, k, filters, vector), lexical], k)
+
+
+    def __is_exact_match(self, question, lexical, filters = None):
+        """Atalho da busca lexica, avaliado pelo indice BM25 dono do melhor
+        chunk. Com shards a lista unida tem scores RRF, entao o shard dono
+        avalia a sua propria lista BM25 (os dois primeiros chunks)"""
+
+        if not lexical:
+            return False
+
+        if self.shards:
+            owner = self.shard_stores.get(shard_name(lexical[0][0].split(":")[0], self.shard_by, self.shards))
+
+            return (owner is not None and owner.lexical_index is not None
+                    and owner.__is_exact_match(question, owner.__lexical_search(question, 2, filters)))
+
+        return (self.lexical_index is not None
+                and self.lexical_index.is_exact_match(question, lexical, ratio=self.lexical_shortcut))
+
+
+    def __lexical_search(self, question, k, filters = None):
+        """Busca BM25, com filtro somente os chunks das particoes pedidas
+        (linhas do Partitioned_Index) recebem score
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks recuperados
+            filters (dict, optional): Metadado -> valor (ou lista de valores). Padrao None.
+
+        Returns:
+            list: [(id, score), ...] em ordem de relevancia
+        """
+
+        # Base dividida: cada shard busca no seu BM25 e as listas sao unidas
+        # pela posicao (o IDF de cada shard e diferente)
+        if self.shards:
+            with self.metrics.stage("search"):
+                return self.__fan_out(lambda shard: shard.__lexical_search(question, k, filters)
+                                      if shard.lexical_index is not None else [], k, fuse=True)
+
+        if not filters:
+            with self.metrics.stage("search"):
+                return self.lexical_index.search(question, k)
+
+        if self.partitions is None:
+            raise ValueError("Base sem indices por particao, recrie a base para utilizar filtros")
+
+        with self.metrics.stage("search"):
+            ids = {self.vectorstore.index_to_docstore_id[int(row)] for row in self.partitions.rows(filters)}
+
+            return self.lexical_index.search(question, k, ids)
+
+
+    def __vector_search(self, question, k, filters = None, vector = None):
+        """Busca os k chunks mais proximos da pergunta direto no indice
+        FAISS, devolvendo os ids do docstore. Com filtro a busca roda
+        somente nos indices das particoes pedidas.
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks recuperados
+            filters (dict, optional): Metadado -> valor (ou lista de valores). Padrao None.
+            vector (np.ndarray, optional): Pergunta ja embedada, shape (1, dim). Padrao None.
+
+        Returns:
+            list: [(id, score), ...] em ordem de proximidade
+        """
+
+        import numpy as np
+
+        if vector is None:
+            with self.metrics.stage("embedding"):
+                vector = np.asarray([self.vectorstore.embedding_function.embed_query(question)],
+                                    dtype=np.float32)
+
+        # Base dividida: a pergunta e embedada uma vez e buscada em todos os shards
+        if self.shards:
+            with self.metrics.stage("search"):
+                return self.__fan_out(lambda shard: shard.__vector_search(question, k, filters, vector), k)
+
+        if filters:
+            if self.partitions is None:
+                raise ValueError("Base sem indices por particao, recrie a base para utilizar filtros")
+
+            with self.metrics.stage("search"):
+                return [(self.vectorstore.index_to_docstore_id[row], score)
+                        for row, score in self.partitions.search(vector, k, filters)]
+
+        with self.metrics.stage("search"):
+            scores, rows = self.vectorstore.index.search(vector, k)
+
+        return [(self.vectorstore.index_to_docstore_id[int(row)], float(score))
+                for score, row in zip(scores[0], rows[0]) if row != -1]
+
+
+    def retrieve(self, question, k = None, filters = None, vector = None):
+        """Recupera os chunks de contexto de uma pergunta, consultando o
+        cache de recuperacao antes do modelo de embedding e do FAISS
+
+        e.g:
+            retrieve("Qual a dose?", filters={"product": "LANNATE", "doc_type": "leaflet"})
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            k (int, optional): Quantidade de chunks, None utiliza 'top_k'. Padrao None.
+            filters (dict, optional): Metadado (product, doc_type) -> valor ou
+                lista de valores, a busca roda somente nessas particoes. Padrao None.
+            vector (np.ndarray, optional): Pergunta ja embedada pelo cache de
+                respostas (embed_query), reaproveitada quando o cache e a base
+                usam o mesmo modelo de embedding. Padrao None.
+
+        Returns:
+            list: Documents recuperados em ordem de proximidade
+        """
+
+        k = k or self.top_k
+        version = self.__retrieval_version(filters)
+
+        with self.metrics.stage("retrieval"):
+            results = self.retrieval_cache.get(version, question, k)
+
+            if results is None:
+                results = self.__search(question, k, filters, self.__query_vector(vector))
+                self.retrieval_cache.put(version, question, k, results)
+
+            documents = [self.vectorstore.docstore.search(doc_id) for doc_id, _ in results]
+
+        self.metrics.set(retrieved_chunks=len(documents))
+
+        return documents
+
+
+    def __query_vector(self, vector):
+        """Vetor da pergunta calculado pelo cache de respostas no formato da
+        busca (shape (1, dim)), ou None quando o cache usa outro modelo de
+        embedding e a pergunta precisa ser embedada de novo"""
+
+        import numpy as np
+
+        if (vector is None or not self.answer_cache
+                or self.answer_cache.embedding_function is not self.vectorstore.embedding_function):
+            return None
+
+        return np.asarray([vector], dtype=np.float32)
+
+
+    def __retrieval_version(self, filters = None):
+        """Chave de versao do cache de recuperacao: versao da base e, caso
+        exista, o filtro de metadados da busca"""
+
+        if not filters:
+            return self.index_version
+
+        return f"""{self.index_version}|{json.dumps(filters, sort_keys=True)}"""
+
+
+    def __retrieve_many(self, questions, k, filters, vectors = None):
+        """Recupera os chunks de varias perguntas de uma vez: as perguntas
+        fora do cache de recuperacao sao embedadas juntas (embed_queries) e, na
+        busca vetorial sem filtro e sem shards, buscadas no FAISS com uma
+        unica chamada (matriz de perguntas)
+
+        Args:
+            questions (list): Perguntas
+            k (int): Quantidade de chunks por pergunta
+            filters (list): Filtro de metadados de cada pergunta (ou None)
+            vectors (list, optional): Vetor de cada pergunta calculado pelo
+                cache de respostas (ou None), perguntas com vetor nao sao
+                embedadas de novo. Padrao None.
+
+        Returns:
+            list: Documents recuperados de cada pergunta, na ordem de entrada
+        """
+
+        import numpy as np
+
+        from custom_libs.rag_embeddings import embed_queries
+
+        versions = [self.__retrieval_version(question_filters) for question_filters in filters]
+        results = [self.retrieval_cache.get(version, question, k)
+                   for version, question in zip(versions, questions)]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            # Embeda todas as perguntas que faltam (em lote quando o modelo
+            # permite), com os mesmos vetores do embed_query do retrieve
+            known = [self.__query_vector(None if vectors is None else vectors[i]) for i in missing]
+            vectors = None
+            if self.retrieval_mode != "lexical":
+                unknown = [j for j, vector in enumerate(known) if vector is None]
+                if unknown:
+                    with self.metrics.stage("embedding"):
+                        embedded = embed_queries(self.vectorstore.embedding_function,
+                                                 [questions[missing[j]] for j in unknown])
+                    for j, vector in zip(unknown, embedded):
+                        known[j] = np.asarray([vector], dtype=np.float32)
+
+                vectors = np.concatenate(known)
+
+            if self.retrieval_mode == "vector" and not self.shards and not any(filters[i] for i in missing):
+                # Uma unica busca no FAISS para o lote inteiro
+                with self.metrics.stage("search"):
+                    scores, rows = self.vectorstore.index.search(vectors, k)
+                for j, i in enumerate(missing):
+                    results[i] = [(self.vectorstore.index_to_docstore_id[int(row)], float(score))
+                                  for score, row in zip(scores[j], rows[j]) if row != -1]
+            else:
+                for j, i in enumerate(missing):
+                    results[i] = self.__search(questions[i], k, filters[i],
+                                               None if vectors is None else vectors[j:j + 1])
+
+            for i in missing:
+                self.retrieval_cache.put(versions[i], questions[i], k, results[i])
+
+        return [[self.vectorstore.docstore.search(doc_id) for doc_id, _ in result]
+                for result in results]
+
+
+    def infer_filters(self, question):
+        """Com 'auto_filter' ligado, filtra pelo produto quando a pergunta
+        cita exatamente um produto da base
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+
+        Returns:
+            dict: {"product": produto} ou None
+        """
+
+        partitions = ([shard.partitions for shard in self.shard_stores.values()] if self.shards
+                      else [self.partitions])
+        partitions = [partition for partition in partitions if partition is not None]
+
+        if not (self.auto_filter and partitions):
+            return None
+
+        words = set(normalize_question(question).split())
+        products = sorted({product for partition in partitions for product in partition.values("product")
+                           if normalize_question(product) in words})
+
+        return {"product": products[0]} if len(products) == 1 else None
+
+
+    def __context(self, question, model = None, filters = None, vector = None):
+        """Recupera e monta o contexto de uma pergunta. Com o empacotamento
+        ligado sao recuperados 'context_candidates' chunks, duplicatas sao
+        removidas, vizinhos do mesmo arquivo sao unidos e o contexto e
+        preenchido ate o orcamento de tokens do modelo.
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados, None utiliza o
+                infer_filters. Padrao None.
+            vector (np.ndarray, optional): Vetor da pergunta devolvido pelo
+                __cached_answer (ver retrieve). Padrao None.
+
+        Returns:
+            list: Documents que vao no contexto do prompt
+        """
+
+        if filters is None:
+            filters = self.infer_filters(question)
+
+        if not self.context_packing:
+            return self.retrieve(question, filters=filters, vector=vector)
+
+        return self.__pack(question, self.retrieve(question, k=self.context_candidates, filters=filters,
+                                                   vector=vector), model)
+
+
+    def __pack(self, question, docs, model = None):
+        """Empacota os chunks recuperados no orcamento de tokens do modelo
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            docs (list): Documents recuperados em ordem de relevancia
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+
+        Returns:
+            list: Documents que vao no contexto do prompt
+        """
+
+        with self.metrics.stage("prompt_build"):
+            return self.__pack_budget(question, docs, model)
+
+
+    def __pack_budget(self, question, docs, model = None):
+        """Calcula o orcamento de tokens e empacota o contexto (ver __pack)"""
+
+        llm = self.llm if model is None else self.llm_pool.get(model)
+        count_tokens = llm_token_counter(llm)
+
+        # Orcamento: contexto do modelo menos o prompt sem contexto e a resposta
+        token_budget = self.context_token_budget
+        if token_budget is None:
+            n_ctx = getattr(llm, "n_ctx", None) or self.llm_config.n_ctx
+            max_tokens = getattr(llm, "max_tokens", None) or 256
+            prompt_tokens = count_tokens(PROMPT_TEMPLATE.format(context="", question=question))
+            token_budget = max(0, n_ctx - max_tokens - prompt_tokens)
+
+        packer = Context_Packer(count_tokens, dedupe_threshold=self.context_dedupe_threshold)
+
+        return packer.pack(docs, token_budget)
+
+
+    def __drop_model_chain(self, model_name, params):
+        """Solta a cadeia de um modelo descarregado do pool (on_evict), para
+        que o modelo possa ser liberado da memoria
+
+        Args:
+            model_name (str): Nome do modelo descarregado
+            params (dict): Parametros de carga do modelo
+        """
+
+        # As cadeias por modelo sao montadas somente com os parametros padrao
+        if not params:
+            self.model_chains.pop(model_name, None)
+
+
+    def __get_chain(self, model = None):
+        """Retorna a cadeia de geracao (prompt + LLM + parser) do objeto,
+        montando apenas na primeira utilizacao. A cadeia so e montada de
+        novo quando a vector store ou a LLM forem trocadas.
+
+        Args:
+            model (str, optional): Modelo do pool que vai responder, None
+                utiliza o modelo padrao do objeto. Padrao None.
+
+        Returns:
+            Runnable: Cadeia que recebe {"context", "question"} e devolve texto
+        """
+
+        from langchain.prompts import PromptTemplate
+        from langchain_core.output_parsers import StrOutputParser
+
+        # Outro modelo do pool, cada um com a sua cadeia
+        if model is not None:
+            llm = self.llm_pool.get(model)
+            chain_llm, chain = self.model_chains.get(model, (None, None))
+
+            if chain_llm is not llm:
+                chain = PromptTemplate.from_template(PROMPT_TEMPLATE) | llm | StrOutputParser()
+                self.model_chains[model] = (llm, chain)
+
+            return chain
+
+        if (self.rag_chain is None
+                or self.chain_llm is not self.llm
+                or self.chain_vectorstore is not self.vectorstore):
+
+            # Abstraction of Prompt
+            prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
+
+            # Cadeia de geracao, o contexto e recuperado antes para que as
+            # fontes possam ser devolvidas junto com a resposta
+            self.rag_chain = prompt | self.llm | StrOutputParser()
+
+            # Guarda com quais objetos a cadeia foi montada
+            self.chain_llm = self.llm
+            self.chain_vectorstore = self.vectorstore
+
+        return self.rag_chain
+
+
+    def __chain_inputs(self, question, sources):
+        """Monta as variaveis do prompt a partir dos chunks recuperados
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            sources (list): Documents recuperados
+
+        Returns:
+            dict: {"context", "question"}
+        """
+
+        return {"context": "\n\n".join(doc.page_content for doc in sources),
+                "question": question}
+
+
+    def __route(self, model):
+        """Normaliza o modelo pedido: None para o modelo padrao do objeto
+
+        Args:
+            model (str): Nome do modelo pedido
+
+        Returns:
+            str: Nome do modelo do pool ou None para o modelo padrao
+        """
+
+        return None if model in (None, self.model_name) else model
+
+
+    def __cached_answer(self, question, model = None, filters = None):
+        """Consulta o cache de respostas (somente para o modelo padrao e
+        perguntas sem filtro explicito)
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca. Padrao None.
+
+        Returns:
+            tuple: ({"answer", "sources"} ou None caso nao exista, vetor da
+            pergunta calculado pelo cache ou None), o vetor segue para a
+            recuperacao e para o __cache_answer sem embedar a pergunta de novo
+        """
+
+        if not (self.answer_cache and model is None and not filters):
+            return None, None
+
+        cached, vector = self.answer_cache.lookup(question, version=self.index_version)
+
+        if cached is None:
+            return None, vector
+
+        from langchain_core.documents import Document
+
+        return {"answer": cached["answer"],
+                "sources": [Document(**source) for source in cached["sources"]]}, vector
+
+
+    def __cache_answer(self, question, answer, sources, model = None, filters = None, vector = None):
+        """Guarda uma resposta do modelo padrao no cache de respostas (caso ligado)"""
+
+        if self.answer_cache and model is None and not filters:
+            self.answer_cache.put(question, {
+                "answer": answer,
+                "sources": [{"page_content": doc.page_content, "metadata": doc.metadata}
+                            for doc in sources],
+                }, version=self.index_version, vector=vector)
+
+
+    def answer(self, question, model = None, filters = None):
+        """Responde uma pergunta devolvendo o texto (sem imprimir nada)
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            model (str, optional): Modelo do pool que vai responder (ex:
+                "vicuna-13b-v1.5-16k.Q5_K_S.gguf"), carregado sob demanda sem
+                descarregar os demais. None utiliza o modelo padrao. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca (ver retrieve). Padrao None.
+
+        Returns:
+            dict: {"answer": texto da resposta, "sources": Documents utilizados,
+            "timings": tempo de cada etapa da chamada (ver Pipeline_Metrics)}
+        """
+
+        model = self.__route(model)
+
+        with self.metrics.trace() as record:
+            # Consulta o cache de respostas antes de rodar a LLM
+            result, vector = self.__cached_answer(question, model, filters)
+            record["cached"] = result is not None
+
+            if result is None:
+                result = self.__generate(question, self.__context(question, model, filters, vector),
+                                         model, filters, timings=record, vector=vector)
+
+        result["timings"] = record
+
+        return result
+
+
+    def answer_many(self, questions, model = None, filters = None):
+        """Responde uma lista de perguntas (ex: conjuntos de avaliacao)
+        compartilhando o trabalho entre elas:
+
+        - as perguntas fora dos caches sao embedadas juntas (mesmos vetores do
+          embed_query) e buscadas com uma unica chamada ao FAISS;
+        - a geracao roda em ordem alfabetica do contexto, entao perguntas
+          com o mesmo contexto (ou o mesmo inicio de contexto) rodam em
+          sequencia e o llama.cpp so avalia os tokens que mudaram.
+
+        Args:
+            questions (list): Perguntas
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados aplicado a todas as
+                perguntas, None utiliza o infer_filters de cada uma. Padrao None.
+
+        Returns:
+            list: {"answer", "sources", "timings"} de cada pergunta, na
+            ordem de entrada (o tempo das etapas em lote, embedding, search e
+            retrieval, e dividido entre as perguntas do lote)
+        """
+
+        model = self.__route(model)
+        results = [None] * len(questions)
+        records = {}
+
+        # Perguntas ja respondidas saem direto do cache de respostas
+        pending = []
+        vectors = {}
+        for i, question in enumerate(questions):
+            records[i] = self.metrics.start()
+
+            with self.metrics.bind(records[i]):
+                cached, vectors[i] = self.__cached_answer(question, model, filters)
+
+            records[i]["cached"] = cached is not None
+
+            if cached is None:
+                pending.append(i)
+            else:
+                results[i] = dict(cached, timings=self.metrics.finish(records[i]))
+
+        if not pending:
+            return results
+
+        # Recuperacao em lote, medida em um registro unico
+        question_filters = [filters if filters is not None else self.infer_filters(questions[i])
+                            for i in pending]
+        k = self.context_candidates if self.context_packing else self.top_k
+
+        batch = {}
+        with self.metrics.bind(batch), self.metrics.stage("retrieval"):
+            retrieved = self.__retrieve_many([questions[i] for i in pending], k, question_filters,
+                                             [vectors[i] for i in pending])
+
+        contexts = {}
+        for i, docs in zip(pending, retrieved):
+            records[i].update({name: seconds / len(pending) for name, seconds in batch.items()})
+            records[i]["retrieved_chunks"] = len(docs)
+
+            with self.metrics.bind(records[i]):
+                contexts[i] = self.__pack(questions[i], docs, model) if self.context_packing else docs
+
+        # Geracao agrupada pelo contexto, que e o inicio do prompt depois do prefixo fixo
+        order = sorted(pending, key=lambda i: self.__chain_inputs(questions[i], contexts[i])["context"])
+
+        for i in order:
+            results[i] = self.__generate(questions[i], contexts[i], model, filters, timings=records[i],
+                                         vector=vectors[i])
+            results[i]["timings"] = self.metrics.finish(records[i])
+
+        return results
+
+
+    def __generate(self, question, sources, model = None, filters = None, timings = None, vector = None):
+        """Roda a LLM para uma pergunta com o contexto ja recuperado
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            sources (list): Documents recuperados
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca. Padrao None.
+            timings (dict, optional): Registro que recebe os tempos da geracao. Padrao None.
+            vector (np.ndarray, optional): Vetor da pergunta devolvido pelo
+                __cached_answer, guardado no cache junto com a resposta. Padrao None.
+
+        Returns:
+            dict: {"answer": texto da resposta, "sources": Documents utilizados}
+        """
+
+        timings = {} if timings is None else timings
+        answer = "".join(self.__stream_tokens(question, sources, model, timings))
+
+        self.__cache_answer(question, answer, sources, model, filters, vector)
+
+        return {"answer": answer, "sources": sources, "timings": timings}
+
+
+    def __stream_tokens(self, question, sources, model, timings, stop_event = None):
+        """Roda a LLM em stream medindo a avaliacao do prompt (tempo ate o
+        primeiro token) e a geracao
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            sources (list): Documents recuperados
+            model (str): Modelo do pool que vai responder (None = padrao)
+            timings (dict): Recebe os tempos da chamada ao final do stream
+            stop_event (threading.Event, optional): Interrompe a geracao (e libera
+                o llm_lock) no proximo token quando setado. Padrao None.
+
+        Yields:
+            str: Pedacos (tokens) da resposta
+        """
+
+        llm = self.llm if model is None else self.llm_pool.get(model)
+
+        with self.metrics.bind(timings), self.metrics.stage("prompt_build"):
+            inputs = self.__chain_inputs(question, sources)
+
+            # Cadeia montada uma unica vez e reaproveitada entre perguntas
+            chain = self.__get_chain(model)
+
+        n_tokens = 0
+        first_token = None
+
+        with self.llm_lock:
+            # Garante o estado do prefixo fixo no cache do modelo
+            if self.prefix_cache:
+                self.prefix_cache.warm(llm)
+
+            start = time.perf_counter()
+
+            for token in chain.stream(inputs):
+                if stop_event is not None and stop_event.is_set():
+                    break
+                if first_token is None:
+                    first_token = time.perf_counter()
+                n_tokens += 1
+                yield token
+
+            end = time.perf_counter()
+
+        first_token = first_token or end
+        prompt = PROMPT_TEMPLATE.format(**inputs)
+
+        # O prompt e tokenizado uma unica vez, para a contagem e para o prefixo
+        # em comum com o prefixo aquecido
+        shared_prefix_tokens = 0
+        if self.prefix_cache and self.prefix_cache.supports(llm):
+            prompt_ids = llm.client.tokenize(prompt.encode("utf-8"), add_bos=False)
+            prompt_tokens = len(prompt_ids)
+            shared_prefix_tokens = self.prefix_cache.shared_prefix_tokens(llm, prompt_ids)
+        else:
+            prompt_tokens = llm_token_counter(llm)(prompt)
+
+        timings.update({
+            "prompt_tokens": prompt_tokens,
+            "shared_prefix_tokens": shared_prefix_tokens,
+            "prompt_eval_seconds": first_token - start,
+            "generation_seconds": end - first_token,
+            "generated_tokens": n_tokens,
+            "context_chunks": len(sources),
+            })
+
+        # Tempos da ultima chamada, para conferir o ganho do cache de prefixo
+        self.last_timings = timings
+
+
+    def stream_answer(self, question, sources = None, model = None, filters = None, stop_event = None):
+        """Gerador que devolve os tokens da resposta conforme o llama.cpp
+        os produz
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            sources (list, optional): Lista que recebe os Documents utilizados
+                como contexto antes do primeiro token. Padrao None.
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca (ver retrieve). Padrao None.
+            stop_event (threading.Event, optional): Interrompe a geracao quando
+                setado, a resposta incompleta nao entra no cache. Padrao None.
+
+        Yields:
+            str: Pedacos (tokens) da resposta
+        """
+
+        model = self.__route(model)
+
+        # O gerador pode ser consumido em outra thread (astream_answer), o
+        # registro so fica ativo durante as chamadas internas
+        record = self.metrics.start()
+
+        # Resposta em cache e devolvida de uma vez
+        with self.metrics.bind(record):
+            result, vector = self.__cached_answer(question, model, filters)
+
+        record["cached"] = result is not None
+
+        if result is not None:
+            if sources is not None:
+                sources.extend(result["sources"])
+            self.metrics.finish(record)
+            yield result["answer"]
+            return
+
+        # O registro e finalizado mesmo quando o consumidor para antes do fim
+        # (break, GeneratorExit do astream_answer cancelado) ou ocorre um erro,
+        # assim chamadas interrompidas tambem entram nos histogramas
+        completed = False
+        try:
+            with self.metrics.bind(record):
+                retrieved = self.__context(question, model, filters, vector)
+
+            if sources is not None:
+                sources.extend(retrieved)
+
+            tokens = []
+            for token in self.__stream_tokens(question, retrieved, model, record, stop_event):
+                tokens.append(token)
+                yield token
+
+            completed = stop_event is None or not stop_event.is_set()
+            if completed:
+                self.__cache_answer(question, "".join(tokens), retrieved, model, filters, vector)
+
+        finally:
+            record["interrupted"] = not completed
+            self.metrics.finish(record)
+
+
+    async def astream_answer(self, question, sources = None, model = None, filters = None,
+                             buffer_size = 64):
+        """Versao assincrona do stream_answer. A geracao roda em uma thread
+        e cada token e entregue ao event loop assim que e produzido.
+
+        A fila entre a thread e o event loop e limitada: com o consumidor
+        lento a geracao espera. Quando o consumidor para de ler (ex: o
+        cliente desconectou e o gerador foi fechado) a geracao e
+        interrompida no proximo token e o llm_lock e liberado.
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            sources (list, optional): Lista que recebe os Documents utilizados
+                como contexto. Padrao None.
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca (ver retrieve). Padrao None.
+            buffer_size (int, optional): Tokens em espera na fila. Padrao 64.
+
+        Yields:
+            str: Pedacos (tokens) da resposta
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=buffer_size)
+        stop_event = threading.Event()
+
+        def put(item):
+            """Coloca um item na fila esperando uma vaga, desiste quando o
+            consumidor para de ler"""
+
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:
+                # Event loop do consumidor ja encerrado
+                return False
+
+            while not stop_event.is_set():
+                try:
+                    future.result(timeout=0.1)
+                    return True
+                except FutureTimeoutError:
+                    continue
+
+            future.cancel()
+            return False
+
+        def produce():
+            try:
+                for token in self.stream_answer(question, sources, model, filters, stop_event):
+                    if not put(token):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(_STREAM_END)
+
+        producer = loop.run_in_executor(None, produce)
+
+        try:
+            while True:
+                item = await queue.get()
+
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                yield item
+
+            await producer
+
+        finally:
+            # Consumidor encerrado (fim, erro ou desconexao), interrompe a geracao
+            stop_event.set()
+
+
+    async def start_async_worker(self,):
+        """Liga o front-end assincrono no event loop atual: uma fila limitada
+        de perguntas, um pool de threads para a recuperacao (embedding +
+        FAISS) e uma unica thread dedicada ao llama.cpp. A recuperacao das
+        perguntas na fila roda em paralelo com a geracao da pergunta atual.
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+
+        # Worker vivo no loop atual. Um worker de outro loop (ex: um asyncio.run
+        # anterior) ou ja encerrado e descartado junto com a sua fila
+        if self.async_worker is not None:
+            if not self.async_worker.done() and self.async_loop is loop:
+                return
+
+            self.__discard_async_worker()
+
+        # Fila limitada, quando cheia o aanswer espera (backpressure)
+        self.request_queue = asyncio.Queue(maxsize=self.async_queue_size)
+
+        # Recuperacoes em paralelo e uma unica thread para o llama.cpp
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=self.async_retrieval_workers,
+                                                     thread_name_prefix="rag-retrieval")
+        self.llm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-llm")
+
+        # Limita quantas perguntas saem da fila ao mesmo tempo: uma gerando
+        # e as demais recuperando contexto
+        self.in_flight = asyncio.Semaphore(self.async_retrieval_workers + 1)
+
+        self.async_loop = loop
+        self.async_worker = loop.create_task(self.__async_worker())
+
+        if self.assist_log:
+            print("Worker assincrono ligado")
+
+
+    def __discard_async_worker(self,):
+        """Descarta o worker, a fila e os executores atuais (sem esperar)"""
+
+        if self.async_worker is not None and not self.async_worker.done():
+            self.async_worker.cancel()
+
+        self.async_worker = None
+        self.async_loop = None
+        self.request_queue = None
+        self.async_tasks = set()
+
+        if self.retrieval_executor is not None:
+            self.retrieval_executor.shutdown(wait=False)
+            self.llm_executor.shutdown(wait=False)
+
+
+    async def stop_async_worker(self,):
+        """Desliga o front-end assincrono e libera as threads. As perguntas
+        que ainda estavam na fila recebem um RuntimeError (quem espera no
+        aanswer nunca fica pendurado)"""
+
+        import asyncio
+
+        if self.async_worker is None:
+            return
+
+        self.async_worker.cancel()
+
+        try:
+            await self.async_worker
+        except asyncio.CancelledError:
+            pass
+
+        # Perguntas que nao sairam da fila
+        while not self.request_queue.empty():
+            *_, future = self.request_queue.get_nowait()
+            self.request_queue.task_done()
+
+            if not future.done():
+                future.set_exception(RuntimeError("Worker assincrono desligado antes de responder a pergunta"))
+
+        self.__discard_async_worker()
+
+
+    async def __async_worker(self,):
+        """Consome a fila de perguntas, respeitando o limite de perguntas
+        em andamento"""
+
+        import asyncio
+
+        while True:
+            question, model, filters, future = await self.request_queue.get()
+
+            try:
+                await self.in_flight.acquire()
+            except asyncio.CancelledError:
+                # Pergunta ja retirada da fila quando o worker foi desligado
+                self.request_queue.task_done()
+                if not future.done():
+                    future.set_exception(RuntimeError("Worker assincrono desligado antes de responder a pergunta"))
+                raise
+
+            task = asyncio.get_running_loop().create_task(self.__async_process(question, model, filters, future))
+
+            # Referencia forte ate a task terminar
+            self.async_tasks.add(task)
+            task.add_done_callback(self.async_tasks.discard)
+
+
+    async def __async_process(self, question, model, filters, future):
+        """Responde uma pergunta da fila: recuperacao no pool de threads e
+        geracao na thread do llama.cpp
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            model (str): Modelo do pool que vai responder (None = padrao)
+            filters (dict): Filtro de metadados da busca (None = sem filtro)
+            future (asyncio.Future): Futuro que recebe o resultado
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        record = self.metrics.start()
+
+        # Fila e semaforo desta execucao do worker (o stop_async_worker
+        # descarta os atributos antes das perguntas em andamento terminarem)
+        request_queue, in_flight = self.request_queue, self.in_flight
+        retrieval_executor, llm_executor = self.retrieval_executor, self.llm_executor
+
+        # Cada etapa roda em uma thread diferente, com o mesmo registro ativo
+        def traced(function, *args):
+            with self.metrics.bind(record):
+                return function(*args)
+
+        try:
+            # Cache de respostas e recuperacao nao disputam a thread da LLM
+            result, vector = await loop.run_in_executor(retrieval_executor, traced, self.__cached_answer,
+                                                        question, model, filters)
+            record["cached"] = result is not None
+
+            if result is None:
+                sources = await loop.run_in_executor(retrieval_executor, traced, self.__context, question, model,
+                                                     filters, vector)
+                result = await loop.run_in_executor(llm_executor, traced, self.__generate, question, sources, model,
+                                                    filters, record, vector)
+
+            result["timings"] = self.metrics.finish(record)
+
+            if not future.done():
+                future.set_result(result)
+
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+        finally:
+            in_flight.release()
+            request_queue.task_done()
+
+
+    async def aanswer(self, question, block = True, model = None, filters = None):
+        """Versao assincrona do answer, passando pela fila limitada
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            block (bool, optional): Caso a fila esteja cheia espera uma vaga
+                quando True, ou levanta asyncio.QueueFull quando False. Padrao True.
+            model (str, optional): Modelo do pool que vai responder. Padrao None.
+            filters (dict, optional): Filtro de metadados da busca (ver retrieve). Padrao None.
+
+        Returns:
+            dict: {"answer": texto da resposta, "sources": Documents utilizados}
+        """
+
+        import asyncio
+
+        await self.start_async_worker()
+
+        future = asyncio.get_running_loop().create_future()
+
+        if block:
+            await self.request_queue.put((question, self.__route(model), filters, future))
+        else:
+            self.request_queue.put_nowait((question, self.__route(model), filters, future))
+
+        return await future
+
+
+    def answer_me(self,question):
+        """Metodo responsavel por responder perguntas, imprimindo a resposta
+        no terminal conforme ela e gerada"""
+
+        print("====================================")
+        print(question)
+
+        for token in self.stream_answer(question):
+            print(token, end="", flush=True)
+
+        print("\n====================================\n")
@@ -20,6 +20,30 @@ class hardware_info():
             bytes /= factor
 
 
+    def get_resources(self):
+        """Recupera apenas os dados de CPU e memoria RAM utilizados para
+        dimensionar a execucao dos modelos (threads, contexto, mlock...)
+
+        Returns:
+            dict: Cores fisicos e logicos, RAM total e disponivel em bytes
+        """
+
+        import os
+        import psutil
+
+        # Recupera dados de CPU, psutil pode nao saber os cores fisicos
+        cpu_cores_logical = psutil.cpu_count(logical=True) or os.cpu_count() or 1
+        cpu_cores_physical = psutil.cpu_count(logical=False) or cpu_cores_logical
+
+        # Recupera dados de memoria RAM no momento
+        svmem = psutil.virtual_memory()
+
+        return {"cpu_cores_physical": cpu_cores_physical,
+                "cpu_cores_logical": cpu_cores_logical,
+                "ram_total": svmem.total,
+                "ram_available": svmem.available}
+
+
     def get_info(self):
         """Recupera os dados de cada um dos parametros de sistema em variaveis separadas
         e retorna para op usuario"""
@@ -0,0 +1,566 @@
+# Imports de libs padrao
+import gc
+import os
+import json
+import weakref
+import warnings
+import threading
+from collections import OrderedDict
+
+
+# Limite de modelos do pool quando ha orcamento de memoria mas o psutil
+# nao esta instalado (a memoria residente nao pode ser medida)
+FALLBACK_MAX_MODELS = 2
+
+
+def resident_memory():
+    """Retorna a memoria residente (RSS) do processo atual em bytes
+
+    Returns:
+        int: Memoria residente ou None caso o psutil nao esteja instalado
+    """
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class LlamaCpp_Config:
+    """Parametros de execucao do llama.cpp validados na criacao.
+
+    Os valores padrao reproduzem a configuracao historica da lib
+    (n_gpu_layers=1, n_batch=2048, n_ctx=2048, f16_kv=True). Utilize
+    LlamaCpp_Config.auto() para escolher threads, batch e mlock a partir
+    do hardware da maquina.
+    """
+
+    def __init__(self,
+                 n_threads = None,
+                 n_threads_batch = None,
+                 n_batch = 2048,
+                 n_ctx = 2048,
+                 n_gpu_layers = 1,
+                 use_mmap = True,
+                 use_mlock = False,
+                 f16_kv = True,
+                 rope_freq_scale = None,
+                 rope_freq_base = None):
+
+        # [ATRIB] Threads de geracao e de avaliacao do prompt (None = padrao do llama.cpp)
+        self.n_threads = n_threads
+        self.n_threads_batch = n_threads_batch
+
+        # [ATRIB] Tokens avaliados por lote e tamanho do contexto
+        self.n_batch = n_batch
+        self.n_ctx = n_ctx
+
+        # [ATRIB] Camadas na GPU (-1 = todas, 0 = somente CPU)
+        self.n_gpu_layers = n_gpu_layers
+
+        # [ATRIB] Pesos lidos via mmap e/ou travados na RAM (mlock)
+        self.use_mmap = use_mmap
+        self.use_mlock = use_mlock
+
+        # [ATRIB] Cache KV em float16
+        self.f16_kv = f16_kv
+
+        # [ATRIB] Escala do RoPE para contextos maiores que o de treino
+        self.rope_freq_scale = rope_freq_scale
+        self.rope_freq_base = rope_freq_base
+
+        self.validate()
+
+
+    def validate(self,):
+        """Valida os parametros, levantando ValueError com o problema
+        encontrado"""
+
+        for name in ("n_threads", "n_threads_batch"):
+            value = getattr(self, name)
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise ValueError(f"""{name} deve ser um inteiro >= 1, recebido: {value}""")
+
+        for name in ("n_batch", "n_ctx"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"""{name} deve ser um inteiro >= 1, recebido: {value}""")
+
+        if self.n_batch > self.n_ctx:
+            raise ValueError(f"""n_batch ({self.n_batch}) nao pode ser maior que n_ctx ({self.n_ctx})""")
+
+        if not isinstance(self.n_gpu_layers, int) or self.n_gpu_layers < -1:
+            raise ValueError(f"""n_gpu_layers deve ser um inteiro >= -1, recebido: {self.n_gpu_layers}""")
+
+        for name in ("use_mmap", "use_mlock", "f16_kv"):
+            if not isinstance(getattr(self, name), bool):
+                raise ValueError(f"""{name} deve ser True ou False, recebido: {getattr(self, name)}""")
+
+        for name in ("rope_freq_scale", "rope_freq_base"):
+            value = getattr(self, name)
+            if value is not None and value <= 0:
+                raise ValueError(f"""{name} deve ser maior que zero, recebido: {value}""")
+
+
+    @classmethod
+    def auto(cls, device = "cpu", model_path = None, resources = None, **overrides):
+        """Escolhe os parametros a partir do hardware da maquina
+
+        - n_threads: cores fisicos (hyper-threading nao ajuda na geracao)
+        - n_threads_batch: cores logicos (avaliacao do prompt escala melhor)
+        - n_batch: 512 em CPU, lotes maiores so gastam memoria sem GPU
+        - n_gpu_layers: 0 em CPU, todas as camadas quando ha GPU
+        - use_mlock: somente se a RAM livre comporta duas vezes o modelo
+
+        Args:
+            device (str, optional): Device ja resolvido ("cpu" ou "cuda"). Padrao "cpu".
+            model_path (str, optional): Arquivo GGUF, utilizado para medir o modelo. Padrao None.
+            resources (dict, optional): Saida do hardware_info.get_resources(). Padrao None.
+            **overrides: Parametros que sobrescrevem os valores escolhidos
+
+        Returns:
+            LlamaCpp_Config: Configuracao validada
+        """
+
+        if resources is None:
+            from custom_libs.ds_utils import hardware_info
+            resources = hardware_info().get_resources()
+
+        model_size = os.path.getsize(model_path) if model_path and os.path.isfile(model_path) else None
+
+        params = {"n_threads": resources["cpu_cores_physical"],
+                  "n_threads_batch": resources["cpu_cores_logical"],
+                  "n_batch": 512 if device == "cpu" else 2048,
+                  "n_ctx": 2048,
+                  "n_gpu_layers": 0 if device == "cpu" else -1,
+                  "use_mmap": True,
+                  "use_mlock": bool(model_size) and resources["ram_available"] > 2 * model_size}
+        params.update(overrides)
+
+        return cls(**params)
+
+
+    def to_dict(self,):
+        """Converte a configuracao em um dicionario serializavel em json
+        (LlamaCpp_Config(**config.to_dict()) recria a configuracao)"""
+
+        return dict(self.__dict__)
+
+
+    def to_params(self,):
+        """Converte a configuracao nos parametros do LlamaCpp do langchain
+
+        Returns:
+            dict: Parametros nao nulos (n_threads_batch vai em model_kwargs)
+        """
+
+        params = {"n_threads": self.n_threads,
+                  "n_batch": self.n_batch,
+                  "n_ctx": self.n_ctx,
+                  "n_gpu_layers": self.n_gpu_layers,
+                  "use_mmap": self.use_mmap,
+                  "use_mlock": self.use_mlock,
+                  "f16_kv": self.f16_kv,
+                  "rope_freq_scale": self.rope_freq_scale,
+                  "rope_freq_base": self.rope_freq_base}
+        params = {name: value for name, value in params.items() if value is not None}
+
+        # O LlamaCpp do langchain nao expoe n_threads_batch diretamente
+        if self.n_threads_batch is not None:
+            params["model_kwargs"] = {"n_threads_batch": self.n_threads_batch}
+
+        return params
+
+
+    def __repr__(self,):
+        return f"""LlamaCpp_Config({self.to_params()})"""
+
+
+class LLM_Pool:
+    """Pool de LLMs carregadas no processo.
+
+    Cada modelo e identificado pelo nome e pelos parametros de carga, e
+    so e carregado na primeira pergunta que o utiliza (os pesos GGUF sao
+    lidos via mmap pelo llama.cpp). Quando a memoria residente passa do
+    orcamento os modelos menos utilizados recentemente sao descarregados,
+    com excecao dos modelos fixados (ex: o modelo padrao do objeto). O
+    mesmo vale para a quantidade de modelos acima de 'max_models'.
+
+    A memoria residente e medida com o psutil. Sem ele, um orcamento de
+    memoria emite um aviso e o pool passa a respeitar 'max_models'
+    (FALLBACK_MAX_MODELS caso nao informado), nunca cresce sem limite.
+    """
+
+    def __init__(self, factory, memory_budget = None, assist_log = False, on_evict = None,
+                 max_models = None):
+
+        # [ATRIB] Funcao que carrega um modelo: factory(model_name, params) -> LLM
+        self.factory = factory
+
+        # [ATRIB] Funcao chamada quando um modelo e descarregado:
+        # on_evict(model_name, params). Quem guarda referencias ao modelo
+        # (ex: cadeias montadas com ele) deve solta-las aqui, senao a
+        # memoria nunca e liberada
+        self.on_evict = on_evict
+
+        # [ATRIB] Orcamento de memoria residente em bytes (None = sem limite)
+        self.memory_budget = memory_budget
+
+        # [ATRIB] Quantidade maxima de modelos carregados (None = sem limite)
+        self.max_models = max_models
+
+        if memory_budget is not None and resident_memory() is None:
+            warnings.warn("psutil nao instalado: o orcamento de memoria do LLM_Pool nao pode ser medido, "
+                          f"""o pool fica limitado a {max_models or FALLBACK_MAX_MODELS} modelos""",
+                          RuntimeWarning, stacklevel=2)
+            self.memory_budget = None
+            self.max_models = max_models or FALLBACK_MAX_MODELS
+
+        # [ATRIB] Variavel que guarda a preferencia sobre o log de execucao
+        self.assist_log = assist_log
+
+        # [ATRIB] Modelos carregados em ordem de utilizacao, chave -> LLM
+        self.models = OrderedDict()
+
+        # [ATRIB] Chaves que nunca sao descarregadas
+        self.pinned = set()
+
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def key(model_name, params):
+        """Chave de um modelo no pool
+
+        Args:
+            model_name (str): Nome do arquivo do modelo
+            params (dict): Parametros de carga do modelo
+
+        Returns:
+            tuple: (nome, parametros serializados em json ordenado)
+        """
+
+        return (model_name, json.dumps(params, sort_keys=True, default=str))
+
+
+    def get(self, model_name, pin = False, **params):
+        """Retorna um modelo do pool, carregando caso ainda nao esteja em
+        memoria
+
+        Args:
+            model_name (str): Nome do arquivo do modelo
+            pin (bool, optional): Impede que o modelo seja descarregado. Padrao False.
+            **params: Parametros de carga repassados para a factory
+
+        Returns:
+            LLM: Modelo carregado
+        """
+
+        key = self.key(model_name, params)
+
+        with self.lock:
+            if pin:
+                self.pinned.add(key)
+
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+
+            if self.assist_log:
+                print(f"""Carregando modelo no pool: {model_name}""")
+
+            self.models[key] = self.factory(model_name, params)
+
+            self.__evict()
+
+            return self.models[key]
+
+
+    def unpin(self, model_name, **params):
+        """Libera um modelo fixado para ser descarregado
+
+        Args:
+            model_name (str): Nome do arquivo do modelo
+            **params: Parametros de carga do modelo
+        """
+
+        with self.lock:
+            self.pinned.discard(self.key(model_name, params))
+
+
+    def __over_limit(self,):
+        """Indica se o pool passou da quantidade de modelos ou do orcamento
+        de memoria residente"""
+
+        if self.max_models is not None and len(self.models) > self.max_models:
+            return True
+
+        if self.memory_budget is None:
+            return False
+
+        rss = resident_memory()
+
+        return rss is not None and rss > self.memory_budget
+
+
+    def __evict(self,):
+        """Descarrega os modelos menos utilizados enquanto o pool estiver
+        acima da quantidade de modelos ou do orcamento de memoria"""
+
+        while self.__over_limit():
+            # O modelo mais recente (o que acabou de ser pedido) nunca sai
+            candidates = [key for key in list(self.models)[:-1] if key not in self.pinned]
+
+            if not candidates:
+                return
+
+            model_name, params = candidates[0]
+            del self.models[candidates[0]]
+
+            if self.on_evict is not None:
+                self.on_evict(model_name, json.loads(params))
+
+            # Libera o modelo (e o mmap dos pesos) imediatamente
+            gc.collect()
+
+            if self.assist_log:
+                print(f"""Modelo descarregado do pool: {candidates[0][0]}""")
+
+
+    def loaded(self,):
+        """Lista os modelos carregados
+
+        Returns:
+            list: Nomes dos modelos em ordem de utilizacao
+        """
+
+        with self.lock:
+            return [model_name for model_name, _ in self.models]
+
+
+def longest_token_prefix(a, b):
+    """Quantidade de tokens iniciais em comum entre duas sequencias
+
+    Args:
+        a (list): Sequencia de tokens
+        b (list): Sequencia de tokens
+
+    Returns:
+        int: Tamanho do prefixo comum
+    """
+
+    n = 0
+    for token_a, token_b in zip(a, b):
+        if token_a != token_b:
+            break
+        n += 1
+
+    return n
+
+
+class Prompt_Prefix_Cache:
+    """Reaproveita o estado do llama.cpp (cache KV) do prefixo fixo do
+    prompt entre perguntas.
+
+    No aquecimento o prefixo e avaliado uma unica vez e o estado e
+    guardado no LlamaRAMCache do modelo. A cada geracao o llama.cpp
+    carrega o estado com o maior prefixo em comum com o prompt novo e so
+    avalia os tokens restantes. Com 'capacity_bytes' maior que o estado
+    do prefixo, os prompts completos das respostas anteriores tambem
+    ficam no cache, entao blocos de contexto repetidos sao reaproveitados.
+
+    Com o cache ligado o llama-cpp-python grava o estado completo depois
+    de cada resposta, e sem ele o Llama.generate ja reaproveita o maior
+    prefixo em comum com o prompt anterior. Por isso o LLM_With_Rag deixa
+    o cache desligado por padrao: ligue somente se o rag_benchmark mostrar
+    ganho com o modelo e as perguntas reais.
+    """
+
+    def __init__(self, prefix, capacity_bytes = 2 << 30):
+
+        # [ATRIB] Texto fixo do inicio do prompt (instrucoes)
+        self.prefix = prefix
+
+        # [ATRIB] Tamanho maximo do LlamaRAMCache de cada modelo
+        self.capacity_bytes = capacity_bytes
+
+        # [ATRIB] Tokens do prefixo ja aquecidos, cliente llama.cpp -> tokens.
+        # Referencia fraca: um modelo descarregado do pool sai do dicionario e
+        # um cliente novo nunca herda o aquecimento de outro
+        self.prefix_tokens = weakref.WeakKeyDictionary()
+
+
+    @staticmethod
+    def supports(llm):
+        """Indica se o modelo expoe o estado do llama.cpp
+
+        Args:
+            llm: LLM do langchain
+
+        Returns:
+            bool: True para LlamaCpp (cliente llama_cpp.Llama)
+        """
+
+        client = getattr(llm, "client", None)
+
+        return client is not None and hasattr(client, "save_state") and hasattr(client, "set_cache")
+
+
+    def warm(self, llm):
+        """Avalia o prefixo e guarda o estado no cache do modelo (somente
+        na primeira chamada para cada modelo)
+
+        Args:
+            llm: LLM do langchain
+
+        Returns:
+            bool: True caso o prefixo esteja aquecido
+        """
+
+        if not self.supports(llm):
+            return False
+
+        client = llm.client
+
+        if client in self.prefix_tokens:
+            return True
+
+        from llama_cpp import LlamaRAMCache
+
+        if client.cache is None:
+            client.set_cache(LlamaRAMCache(capacity_bytes=self.capacity_bytes))
+
+        # Avalia somente o prefixo e guarda o estado resultante
+        tokens = client.tokenize(self.prefix.encode("utf-8"))
+        client.reset()
+        client.eval(tokens)
+        client.cache[tokens] = client.save_state()
+
+        self.prefix_tokens[client] = tokens
+
+        return True
+
+
+    def save_state(self, llm, path):
+        """Grava no disco o estado do prefixo aquecido (arrays em um .npz,
+        sem pickle), para ser restaurado pelo load_state em outro processo.
+
+        Somente o que o load_state do llama.cpp utiliza e gravado: os
+        tokens, o estado do contexto (cache KV) e a ultima linha dos
+        logits (o load_state replica a linha para os tokens do prefixo e
+        a geracao sempre avalia de novo o ultimo token do prompt)
+
+        Args:
+            llm: LLM do langchain ja aquecida pelo warm
+            path (str): Arquivo .npz
+
+        Returns:
+            bool: True caso o estado tenha sido gravado
+        """
+
+        if not self.supports(llm) or llm.client not in self.prefix_tokens:
+            return False
+
+        import numpy as np
+
+        state = llm.client.cache[self.prefix_tokens[llm.client]]
+
+        # O estado do llama.cpp (bytes ou array do ctypes, conforme a versao)
+        # vai como array de uint8, os tokens e contagens como arrays do numpy
+        arrays = {"input_ids": np.asarray(state.input_ids),
+                  "n_tokens": np.asarray(state.n_tokens),
+                  "llama_state_size": np.asarray(state.llama_state_size),
+                  "bytes_llama_state": np.frombuffer(bytes(state.llama_state), dtype=np.uint8)}
+
+        scores = np.asarray(state.scores)
+        if scores.ndim == 2 and len(scores):
+            arrays["scores"] = scores[min(state.n_tokens, len(scores)) - 1:][:1]
+
+        if getattr(state, "seed", None) is not None:
+            arrays["seed"] = np.asarray(state.seed)
+
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+        return True
+
+
+    def load_state(self, llm, path):
+        """Restaura o estado do prefixo gravado pelo save_state no cache do
+        modelo, no lugar de avaliar o prefixo de novo (warm)
+
+        Args:
+            llm: LLM do langchain
+            path (str): Arquivo .npz
+
+        Returns:
+            bool: True caso o estado tenha sido restaurado, False caso o
+            estado gravado nao seja do prefixo atual
+        """
+
+        if not self.supports(llm):
+            return False
+
+        import numpy as np
+        from llama_cpp import LlamaRAMCache, LlamaState
+
+        client = llm.client
+
+        fields = {}
+        with np.load(path, allow_pickle=False) as data:
+            for name in data.files:
+                if name.startswith("bytes_"):
+                    fields[name[len("bytes_"):]] = data[name].tobytes()
+                elif data[name].ndim == 0:
+                    fields[name] = data[name].item()
+                else:
+                    fields[name] = data[name]
+
+        state = LlamaState(**fields)
+
+        # O estado precisa ser exatamente o do prefixo atual
+        tokens = client.tokenize(self.prefix.encode("utf-8"))
+        if list(state.input_ids[:state.n_tokens]) != list(tokens):
+            return False
+
+        if client.cache is None:
+            client.set_cache(LlamaRAMCache(capacity_bytes=self.capacity_bytes))
+
+        client.load_state(state)
+        client.cache[tokens] = state
+
+        self.prefix_tokens[client] = tokens
+
+        return True
+
+
+    def shared_prefix_tokens(self, llm, prompt_ids):
+        """Quantidade de tokens iniciais do prompt em comum com o prefixo
+        aquecido. E o maximo que o llama.cpp pode reaproveitar do cache,
+        nao a quantidade de tokens que ele efetivamente deixou de avaliar
+
+        Args:
+            llm: LLM do langchain
+            prompt_ids (list): Tokens do prompt completo (sem o BOS), ja
+                calculados para a contagem do prompt
+
+        Returns:
+            int: Tokens do prompt cobertos pelo prefixo aquecido
+        """
+
+        if not self.supports(llm):
+            return 0
+
+        prefix = self.prefix_tokens.get(llm.client)
+
+        if not prefix:
+            return 0
+
+        # O prefixo e aquecido com o BOS, a contagem do prompt nao inclui o BOS
+        if prefix[0] == llm.client.token_bos():
+            prefix = prefix[1:]
+
+        return longest_token_prefix(prefix, prompt_ids)
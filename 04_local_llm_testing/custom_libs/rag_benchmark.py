@@ -0,0 +1,488 @@
+"""Benchmark reprodutivel do pipeline RAG (custom_libs.custom_llm).
+
+Roda offline e somente em CPU: o modelo de embedding e trocado por um
+embedder deterministico (hash dos termos) e a LLM por um stub que gera
+sempre os mesmos tokens, entao os numeros medem a lib (ingestao, FAISS,
+BM25, empacotamento do contexto, streaming) e nao os pesos dos modelos.
+
+Mede, para cada tipo de indice:
+    - tempo de criacao da base e chunks/s da ingestao;
+    - tempo de carga da base ja criada;
+    - warm start: restart com start_model(new_db=True) e o snapshot gravado,
+      a criacao da base deve ser pulada (snapshot_hit);
+    - cold start em um processo novo (import + start_model + 1a resposta);
+    - latencia por pergunta da recuperacao (p50/p95/p99) e recall@k no
+      conjunto fixo de perguntas sobre a pasta 02_transcript_data;
+    - tokens/s da geracao.
+
+Mede tambem o tempo do import do custom_llm em um processo novo e quais
+libs pesadas ele carrega. Com --import-budget somente esse teste roda e o
+processo termina com erro caso o import passe do orcamento ou carregue
+alguma lib pesada (utilizado no CI).
+
+O resultado e um json com chaves ordenadas, para comparar commits com diff.
+
+Uso (na pasta 04_local_llm_testing):
+    python -m custom_libs.rag_benchmark --output benchmark.json
+    python -m custom_libs.rag_benchmark --index-types flat hnsw --modes vector hybrid
+    python -m custom_libs.rag_benchmark --import-budget 0.5
+"""
+
+# Imports de libs padrao
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib
+import statistics
+import subprocess
+from functools import partial
+
+# numpy, langchain e os stubs (custom_libs.rag_benchmark_stubs) sao importados
+# dentro das funcoes que os utilizam, entao o --import-budget roda em um
+# interpretador sem as libs pesadas instaladas
+
+
+# Versao do formato do json, incrementar caso as chaves mudem
+BENCHMARK_VERSION = 1
+
+# Nome do embedder deterministico no registro de modelos de embedding
+BENCHMARK_EMBEDDING_MODEL = "benchmark-hash-embedding"
+
+# Nome do modelo stub (nao existe arquivo GGUF)
+BENCHMARK_MODEL_NAME = "benchmark-stub.gguf"
+
+# Libs pesadas que o import do custom_llm nao pode carregar (sao importadas
+# dentro dos metodos que as utilizam)
+HEAVY_MODULES = ("torch", "pandas", "numpy", "langchain", "langchain_core", "langchain_community",
+                 "faiss", "llama_cpp", "sentence_transformers")
+
+# Orcamento padrao (s) do import do custom_llm em um processo novo
+DEFAULT_IMPORT_BUDGET = 0.5
+
+# Codigo do processo filho que mede o import
+IMPORT_CHECK = f"""
+import sys, time, json
+start = time.perf_counter()
+import custom_libs.custom_llm
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy_modules": sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)}}))
+"""
+
+# Pasta de documentos padrao, relativa a 04_local_llm_testing
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "02_transcript_data")
+
+# Conjunto fixo de perguntas. Um chunk e relevante quando vem do arquivo
+# esperado (None = qualquer arquivo) e contem o trecho esperado
+BENCHMARK_QUESTIONS = (
+    {"question": "Qual é o preço do LANNATE?", "file": "price_LANNATE.txt", "expected": "2.000,00"},
+    {"question": "Qual é o preço do PRIVILEGE?", "file": "price_PRIVILEGE.txt", "expected": "7.000,00"},
+    {"question": "Qual é o numero MAPA do LANNATE?", "file": "leaflet_LANNATE.txt", "expected": "1238603"},
+    {"question": "Qual é o numero de registro MAPA do PRIVILEGE?", "file": "leaflet_PRIVILEGE.txt", "expected": "25016"},
+    {"question": "Qual é a classe toxicológica do LANNATE?", "file": "leaflet_LANNATE.txt", "expected": "EXTREMAMENTE"},
+    {"question": "Qual é o ingrediente ativo do LANNATE?", "file": "leaflet_LANNATE.txt", "expected": "METOMIL"},
+    {"question": "Qual é a composição do PRIVILEGE?", "file": "leaflet_PRIVILEGE.txt", "expected": "ACETAMIPRIDO"},
+    {"question": "Qual o número de registro MAPA do produto AZIMUT FR 1L?", "file": "price_description_nutrien.txt", "expected": "13612"},
+    {"question": "Qual ERP vende o produto MAXSAN 20L?", "file": "price_description_nutrien.txt", "expected": "MAXSAN 20L"},
+    {"question": "Qual é o telefone do Disque Intoxicação?", "file": None, "expected": "0800 722 6001"},
+    )
+
+
+def register_stubs(dim = 256):
+    """Registra o embedder deterministico no registro de modelos de
+    embedding da lib (chamado uma vez por processo)"""
+
+    from custom_libs.custom_llm import register_embedding_model
+    from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+
+    register_embedding_model(BENCHMARK_EMBEDDING_MODEL, Hash_Embeddings(dim))
+
+
+def new_rag(storage_path, data_path, n_tokens = 32, **params):
+    """Cria um LLM_With_Rag com os stubs do benchmark
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+        data_path (str): Pasta de documentos
+        n_tokens (int, optional): Tokens gerados pelo stub. Padrao 32.
+        **params: Parametros repassados para o LLM_With_Rag
+
+    Returns:
+        LLM_With_Rag: Objeto ainda sem start_model
+    """
+
+    from langchain.document_loaders import TextLoader
+
+    from custom_libs.custom_llm import LLM_With_Rag
+    from custom_libs.rag_benchmark_stubs import Stub_LLM
+
+    params.setdefault("embedding_cache", False)
+
+    rag = LLM_With_Rag(model_name=BENCHMARK_MODEL_NAME,
+                       storage_path=storage_path,
+                       rag_data_path=data_path,
+                       embedding_model=BENCHMARK_EMBEDDING_MODEL,
+                       document_loader=partial(TextLoader, encoding="utf-8"),
+                       device="cpu",
+                       llm_verbose=False,
+                       **params)
+
+    # O pool carrega o stub no lugar do llama.cpp
+    rag.llm_pool.factory = lambda model_name, load_params: Stub_LLM(n_tokens=n_tokens)
+
+    return rag
+
+
+def start_model(rag, new_db):
+    """start_model que falha caso a base ou o modelo nao carreguem (a lib
+    so imprime o erro e segue)
+
+    Args:
+        rag (LLM_With_Rag): Objeto criado pelo new_rag
+        new_db (bool): Cria a base antes de carregar
+
+    Returns:
+        float: Tempo do start_model (s)
+    """
+
+    start = time.perf_counter()
+    rag.start_model(new_db=new_db)
+    elapsed = time.perf_counter() - start
+
+    if rag.vectorstore is None or rag.llm is None:
+        raise RuntimeError(f"""Falha ao iniciar a base em {rag.storage_path}, veja o erro acima""")
+
+    return elapsed
+
+
+def distribution(values, scale = 1.0):
+    """Resumo de uma lista de medidas: media, p50, p95, p99 e maximo
+
+    Args:
+        values (list): Medidas
+        scale (float, optional): Multiplicador (ex: 1000 para ms). Padrao 1.0.
+
+    Returns:
+        dict: {"count", "mean", "p50", "p95", "p99", "max"}
+    """
+
+    import numpy as np
+
+    if not values:
+        return {"count": 0}
+
+    values = np.asarray(values, dtype=np.float64) * scale
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+
+    return {"count": int(values.size), "mean": float(values.mean()), "p50": float(p50),
+            "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+
+
+def is_relevant(doc, item):
+    """Indica se um chunk recuperado responde a pergunta do conjunto fixo"""
+
+    if item["file"] is not None and doc.metadata.get("file") != item["file"]:
+        return False
+
+    return item["expected"].lower() in doc.page_content.lower()
+
+
+def bench_retrieval(rag, questions, k, repeats):
+    """Latencia da recuperacao por pergunta e recall@k
+
+    Args:
+        rag (LLM_With_Rag): Objeto com a base carregada (sem cache de recuperacao)
+        questions (tuple): Conjunto de perguntas
+        k (int): Chunks recuperados por pergunta
+        repeats (int): Passadas pelo conjunto de perguntas
+
+    Returns:
+        dict: {"latency_ms", "recall_at_k", "hits"}
+    """
+
+    latencies = []
+    hits = []
+
+    # Primeira passada fora da medicao (carga lazy das particoes, caches do SO)
+    for item in questions:
+        rag.retrieve(item["question"], k=k)
+
+    for _ in range(repeats):
+        for item in questions:
+            start = time.perf_counter()
+            rag.retrieve(item["question"], k=k)
+            latencies.append(time.perf_counter() - start)
+
+    for item in questions:
+        hits.append(any(is_relevant(doc, item) for doc in rag.retrieve(item["question"], k=k)))
+
+    return {"latency_ms": distribution(latencies, 1000),
+            "recall_at_k": sum(hits) / len(hits),
+            "hits": hits}
+
+
+def bench_generation(rag, questions):
+    """Tokens/s e tempo total das respostas com o stub
+
+    Args:
+        rag (LLM_With_Rag): Objeto com start_model feito
+        questions (tuple): Conjunto de perguntas
+
+    Returns:
+        dict: Distribuicao de tokens/s, do tempo total e do prompt_build
+    """
+
+    records = [rag.answer(item["question"])["timings"] for item in questions]
+
+    return {"tokens_per_second": distribution([r["tokens_per_second"] for r in records
+                                               if "tokens_per_second" in r]),
+            "total_ms": distribution([r["total_seconds"] for r in records], 1000),
+            "prompt_build_ms": distribution([r.get("prompt_build_seconds", 0.0) for r in records], 1000),
+            "prompt_tokens": distribution([r["prompt_tokens"] for r in records])}
+
+
+def bench_cold_start(storage_path, data_path, index_type):
+    """Cold start em um processo novo: interpretador, imports, carga da
+    base e do modelo e a primeira resposta
+
+    Args:
+        storage_path (str): Pasta da base ja criada
+        data_path (str): Pasta de documentos
+        index_type (str): Tipo do indice da base
+
+    Returns:
+        dict: Tempos do processo filho e tempo total do processo (s)
+    """
+
+    command = [sys.executable, "-m", "custom_libs.rag_benchmark", "--cold-start",
+               "--storage", storage_path, "--data", data_path, "--index-types", index_type]
+
+    start = time.perf_counter()
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    elapsed = time.perf_counter() - start
+
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = elapsed
+
+    return result
+
+
+def bench_import(repeats = 5):
+    """Tempo do import do custom_llm em processos novos (mediana) e as
+    libs pesadas carregadas por ele
+
+    Args:
+        repeats (int, optional): Quantidade de processos. Padrao 5.
+
+    Returns:
+        dict: {"seconds", "runs", "heavy_modules"}
+    """
+
+    runs = []
+    heavy_modules = set()
+
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT_CHECK], check=True, capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+
+        runs.append(result["seconds"])
+        heavy_modules.update(result["heavy_modules"])
+
+    return {"seconds": statistics.median(runs), "runs": runs, "heavy_modules": sorted(heavy_modules)}
+
+
+def check_import_budget(budget = DEFAULT_IMPORT_BUDGET, repeats = 5):
+    """Verifica o orcamento do import do custom_llm
+
+    Args:
+        budget (float, optional): Tempo maximo (s) da mediana. Padrao DEFAULT_IMPORT_BUDGET.
+        repeats (int, optional): Quantidade de processos. Padrao 5.
+
+    Returns:
+        tuple: (True caso esteja dentro do orcamento, resultado do bench_import)
+    """
+
+    result = bench_import(repeats)
+    result["budget_seconds"] = budget
+
+    return result["seconds"] <= budget and not result["heavy_modules"], result
+
+
+def cold_start_child(storage_path, data_path, index_type):
+    """Lado do processo filho do bench_cold_start, imprime o json dos tempos"""
+
+    start = time.perf_counter()
+    importlib.import_module("custom_libs.custom_llm")
+    import_seconds = time.perf_counter() - start
+
+    register_stubs()
+
+    start = time.perf_counter()
+    rag = new_rag(storage_path, data_path, index_config=index_type)
+    start_model(rag, new_db=False)
+    start_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rag.answer(BENCHMARK_QUESTIONS[0]["question"])
+    first_answer_seconds = time.perf_counter() - start
+
+    print(json.dumps({"import_seconds": import_seconds,
+                      "start_seconds": start_seconds,
+                      "ready_seconds": rag.start_stats["ready_seconds"],
+                      "first_answer_seconds": first_answer_seconds}))
+
+
+def run_benchmark(data_path = DEFAULT_DATA_PATH,
+                  index_types = ("flat",),
+                  modes = ("vector", "hybrid"),
+                  k = 4,
+                  repeats = 5,
+                  n_tokens = 32,
+                  cold_start = True,
+                  work_dir = None):
+    """Roda o benchmark completo
+
+    Args:
+        data_path (str, optional): Pasta de documentos. Padrao 02_transcript_data.
+        index_types (tuple, optional): Tipos de indice medidos (ver Index_Config). Padrao ("flat",).
+        modes (tuple, optional): Tipos de busca medidos. Padrao ("vector", "hybrid").
+        k (int, optional): Chunks recuperados por pergunta (recall@k). Padrao 4.
+        repeats (int, optional): Passadas pelo conjunto de perguntas. Padrao 5.
+        n_tokens (int, optional): Tokens gerados pelo stub por resposta. Padrao 32.
+        cold_start (bool, optional): Mede o cold start em um processo novo. Padrao True.
+        work_dir (str, optional): Pasta das bases criadas, None utiliza uma
+            pasta temporaria apagada no final. Padrao None.
+
+    Returns:
+        dict: Resultado do benchmark (ver BENCHMARK_VERSION)
+    """
+
+    import faiss
+
+    register_stubs()
+
+    temporary = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix="rag_benchmark_") if temporary else work_dir
+
+    result = {"benchmark_version": BENCHMARK_VERSION,
+              "environment": {"python": platform.python_version(),
+                              "platform": platform.platform(),
+                              "cpu_count": os.cpu_count(),
+                              "faiss": faiss.__version__},
+              "settings": {"data_path": os.path.abspath(data_path),
+                           "files": sorted(os.listdir(data_path)),
+                           "questions": len(BENCHMARK_QUESTIONS),
+                           "k": k, "repeats": repeats, "n_tokens": n_tokens,
+                           "modes": list(modes)},
+              "import": bench_import(),
+              "indexes": {}}
+
+    try:
+        for index_type in index_types:
+            storage_path = os.path.join(work_dir, index_type)
+            shutil.rmtree(storage_path, ignore_errors=True)
+
+            # Criacao da base (inclui a carga feita no final do start_model)
+            rag = new_rag(storage_path, data_path, n_tokens, index_config=index_type, warm_snapshot=True)
+
+            entry = {"build_seconds": start_model(rag, new_db=True),
+                     "chunks": rag.ingest_stats.get("chunks"),
+                     "chunks_per_second": rag.ingest_stats.get("chunks_per_second"),
+                     "retrieval": {}}
+
+            # Carga da base ja criada, com e sem memory-map
+            for mmap_index in (False, True):
+                rag = new_rag(storage_path, data_path, n_tokens, index_config=index_type, mmap_index=mmap_index)
+                entry["load_mmap_seconds" if mmap_index else "load_seconds"] = start_model(rag, new_db=False)
+
+            # Restart com new_db=True e o snapshot ligado, a criacao da base deve ser pulada
+            rag = new_rag(storage_path, data_path, n_tokens, index_config=index_type, warm_snapshot=True)
+            start_model(rag, new_db=True)
+            entry["warm_start"] = {"ready_seconds": rag.start_stats["ready_seconds"],
+                                   "snapshot_hit": rag.start_stats["snapshot_hit"]}
+
+            if cold_start:
+                entry["cold_start"] = bench_cold_start(storage_path, data_path, index_type)
+
+            # Recuperacao sem cache, para medir a busca em si
+            for mode in modes:
+                rag = new_rag(storage_path, data_path, n_tokens, index_config=index_type,
+                              retrieval_mode=mode, retrieval_cache_size=0)
+                start_model(rag, new_db=False)
+                entry["retrieval"][mode] = bench_retrieval(rag, BENCHMARK_QUESTIONS, k, repeats)
+
+            # Geracao com o stub (contexto empacotado, streaming e metricas)
+            rag = new_rag(storage_path, data_path, n_tokens, index_config=index_type, retrieval_cache_size=0)
+            start_model(rag, new_db=False)
+            entry["generation"] = bench_generation(rag, BENCHMARK_QUESTIONS)
+
+            result["indexes"][index_type] = entry
+
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return result
+
+
+def main(argv = None):
+    """Linha de comando do benchmark"""
+
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline RAG")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="Pasta de documentos")
+    parser.add_argument("--index-types", nargs="+", default=["flat"], help="flat, ivf_flat, ivf_pq, hnsw")
+    parser.add_argument("--modes", nargs="+", default=["vector", "hybrid"], help="vector, lexical, hybrid")
+    parser.add_argument("--k", type=int, default=4, help="Chunks por pergunta (recall@k)")
+    parser.add_argument("--repeats", type=int, default=5, help="Passadas pelo conjunto de perguntas")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens gerados pelo stub por resposta")
+    parser.add_argument("--no-cold-start", action="store_true", help="Nao mede o cold start")
+    parser.add_argument("--work-dir", default=None, help="Pasta das bases (padrao: temporaria)")
+    parser.add_argument("--output", default=None, help="Arquivo json de saida (padrao: stdout)")
+    parser.add_argument("--import-budget", type=float, default=None,
+                        help="Somente verifica o tempo (s) do import do custom_llm, termina com erro caso passe")
+    parser.add_argument("--cold-start", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--storage", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Processo filho do bench_cold_start
+    if args.cold_start:
+        cold_start_child(args.storage, args.data, args.index_types[0])
+        return
+
+    # Teste do orcamento do import (CI)
+    if args.import_budget is not None:
+        ok, result = check_import_budget(args.import_budget)
+        print(json.dumps(result, indent=2, sort_keys=True))
+
+        if not ok:
+            sys.exit(f"""Import do custom_llm fora do orcamento: {result['seconds']:.3f}s (orcamento {args.import_budget:.3f}s), """
+                     f"""libs pesadas carregadas: {result['heavy_modules'] or 'nenhuma'}""")
+        return
+
+    result = run_benchmark(data_path=args.data,
+                           index_types=tuple(args.index_types),
+                           modes=tuple(args.modes),
+                           k=args.k,
+                           repeats=args.repeats,
+                           n_tokens=args.tokens,
+                           cold_start=not args.no_cold_start,
+                           work_dir=args.work_dir)
+
+    content = json.dumps(result, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(content + "\n")
+    else:
+        print(content)
+
+
+if __name__ == "__main__":
+    main()
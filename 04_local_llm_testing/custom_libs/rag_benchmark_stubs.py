@@ -0,0 +1,77 @@
+"""Stubs do benchmark do pipeline RAG (custom_libs.rag_benchmark): um
+embedder deterministico e uma LLM que gera sempre os mesmos tokens.
+
+Ficam fora do rag_benchmark porque dependem do numpy e do langchain, que
+o benchmark so importa quando roda o pipeline.
+"""
+
+# Imports de libs padrao
+import hashlib
+
+# Imports de libs especificos para manipulacao de dados
+import numpy as np
+
+# Imports de libs especificos para a utilizacao de LLM
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+# Import da tokenizacao do indice lexico (minusculas, sem acentos)
+from custom_libs.rag_lexical import tokenize
+
+
+class Hash_Embeddings(Embeddings):
+    """Embedder deterministico: cada termo (tokenize do BM25) soma 1 em
+    uma posicao escolhida pelo hash do termo e o vetor e normalizado.
+    Nao depende de pesos, rede ou GPU."""
+
+    def __init__(self, dim = 256):
+
+        # [ATRIB] Dimensao dos vetores
+        self.dim = dim
+
+
+    def embed_query(self, text):
+        """Vetor de um texto"""
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+
+        for term in tokenize(text):
+            vector[int.from_bytes(hashlib.md5(term.encode("utf-8")).digest()[:4], "little") % self.dim] += 1.0
+
+        norm = np.linalg.norm(vector)
+
+        return (vector / norm if norm else vector).tolist()
+
+
+    def embed_documents(self, texts):
+        """Vetores de uma lista de textos"""
+
+        return [self.embed_query(text) for text in texts]
+
+
+class Stub_LLM(LLM):
+    """LLM stub: devolve sempre os mesmos 'n_tokens' tokens em stream, o
+    tempo medido e somente o da cadeia do langchain e da lib"""
+
+    # [ATRIB] Quantidade de tokens gerados por resposta
+    n_tokens: int = 32
+
+    @property
+    def _llm_type(self):
+
+        return "benchmark-stub"
+
+
+    def _call(self, prompt, stop = None, run_manager = None, **kwargs):
+
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+
+    def _stream(self, prompt, stop = None, run_manager = None, **kwargs):
+
+        for i in range(self.n_tokens):
+            chunk = GenerationChunk(text=f""" token{i}""")
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,416 @@
+# Imports de libs padrao
+import os
+import re
+import json
+import time
+import atexit
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_question(question):
+    """Normaliza uma pergunta para comparacao exata: caixa baixa, sem
+    acentos, sem pontuacao e com espacos simples
+
+    e.g:
+        "O que é LANNATE?" => "o que e lannate"
+
+    Args:
+        question (str): Pergunta original
+
+    Returns:
+        str: Pergunta normalizada
+    """
+
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text)
+
+    return " ".join(text.split())
+
+
+class Answer_Cache:
+    """Cache de respostas da LLM.
+
+    Primeiro procura a pergunta normalizada (match exato) e, caso exista
+    um modelo de embedding, procura perguntas parecidas pela similaridade
+    de cosseno com as perguntas ja respondidas. Cada resposta guarda a
+    versao da base em que foi gerada e so e devolvida para a mesma versao.
+    As entradas expiram apos 'ttl' segundos e, quando o cache passa de
+    'max_size', a entrada menos utilizada recentemente e descartada (LRU).
+
+    Opcionalmente o cache e persistido: as entradas em um arquivo json e os
+    vetores das perguntas em binario (<path>.npy). A gravacao acontece a
+    cada 'save_every' respostas novas, quando passam 'save_interval'
+    segundos desde a ultima gravacao e no encerramento do processo.
+    """
+
+    def __init__(self,
+                 embedding_function = None,
+                 threshold = 0.92,
+                 ttl = 3600,
+                 max_size = 1024,
+                 path = None,
+                 save_every = 32,
+                 save_interval = 60):
+
+        # [ATRIB] Modelo de embedding das perguntas (None = somente match exato)
+        self.embedding_function = embedding_function
+
+        # [ATRIB] Similaridade minima para considerar duas perguntas iguais
+        self.threshold = threshold
+
+        # [ATRIB] Tempo de vida de uma resposta em segundos (None = nunca expira)
+        self.ttl = ttl
+
+        # [ATRIB] Quantidade maxima de respostas guardadas
+        self.max_size = max_size
+
+        # [ATRIB] Arquivo json de persistencia (None = somente em memoria)
+        self.path = path
+
+        # [ATRIB] Respostas novas entre gravacoes e tempo maximo (s) entre gravacoes
+        self.save_every = save_every
+        self.save_interval = save_interval
+
+        # [ATRIB] Respostas ainda nao gravadas e instante da ultima gravacao
+        self.pending = 0
+        self.last_save = time.monotonic()
+
+        # [ATRIB] Entradas em ordem de utilizacao, pergunta normalizada ->
+        # {"question", "answer", "vector", "version", "created"}
+        self.entries = OrderedDict()
+
+        # [ATRIB] Contadores de acertos (exatos e semanticos) e erros
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        if self.path:
+            self.load()
+
+            # Grava as respostas pendentes no encerramento do processo
+            atexit.register(self.flush)
+
+
+    def __valid(self, entry, version, now):
+        """Indica se uma entrada pode ser devolvida: dentro do tempo de vida
+        e gerada com a mesma versao da base"""
+
+        return (entry.get("version") == version
+                and (self.ttl is None or now - entry["created"] <= self.ttl))
+
+
+    def __embed(self, question):
+        """Embeda uma pergunta (vetor original do embed_query)"""
+
+        import numpy as np
+
+        return np.asarray(self.embedding_function.embed_query(question), dtype=np.float32)
+
+
+    @staticmethod
+    def __normalize(vector):
+        """Normaliza um vetor (norma 1) para a similaridade de cosseno"""
+
+        import numpy as np
+
+        norm = np.linalg.norm(vector)
+
+        return vector / norm if norm else vector
+
+
+    def lookup(self, question, version = None):
+        """Procura a resposta de uma pergunta no cache. Entradas expiradas ou
+        de outra versao sao ignoradas aqui e descartadas no put, assim o
+        match exato nao percorre o cache.
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            version (str, optional): Versao da base de vetores, respostas de
+                outras versoes sao ignoradas. Padrao None.
+
+        Returns:
+            tuple: (resposta guardada ou None, vetor da pergunta calculado na
+            busca por perguntas parecidas ou None). O vetor e o do embed_query
+            (sem normalizar) e pode ser reaproveitado na recuperacao e no put
+        """
+
+        key = normalize_question(question)
+        now = time.time()
+
+        with self.lock:
+            # Match exato da pergunta normalizada
+            entry = self.entries.get(key)
+            if entry is not None and self.__valid(entry, version, now):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["answer"], None
+
+            candidates = [(k, entry["vector"]) for k, entry in self.entries.items()
+                          if entry["vector"] is not None and self.__valid(entry, version, now)]
+
+        # Sem modelo de embedding nao existe busca por perguntas parecidas
+        if self.embedding_function is None:
+            with self.lock:
+                self.misses += 1
+            return None, None
+
+        vector = self.__embed(question)
+
+        if candidates:
+            import numpy as np
+
+            matrix = np.stack([candidate for _, candidate in candidates])
+            scores = matrix @ self.__normalize(vector)
+            best = int(np.argmax(scores))
+
+            if scores[best] >= self.threshold:
+                with self.lock:
+                    best_key = candidates[best][0]
+                    if best_key in self.entries:
+                        self.entries.move_to_end(best_key)
+                        self.hits += 1
+                        self.semantic_hits += 1
+                        return self.entries[best_key]["answer"], vector
+
+        with self.lock:
+            self.misses += 1
+
+        return None, vector
+
+
+    def get(self, question, version = None):
+        """Procura a resposta de uma pergunta no cache (ver lookup)
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            version (str, optional): Versao da base de vetores. Padrao None.
+
+        Returns:
+            Resposta guardada ou None caso nao exista
+        """
+
+        return self.lookup(question, version)[0]
+
+
+    def put(self, question, answer, version = None, vector = None):
+        """Guarda a resposta de uma pergunta. As entradas expiradas ou de
+        outra versao da base sao descartadas aqui e, caso o cache esteja
+        cheio, a entrada menos utilizada tambem
+
+        Args:
+            question (str): Pergunta feita pelo usuario
+            answer: Resposta gerada pela LLM (qualquer valor serializavel em json)
+            version (str, optional): Versao da base com que a resposta foi gerada. Padrao None.
+            vector (np.ndarray, optional): Vetor da pergunta devolvido pelo
+                lookup, evita embedar a pergunta de novo. Padrao None.
+        """
+
+        key = normalize_question(question)
+        now = time.time()
+
+        if self.embedding_function is not None:
+            vector = self.__normalize(self.__embed(question) if vector is None else vector)
+        else:
+            vector = None
+
+        with self.lock:
+            for stale_key in [k for k, entry in self.entries.items() if not self.__valid(entry, version, now)]:
+                del self.entries[stale_key]
+
+            self.entries[key] = {"question": question,
+                                 "answer": answer,
+                                 "vector": vector,
+                                 "version": version,
+                                 "created": now}
+            self.entries.move_to_end(key)
+
+            # Descarta as entradas menos utilizadas recentemente
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+            self.pending += 1
+            save = self.path and (self.pending >= self.save_every
+                                  or time.monotonic() - self.last_save >= self.save_interval)
+
+        if save:
+            self.save()
+
+
+    def clear(self,):
+        """Apaga todas as respostas do cache"""
+
+        with self.lock:
+            self.entries.clear()
+
+        if self.path:
+            self.save()
+
+
+    def flush(self,):
+        """Grava as respostas ainda nao persistidas (caso existam)"""
+
+        if self.path and self.pending:
+            self.save()
+
+
+    def load(self,):
+        """Carrega o cache do arquivo json (e dos vetores em <path>.npy), caso exista"""
+
+        import numpy as np
+
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+
+        # Formato antigo (lista com os vetores no json), sem versao da base
+        # as respostas nunca seriam devolvidas, entao sao descartadas
+        if isinstance(content, list):
+            return
+
+        vectors_path = self.path + ".npy"
+        vectors = None
+        if os.path.isfile(vectors_path):
+            vectors = np.load(vectors_path, allow_pickle=False)
+
+        # Arquivos gravados em momentos diferentes (ex: processo encerrado
+        # entre as duas gravacoes), os vetores sao descartados
+        if vectors is None or content.get("vectors") != len(vectors):
+            vectors = None
+
+        entries = OrderedDict()
+        for entry in content.get("entries", []):
+            value = dict(entry["value"])
+            row = value.pop("row", None)
+            value["vector"] = vectors[row] if vectors is not None and row is not None else None
+            entries[entry["key"]] = value
+
+        with self.lock:
+            self.entries = entries
+
+
+    def save(self,):
+        """Persiste o cache de forma atomica: entradas no json e vetores
+        das perguntas em binario no <path>.npy"""
+
+        import numpy as np
+
+        with self.lock:
+            items = list(self.entries.items())
+            self.pending = 0
+            self.last_save = time.monotonic()
+
+        content = []
+        vectors = []
+        for key, entry in items:
+            value = {name: item for name, item in entry.items() if name != "vector"}
+
+            # Linha do vetor da pergunta no <path>.npy
+            if entry["vector"] is not None:
+                value["row"] = len(vectors)
+                vectors.append(entry["vector"])
+
+            content.append({"key": key, "value": value})
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with self.save_lock:
+            tmp_path = self.path + ".npy.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+            os.replace(tmp_path, self.path + ".npy")
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"vectors": len(vectors), "entries": content}, f)
+            os.replace(tmp_path, self.path)
+
+
+class Retrieval_Cache:
+    """Cache de recuperacao: pergunta normalizada -> ids dos top-k chunks.
+
+    A chave inclui a versao da base de vetores, entao qualquer alteracao
+    no 00_storage invalida automaticamente as buscas antigas. Um acerto
+    evita tanto o modelo de embedding quanto a busca no FAISS.
+    """
+
+    def __init__(self, max_size = 2048):
+
+        # [ATRIB] Quantidade maxima de buscas guardadas (LRU)
+        self.max_size = max_size
+
+        # [ATRIB] Entradas em ordem de utilizacao,
+        # (versao, k, pergunta normalizada) -> [(id, score), ...]
+        self.entries = OrderedDict()
+
+        # [ATRIB] Contadores de acertos e erros
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+
+    def get(self, version, question, k):
+        """Procura os ids recuperados para uma pergunta
+
+        Args:
+            version (str): Versao da base de vetores
+            question (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks recuperados
+
+        Returns:
+            list: [(id, score), ...] ou None caso nao exista
+        """
+
+        key = (version, k, normalize_question(question))
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+
+        return None
+
+
+    def put(self, version, question, k, results):
+        """Guarda os ids recuperados para uma pergunta
+
+        Args:
+            version (str): Versao da base de vetores
+            question (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks recuperados
+            results (list): [(id, score), ...]
+        """
+
+        if self.max_size <= 0:
+            return
+
+        key = (version, k, normalize_question(question))
+
+        with self.lock:
+            self.entries[key] = list(results)
+            self.entries.move_to_end(key)
+
+            # Descarta as entradas menos utilizadas recentemente, entradas
+            # de versoes antigas da base acabam saindo por aqui
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+    def clear(self,):
+        """Apaga todas as buscas guardadas"""
+
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,166 @@
+# Imports de libs padrao
+import re
+
+
+def approx_tokens(text):
+    """Estimativa grosseira de tokens (~4 caracteres por token), usada
+    quando o modelo nao expoe o tokenizador
+
+    Args:
+        text (str): Texto a ser medido
+
+    Returns:
+        int: Quantidade estimada de tokens
+    """
+
+    return max(1, len(text) // 4)
+
+
+def llm_token_counter(llm):
+    """Retorna uma funcao que conta tokens com o tokenizador do modelo
+
+    Args:
+        llm: LLM do langchain (LlamaCpp expoe o llama.cpp em 'client')
+
+    Returns:
+        function: count_tokens(text) -> int
+    """
+
+    client = getattr(llm, "client", None)
+
+    if client is not None and hasattr(client, "tokenize"):
+        return lambda text: len(client.tokenize(text.encode("utf-8"), add_bos=False))
+
+    return approx_tokens
+
+
+def _shingles(text, size = 3):
+    """Conjunto de n-gramas de palavras de um texto normalizado"""
+
+    words = re.findall(r"\w+", text.lower())
+
+    if len(words) <= size:
+        return {tuple(words)}
+
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class Context_Packer:
+    """Monta o contexto do prompt RAG dentro de um orcamento de tokens.
+
+    Os chunks recuperados (em ordem de relevancia) passam por tres etapas:
+    1. chunks quase iguais (Jaccard dos n-gramas de palavras acima de
+       'dedupe_threshold') sao descartados, fica o mais relevante;
+    2. chunks vizinhos do mesmo arquivo (metadado 'chunk' consecutivo)
+       sao unidos em um unico trecho;
+    3. os trechos entram no contexto em ordem de relevancia enquanto
+       couberem no orcamento, medido com o tokenizador do modelo.
+    """
+
+    def __init__(self, count_tokens = approx_tokens, dedupe_threshold = 0.9, separator = "\n\n"):
+
+        # [ATRIB] Funcao que conta os tokens de um texto
+        self.count_tokens = count_tokens
+
+        # [ATRIB] Similaridade a partir da qual dois chunks sao considerados iguais
+        self.dedupe_threshold = dedupe_threshold
+
+        # [ATRIB] Separador entre os trechos do contexto
+        self.separator = separator
+
+
+    def dedupe(self, docs):
+        """Remove chunks quase duplicados mantendo o primeiro (mais relevante)
+
+        Args:
+            docs (list): Documents em ordem de relevancia
+
+        Returns:
+            list: Documents sem duplicatas
+        """
+
+        kept, kept_shingles = [], []
+
+        for doc in docs:
+            shingles = _shingles(doc.page_content)
+
+            duplicated = any(len(shingles & other) / max(1, len(shingles | other)) >= self.dedupe_threshold
+                             for other in kept_shingles)
+
+            if not duplicated:
+                kept.append(doc)
+                kept_shingles.append(shingles)
+
+        return kept
+
+
+    def merge_adjacent(self, docs):
+        """Une chunks consecutivos do mesmo arquivo. O trecho unido fica na
+        posicao do chunk mais relevante do grupo.
+
+        Args:
+            docs (list): Documents em ordem de relevancia
+
+        Returns:
+            list: Documents unidos, em ordem de relevancia
+        """
+
+        from langchain_core.documents import Document
+
+        # Agrupa por arquivo os chunks que tem posicao conhecida
+        by_source = {}
+        for rank, doc in enumerate(docs):
+            if "chunk" in doc.metadata:
+                by_source.setdefault(doc.metadata.get("source"), []).append((doc.metadata["chunk"], rank, doc))
+
+        merged = {}
+        absorbed = set()
+
+        for chunks in by_source.values():
+            chunks.sort(key=lambda item: item[0])
+
+            # Sequencias de posicoes consecutivas viram um unico trecho
+            group = [chunks[0]]
+            for item in chunks[1:] + [None]:
+                if item is not None and item[0] == group[-1][0] + 1:
+                    group.append(item)
+                    continue
+
+                if len(group) > 1:
+                    best_rank = min(rank for _, rank, _ in group)
+                    metadata = dict(group[0][2].metadata)
+                    metadata["chunk_end"] = group[-1][0]
+                    merged[best_rank] = Document(
+                        page_content=" ".join(doc.page_content for _, _, doc in group),
+                        metadata=metadata)
+                    absorbed.update(rank for _, rank, _ in group if rank != best_rank)
+
+                group = [item]
+
+        return [merged.get(rank, doc) for rank, doc in enumerate(docs) if rank not in absorbed]
+
+
+    def pack(self, docs, token_budget):
+        """Monta o contexto dentro do orcamento de tokens
+
+        Args:
+            docs (list): Documents recuperados em ordem de relevancia
+            token_budget (int): Quantidade maxima de tokens do contexto
+
+        Returns:
+            list: Documents que cabem no contexto, em ordem de relevancia
+        """
+
+        separator_tokens = self.count_tokens(self.separator)
+        remaining = token_budget
+        packed = []
+
+        for doc in self.merge_adjacent(self.dedupe(docs)):
+            tokens = self.count_tokens(doc.page_content) + (separator_tokens if packed else 0)
+
+            # Trechos que nao cabem sao pulados, um menor ainda pode caber
+            if tokens <= remaining:
+                packed.append(doc)
+                remaining -= tokens
+
+        return packed
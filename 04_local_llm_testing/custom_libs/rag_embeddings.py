@@ -0,0 +1,266 @@
+# Imports de libs padrao
+import os
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Import da interface de embeddings do langchain
+from langchain_core.embeddings import Embeddings
+
+# Import do cache de embeddings em disco
+from custom_libs.rag_storage import Embedding_Cache, text_hash
+
+
+# Modelo de embedding de cada processo worker do pipeline de ingestao
+_worker_embedding_model = None
+
+# Modelos em que embed_query(texto) e igual a embed_documents([texto])[0]
+# (sem instrucao de pergunta), as perguntas podem ser embedadas em lote.
+# Modelos com instrucao (Instruct, BGE, e5) ficam de fora
+QUERY_BATCH_MODELS = ("HuggingFaceEmbeddings", "Hash_Embeddings")
+
+
+def embed_queries(embedding_function, texts):
+    """Embeda varias perguntas com os mesmos vetores do embed_query, assim
+    a busca em lote (answer_many) e a busca de uma pergunta (retrieve)
+    recuperam os mesmos chunks e compartilham o cache de recuperacao
+
+    Args:
+        embedding_function (Embeddings): Modelo de embedding da base
+        texts (list): Perguntas
+
+    Returns:
+        list: Vetores na mesma ordem das perguntas
+    """
+
+    if type(embedding_function).__name__ in QUERY_BATCH_MODELS:
+        return embedding_function.embed_documents(texts)
+
+    return [embedding_function.embed_query(text) for text in texts]
+
+
+def _init_embedding_worker(model_name, n_threads, embedding_function = None):
+    """Inicializa um processo worker do pipeline de embedding, carregando
+    o modelo uma unica vez por processo
+
+    Args:
+        model_name (str): Nome do modelo de embedding no HuggingFace
+        n_threads (int): Threads do torch que cada worker pode utilizar
+        embedding_function (Embeddings, optional): Modelo registrado no
+            processo principal (register_embedding_model), enviado pronto
+            ao worker. None carrega o modelo pelo nome. Padrao None.
+    """
+
+    from custom_libs.custom_llm import get_embedding_model, register_embedding_model
+
+    global _worker_embedding_model
+
+    # O processo spawn comeca com o registro vazio, sem o modelo registrado
+    # o worker tentaria baixar um modelo do HuggingFace com esse nome
+    if embedding_function is not None:
+        register_embedding_model(model_name, embedding_function, "cpu")
+    else:
+        import torch
+
+        # Divide os cores entre os workers para nao disputarem a CPU
+        torch.set_num_threads(n_threads)
+
+    _worker_embedding_model = get_embedding_model(model_name, "cpu")
+
+
+def _embed_batch_worker(texts):
+    """Embeda um lote de textos dentro de um processo worker
+
+    Args:
+        texts (list): Lote de textos
+
+    Returns:
+        list: Vetores do lote
+    """
+
+    return _worker_embedding_model.embed_documents(texts)
+
+
+class Parallel_Embeddings(Embeddings):
+    """Pipeline de embedding em lotes para a ingestao de documentos.
+
+    Os chunks sao ordenados por tamanho e agrupados em lotes de
+    'batch_size' (lotes com textos de tamanho parecido gastam menos
+    padding no sentence-transformer). Com mais de um worker os lotes
+    sao embedados em um pool de processos, cada um com o seu proprio
+    modelo carregado, o que so faz sentido em maquinas somente CPU.
+    """
+
+    def __init__(self, embedding_function, model_name, batch_size = 64, workers = 1, worker_model = None):
+
+        # [ATRIB] Modelo de embedding do processo principal
+        self.embedding_function = embedding_function
+
+        # [ATRIB] Nome do modelo (carregado de novo em cada worker)
+        self.model_name = model_name
+
+        # [ATRIB] Quantidade de chunks por lote
+        self.batch_size = max(1, batch_size)
+
+        # [ATRIB] Quantidade de processos do pool
+        self.workers = max(1, workers)
+
+        # [ATRIB] Modelo registrado enviado (pickle) para cada worker, None
+        # carrega 'model_name' do HuggingFace em cada worker
+        self.worker_model = worker_model
+
+        # [ATRIB] Pool de processos, criado somente quando necessario
+        self.pool = None
+
+
+    def __get_pool(self,):
+        """Cria o pool de processos na primeira utilizacao
+
+        Returns:
+            ProcessPoolExecutor: Pool de workers de embedding
+        """
+
+        if self.pool is None:
+            # Falha aqui, com uma mensagem clara, e nao dentro de cada worker
+            if self.worker_model is not None:
+                try:
+                    pickle.dumps(self.worker_model)
+                except Exception as e:
+                    raise ValueError(f"""Modelo de embedding registrado {self.model_name} nao pode ser enviado """
+                                     f"""aos workers ({e}), utilize embed_workers=1""") from e
+
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # spawn evita herdar o estado do torch do processo principal
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embedding_worker,
+                initargs=(self.model_name, max(1, (os.cpu_count() or 1) // self.workers), self.worker_model),
+                )
+
+        return self.pool
+
+
+    def embed_documents(self, texts):
+        """Embeda uma lista de textos em lotes, em paralelo caso haja
+        mais de um worker
+
+        Args:
+            texts (list): Lista de textos
+
+        Returns:
+            list: Vetores na mesma ordem dos textos
+        """
+
+        # Agrupa textos de tamanho parecido no mesmo lote
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        positions = [order[n:n + self.batch_size] for n in range(0, len(order), self.batch_size)]
+        batches = [[texts[i] for i in batch] for batch in positions]
+
+        if self.workers > 1 and len(batches) > 1:
+            results = self.__get_pool().map(_embed_batch_worker, batches)
+        else:
+            results = map(self.embedding_function.embed_documents, batches)
+
+        # Devolve os vetores na ordem original
+        vectors = [None] * len(texts)
+        for batch_positions, batch_vectors in zip(positions, results):
+            for i, vector in zip(batch_positions, batch_vectors):
+                vectors[i] = vector
+
+        return vectors
+
+
+    def embed_query(self, text):
+        """Embeda uma pergunta direto no modelo do processo principal
+
+        Args:
+            text (str): Texto da pergunta
+
+        Returns:
+            list: Vetor da pergunta
+        """
+
+        return self.embedding_function.embed_query(text)
+
+
+    def close(self,):
+        """Encerra o pool de processos, caso tenha sido criado"""
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+class Cached_Embeddings(Embeddings):
+    """Embedding que consulta o Embedding_Cache antes de chamar o modelo.
+
+    Apenas textos que nunca foram vistos pelo modelo sao embedados, os
+    demais sao lidos do cache em disco. Perguntas (embed_query) nao sao
+    cacheadas e vao direto para o modelo.
+    """
+
+    def __init__(self, embedding_function, storage_path):
+
+        # [ATRIB] Modelo de embedding original
+        self.embedding_function = embedding_function
+
+        # [ATRIB] Cache em disco do modelo
+        self.cache = Embedding_Cache(storage_path,
+                                     getattr(embedding_function, "model_name",
+                                             type(embedding_function).__name__))
+
+        # [ATRIB] Contadores de acertos e erros do cache
+        self.hits = 0
+        self.misses = 0
+
+
+    def embed_documents(self, texts):
+        """Embeda uma lista de textos reaproveitando o cache
+
+        Args:
+            texts (list): Lista de textos
+
+        Returns:
+            list: Lista de vetores na mesma ordem dos textos
+        """
+
+        keys = [text_hash(text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+
+        # Textos que nao estao no cache (sem repetir textos iguais)
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+
+        self.hits += sum(vector is not None for vector in vectors)
+        self.misses += len(texts) - sum(vector is not None for vector in vectors)
+
+        if missing:
+            new_vectors = self.embedding_function.embed_documents(list(missing.values()))
+            for key, vector in zip(missing.keys(), new_vectors):
+                self.cache.add(key, vector)
+
+            vectors = [vector if vector is not None else self.cache.get(key)
+                       for key, vector in zip(keys, vectors)]
+
+        return vectors
+
+
+    def embed_query(self, text):
+        """Embeda uma pergunta direto no modelo
+
+        Args:
+            text (str): Texto da pergunta
+
+        Returns:
+            list: Vetor da pergunta
+        """
+
+        return self.embedding_function.embed_query(text)
+
+
+    def save(self,):
+        """Persiste os vetores novos do cache em disco"""
+
+        self.cache.save()
@@ -0,0 +1,363 @@
+# Imports de libs padrao
+import os
+import json
+import math
+import time
+
+
+# Nome do arquivo com o tipo e os parametros do indice, gravado no storage
+INDEX_CONFIG_FILE = "index_config.json"
+
+# Nome do arquivo com o relatorio recall x latencia da ultima criacao
+INDEX_REPORT_FILE = "index_report.json"
+
+# Tipos de indice suportados
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+class Index_Config:
+    """Tipo e parametros do indice FAISS da base de vetores.
+
+    - flat: busca exata (padrao do langchain), custo linear no tamanho da base;
+    - ivf_flat: vetores divididos em 'nlist' listas (k-means), a busca
+      visita 'nprobe' listas;
+    - ivf_pq: como o ivf_flat, mas os vetores sao comprimidos com product
+      quantization ('pq_m' sub-vetores de 'pq_bits' bits), ocupa uma fracao
+      da memoria do float32;
+    - hnsw: grafo navegavel com 'hnsw_m' vizinhos por no, a busca visita
+      'ef_search' candidatos. Nao aceita remocao de vetores.
+
+    Os indices IVF sao treinados em uma amostra de ate 'train_size' vetores.
+    """
+
+    def __init__(self,
+                 index_type = "flat",
+                 nlist = None,
+                 nprobe = 8,
+                 pq_m = 16,
+                 pq_bits = 8,
+                 hnsw_m = 32,
+                 ef_construction = 80,
+                 ef_search = 64,
+                 train_size = 100000):
+
+        # [ATRIB] Tipo do indice (um de INDEX_TYPES)
+        self.index_type = index_type
+
+        # [ATRIB] [IVF] Quantidade de listas (None = ~4 * raiz da quantidade de vetores)
+        # e quantidade de listas visitadas por busca
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        # [ATRIB] [PQ] Sub-vetores e bits por codigo
+        self.pq_m = pq_m
+        self.pq_bits = pq_bits
+
+        # [ATRIB] [HNSW] Vizinhos por no e candidatos na construcao e na busca
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+        # [ATRIB] Quantidade maxima de vetores da amostra de treino
+        self.train_size = train_size
+
+        self.validate()
+
+
+    def validate(self,):
+        """Valida os parametros, levantando ValueError com o problema
+        encontrado"""
+
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"""index_type deve ser um de {INDEX_TYPES}, recebido: {self.index_type}""")
+
+        for name in ("nprobe", "pq_m", "hnsw_m", "ef_construction", "ef_search", "train_size"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"""{name} deve ser um inteiro >= 1, recebido: {value}""")
+
+        if self.nlist is not None and (not isinstance(self.nlist, int) or self.nlist < 1):
+            raise ValueError(f"""nlist deve ser um inteiro >= 1, recebido: {self.nlist}""")
+
+        if not isinstance(self.pq_bits, int) or not 1 <= self.pq_bits <= 16:
+            raise ValueError(f"""pq_bits deve ser um inteiro entre 1 e 16, recebido: {self.pq_bits}""")
+
+
+    def to_dict(self,):
+        """Converte a configuracao em um dicionario serializavel em json"""
+
+        return dict(self.__dict__)
+
+
+    def __repr__(self,):
+
+        return f"""Index_Config({self.to_dict()})"""
+
+
+    def save(self, storage_path, **extra):
+        """Grava a configuracao na pasta da base de forma atomica
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+            **extra: Informacoes adicionais gravadas junto (ex: nlist efetivo)
+        """
+
+        os.makedirs(storage_path, exist_ok=True)
+
+        path = os.path.join(storage_path, INDEX_CONFIG_FILE)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.to_dict(), **extra), f)
+
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, storage_path):
+        """Carrega a configuracao gravada na pasta da base
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+
+        Returns:
+            Index_Config: Configuracao gravada ou None caso nao exista
+            (bases antigas sao sempre flat)
+        """
+
+        path = os.path.join(storage_path, INDEX_CONFIG_FILE)
+
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+
+        params = {name: value for name, value in content.items()
+                  if name in cls().__dict__}
+
+        return cls(**params)
+
+
+    def resolve_nlist(self, n_vectors):
+        """Quantidade de listas do IVF para a base
+
+        Args:
+            n_vectors (int): Quantidade de vetores da base
+
+        Returns:
+            int: nlist informado ou ~4 * raiz de n, com pelo menos 39
+            vetores de treino por lista (minimo recomendado pelo FAISS)
+        """
+
+        nlist = self.nlist or int(4 * math.sqrt(n_vectors))
+
+        return max(1, min(nlist, n_vectors // 39))
+
+
+    def factory_string(self, n_vectors):
+        """Descricao do indice no formato do faiss.index_factory
+
+        Args:
+            n_vectors (int): Quantidade de vetores da base
+
+        Returns:
+            str: e.g "IVF1024,PQ16x8" ou "HNSW32"
+        """
+
+        if self.index_type == "ivf_flat":
+            return f"""IVF{self.resolve_nlist(n_vectors)},Flat"""
+
+        if self.index_type == "ivf_pq":
+            return f"""IVF{self.resolve_nlist(n_vectors)},PQ{self.pq_m}x{self.pq_bits}"""
+
+        if self.index_type == "hnsw":
+            return f"""HNSW{self.hnsw_m}"""
+
+        return "Flat"
+
+
+def write_index(index, path):
+    """Grava um indice FAISS de forma atomica (arquivo temporario + replace),
+    processos que leem o indice via memory-map nunca veem um arquivo pela
+    metade
+
+    Args:
+        index (faiss.Index): Indice
+        path (str): Arquivo .faiss
+    """
+
+    import faiss
+
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_index(path, mmap = False):
+    """Le um indice FAISS, via memory-map somente leitura caso 'mmap'
+
+    O IO_FLAG_MMAP_IFC mapeia o arquivo inteiro (vetores do flat, grafo e
+    vetores do HNSW, listas do IVF), entao varios processos compartilham as
+    mesmas paginas. Versoes do FAISS sem esse flag (ou sem suporte para o
+    tipo do indice) caem no IO_FLAG_MMAP, que mapeia somente as listas
+    invertidas dos indices IVF: flat e HNSW sao lidos inteiros para a RAM.
+
+    Args:
+        path (str): Arquivo .faiss
+        mmap (bool, optional): Le via memory-map somente leitura. Padrao False.
+
+    Returns:
+        faiss.Index: Indice carregado
+    """
+
+    import faiss
+
+    if not mmap:
+        return faiss.read_index(path)
+
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def set_search_params(index, nprobe = None, ef_search = None):
+    """Ajusta os parametros de busca do indice (somente os que se aplicam)
+
+    Args:
+        index (faiss.Index): Indice carregado
+        nprobe (int, optional): Listas visitadas nos indices IVF. Padrao None.
+        ef_search (int, optional): Candidatos visitados no HNSW. Padrao None.
+    """
+
+    import faiss
+
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def sample_vectors(index, size, seed = 0):
+    """Amostra aleatoria dos vetores de um indice flat
+
+    Args:
+        index (faiss.Index): Indice flat com os vetores originais
+        size (int): Tamanho maximo da amostra
+        seed (int, optional): Semente do sorteio. Padrao 0.
+
+    Returns:
+        np.ndarray: Matriz (amostra, dim) float32
+    """
+
+    import numpy as np
+
+    n_vectors = index.ntotal
+
+    if size >= n_vectors:
+        return index.reconstruct_n(0, n_vectors)
+
+    rows = np.sort(np.random.default_rng(seed).choice(n_vectors, size, replace=False))
+
+    return np.vstack([index.reconstruct(int(row)) for row in rows])
+
+
+def build_index(flat_index, config, block_size = 65536):
+    """Cria o indice configurado a partir do indice flat da ingestao,
+    treinando na amostra e copiando os vetores em blocos. A ordem das
+    linhas e preservada, entao o index_to_docstore_id continua valido.
+
+    Args:
+        flat_index (faiss.Index): Indice flat com todos os vetores
+        config (Index_Config): Tipo e parametros do indice
+        block_size (int, optional): Vetores copiados por vez. Padrao 65536.
+
+    Returns:
+        faiss.Index: Indice treinado e preenchido
+    """
+
+    import faiss
+
+    if config.index_type == "flat":
+        return flat_index
+
+    n_vectors = flat_index.ntotal
+
+    if config.index_type == "ivf_pq" and flat_index.d % config.pq_m:
+        raise ValueError(f"""pq_m ({config.pq_m}) deve dividir a dimensao dos vetores ({flat_index.d})""")
+
+    index = faiss.index_factory(flat_index.d, config.factory_string(n_vectors), faiss.METRIC_L2)
+
+    if config.index_type == "hnsw":
+        index.hnsw.efConstruction = config.ef_construction
+
+    # Treina o quantizador (IVF) e os codebooks (PQ) em uma amostra
+    if not index.is_trained:
+        index.train(sample_vectors(flat_index, config.train_size))
+
+    for start in range(0, n_vectors, block_size):
+        index.add(flat_index.reconstruct_n(start, min(block_size, n_vectors - start)))
+
+    set_search_params(index, config.nprobe, config.ef_search)
+
+    return index
+
+
+def recall_report(flat_index, index, config, n_queries = 200, k = 10, seed = 1):
+    """Compara o indice aproximado com a busca exata do indice flat:
+    recall@k e latencia media por consulta para cada valor de nprobe
+    (IVF) ou ef_search (HNSW). As consultas sao vetores da propria base.
+
+    Args:
+        flat_index (faiss.Index): Indice flat (busca exata)
+        index (faiss.Index): Indice aproximado
+        config (Index_Config): Configuracao do indice aproximado
+        n_queries (int, optional): Quantidade de consultas. Padrao 200.
+        k (int, optional): Vizinhos comparados. Padrao 10.
+        seed (int, optional): Semente do sorteio das consultas. Padrao 1.
+
+    Returns:
+        list: [{"param", "value", "recall", "ms_per_query"}, ...]
+    """
+
+    queries = sample_vectors(flat_index, n_queries, seed=seed)
+    k = min(k, flat_index.ntotal)
+
+    def timed_search(search_index):
+        start = time.perf_counter()
+        _, rows = search_index.search(queries, k)
+        return rows, (time.perf_counter() - start) * 1000 / len(queries)
+
+    exact_rows, exact_ms = timed_search(flat_index)
+    report = [{"param": "exact", "value": None, "recall": 1.0, "ms_per_query": exact_ms}]
+
+    if config.index_type in ("ivf_flat", "ivf_pq"):
+        param = "nprobe"
+        nlist = config.resolve_nlist(flat_index.ntotal)
+        values = sorted({min(2 ** i, nlist) for i in range(int(math.log2(nlist)) + 2)} | {config.nprobe})
+    elif config.index_type == "hnsw":
+        param = "ef_search"
+        values = sorted({16, 32, 64, 128, 256, config.ef_search})
+    else:
+        return report
+
+    for value in values:
+        set_search_params(index, **{param: value})
+        rows, ms = timed_search(index)
+
+        hits = sum(len(set(found) & set(expected)) for found, expected in zip(rows, exact_rows))
+        report.append({"param": param, "value": value,
+                       "recall": hits / exact_rows.size, "ms_per_query": ms})
+
+    # Volta o indice para os parametros configurados
+    set_search_params(index, config.nprobe, config.ef_search)
+
+    return report
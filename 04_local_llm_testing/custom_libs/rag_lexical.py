@@ -0,0 +1,265 @@
+# Imports de libs padrao
+import os
+import re
+import math
+import json
+from collections import Counter
+
+# Import da normalizacao de perguntas (minusculas, sem acentos)
+from custom_libs.rag_cache import normalize_question
+
+
+# Nome do arquivo do indice invertido BM25, gravado no storage
+BM25_FILE = "bm25.json"
+
+# Versao do formato do indice, incrementar caso o layout mude
+BM25_VERSION = 1
+
+
+def tokenize(text):
+    """Divide um texto em termos normalizados (minusculas, sem acentos e
+    sem pontuacao), o mesmo tratamento das perguntas do cache
+
+    e.g:
+        "Número MAPA do LANNATE?" => ["numero", "mapa", "do", "lannate"]
+
+    Args:
+        text (str): Texto a ser dividido
+
+    Returns:
+        list: Termos do texto
+    """
+
+    return re.findall(r"\w+", normalize_question(text))
+
+
+def reciprocal_rank_fusion(result_lists, k, constant = 60):
+    """Une listas de resultados pela posicao de cada id (RRF): cada lista
+    soma 1 / (constant + posicao), entao scores de escalas diferentes
+    (distancia L2 e BM25) nunca sao comparados diretamente
+
+    Args:
+        result_lists (list): Listas de [(id, score), ...] em ordem de relevancia
+        k (int): Quantidade de resultados devolvidos
+        constant (int, optional): Constante do RRF. Padrao 60.
+
+    Returns:
+        list: [(id, score RRF), ...] em ordem de relevancia
+    """
+
+    scores = {}
+
+    for results in result_lists:
+        for rank, (doc_id, _) in enumerate(results):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (constant + rank + 1)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class BM25_Index:
+    """Indice invertido com ranqueamento BM25 dos chunks da base.
+
+    Guarda os termos de cada chunk (id -> {termo: frequencia}) e monta as
+    listas invertidas (termo -> {id: frequencia}) em memoria, assim chunks
+    de arquivos alterados ou removidos saem do indice sem reprocessar o
+    restante. A busca nao precisa do modelo de embedding.
+    """
+
+    def __init__(self, k1 = 1.2, b = 0.75):
+
+        # [ATRIB] Parametros do BM25: saturacao da frequencia e normalizacao pelo tamanho
+        self.k1 = k1
+        self.b = b
+
+        # [ATRIB] Termos de cada chunk, id -> {termo: frequencia}
+        self.docs = {}
+
+        # [ATRIB] Listas invertidas, termo -> {id: frequencia}
+        self.postings = {}
+
+        # [ATRIB] Tamanho (em termos) de cada chunk e soma dos tamanhos
+        self.lengths = {}
+        self.total_length = 0
+
+
+    def __len__(self,):
+
+        return len(self.docs)
+
+
+    def add(self, ids, texts):
+        """Indexa chunks (um id repetido substitui o chunk anterior)
+
+        Args:
+            ids (list): Ids dos chunks
+            texts (list): Textos dos chunks
+        """
+
+        for doc_id, text in zip(ids, texts):
+            if doc_id in self.docs:
+                self.remove([doc_id])
+
+            terms = Counter(tokenize(text))
+
+            self.docs[doc_id] = dict(terms)
+            self.lengths[doc_id] = sum(terms.values())
+            self.total_length += self.lengths[doc_id]
+
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[doc_id] = frequency
+
+
+    def remove(self, ids):
+        """Remove chunks do indice
+
+        Args:
+            ids (list): Ids dos chunks
+        """
+
+        for doc_id in ids:
+            terms = self.docs.pop(doc_id, None)
+
+            if terms is None:
+                continue
+
+            self.total_length -= self.lengths.pop(doc_id)
+
+            for term in terms:
+                posting = self.postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+
+
+    def idf(self, term):
+        """Peso inverso da frequencia de um termo nos chunks"""
+
+        df = len(self.postings.get(term, ()))
+
+        return math.log(1 + (len(self.docs) - df + 0.5) / (df + 0.5))
+
+
+    def search(self, query, k, ids = None):
+        """Busca os k chunks com maior score BM25
+
+        Args:
+            query (str): Pergunta feita pelo usuario
+            k (int): Quantidade de chunks
+            ids (set, optional): Somente esses chunks recebem score (ex:
+                chunks das particoes de um filtro), o IDF continua sendo o
+                da base inteira. Padrao None.
+
+        Returns:
+            list: [(id, score), ...] em ordem de relevancia
+        """
+
+        if not self.docs or (ids is not None and not ids):
+            return []
+
+        avg_length = self.total_length / len(self.docs)
+        scores = {}
+
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+
+            idf = self.idf(term)
+
+            # Percorre o menor dos dois: a lista invertida ou os candidatos
+            if ids is not None:
+                if len(ids) < len(posting):
+                    posting = {doc_id: posting[doc_id] for doc_id in ids if doc_id in posting}
+                else:
+                    posting = {doc_id: frequency for doc_id, frequency in posting.items() if doc_id in ids}
+
+            for doc_id, frequency in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+    def is_exact_match(self, query, results, ratio = 2.0, rare_fraction = 0.1):
+        """Indica se a busca lexica resolve a pergunta sozinha: o melhor
+        chunk contem todos os termos raros da pergunta (presentes em menos
+        de 'rare_fraction' dos chunks, ex: numero MAPA, nome do produto) e
+        o seu score e pelo menos 'ratio' vezes o do segundo colocado
+
+        Args:
+            query (str): Pergunta feita pelo usuario
+            results (list): Saida do search para a pergunta
+            ratio (float, optional): Vantagem minima sobre o segundo. Padrao 2.0.
+            rare_fraction (float, optional): Fracao maxima de chunks com o termo. Padrao 0.1.
+
+        Returns:
+            bool: True caso a resposta da busca lexica seja obvia
+        """
+
+        if not results:
+            return False
+
+        rare_terms = {term for term in tokenize(query)
+                      if 0 < len(self.postings.get(term, ())) <= rare_fraction * len(self.docs)}
+
+        best_id, best_score = results[0]
+
+        if not rare_terms or not rare_terms <= self.docs[best_id].keys():
+            return False
+
+        return len(results) == 1 or best_score >= ratio * results[1][1]
+
+
+    def save(self, storage_path):
+        """Grava o indice na pasta da base de forma atomica
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+        """
+
+        os.makedirs(storage_path, exist_ok=True)
+
+        path = os.path.join(storage_path, BM25_FILE)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": BM25_VERSION, "k1": self.k1, "b": self.b, "docs": self.docs}, f)
+
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, storage_path):
+        """Carrega o indice gravado na pasta da base
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+
+        Returns:
+            BM25_Index: Indice carregado ou None caso nao exista (ou seja
+            de outra versao)
+        """
+
+        path = os.path.join(storage_path, BM25_FILE)
+
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+
+        if content.get("version") != BM25_VERSION:
+            return None
+
+        index = cls(k1=content["k1"], b=content["b"])
+        index.docs = content["docs"]
+
+        # Monta as listas invertidas a partir dos termos de cada chunk
+        for doc_id, terms in index.docs.items():
+            index.lengths[doc_id] = sum(terms.values())
+            index.total_length += index.lengths[doc_id]
+
+            for term, frequency in terms.items():
+                index.postings.setdefault(term, {})[doc_id] = frequency
+
+        return index
@@ -0,0 +1,270 @@
+# Imports de libs padrao
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# Limites dos buckets dos histogramas: escala logaritmica (fator raiz de 2)
+# de 0.1ms ate ~1.5e5, serve tanto para segundos quanto para contagens
+DEFAULT_BUCKETS = tuple(1e-4 * 2 ** (i / 2) for i in range(62))
+
+
+class Histogram:
+    """Histograma de buckets fixos (mesmo modelo do Prometheus), os
+    percentis sao estimados por interpolacao dentro do bucket"""
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+
+        # [ATRIB] Limite superior de cada bucket (o ultimo bucket e +Inf)
+        self.buckets = tuple(buckets)
+
+        # [ATRIB] Quantidade de valores por bucket, total, soma, minimo e maximo
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+
+    def observe(self, value):
+        """Registra um valor"""
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+    def percentile(self, q):
+        """Estimativa do percentil q (0 a 100)
+
+        Args:
+            q (float): Percentil, e.g: 95
+
+        Returns:
+            float: Valor estimado ou None caso o histograma esteja vazio
+        """
+
+        if not self.count:
+            return None
+
+        target = q / 100 * self.count
+        cumulative = 0
+
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= target:
+                lower = self.buckets[i - 1] if i > 0 else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (target - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+
+        return self.max
+
+
+    def summary(self,):
+        """Resumo do histograma: quantidade, media, p50, p95, p99 e maximo"""
+
+        return {"count": self.count,
+                "mean": self.sum / self.count if self.count else None,
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99),
+                "max": self.max}
+
+
+class Pipeline_Metrics:
+    """Instrumentacao por etapa do pipeline RAG.
+
+    Cada chamada tem um registro (dict) com o tempo de cada etapa em
+    '<etapa>_seconds' (embedding, search, retrieval, prompt_build,
+    prompt_eval, generation, total) e contagens (prompt_tokens,
+    generated_tokens, tokens_per_second, retrieved_chunks, context_chunks).
+    O registro ativo fica na thread (bind), entao as etapas medidas em
+    funcoes internas caem na chamada certa. Ao final todos os valores
+    numericos entram em um histograma por nome.
+    """
+
+    def __init__(self, enabled = True):
+
+        # [ATRIB] Liga/desliga os histogramas (os registros continuam sendo montados)
+        self.enabled = enabled
+
+        # [ATRIB] Histogramas por nome do valor
+        self.histograms = {}
+
+        # [ATRIB] Registro da ultima chamada finalizada
+        self.last = {}
+
+        # [ATRIB] Registro ativo em cada thread
+        self.local = threading.local()
+
+        self.lock = threading.Lock()
+
+
+    def observe(self, name, value):
+        """Registra um valor no histograma do nome"""
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+
+    def current(self,):
+        """Registro ativo na thread atual (None fora de uma chamada)"""
+
+        return getattr(self.local, "record", None)
+
+
+    def start(self,):
+        """Cria o registro de uma chamada
+
+        Returns:
+            dict: Registro vazio com o instante de inicio
+        """
+
+        return {"_start": time.perf_counter()}
+
+
+    @contextmanager
+    def bind(self, record):
+        """Torna um registro o ativo da thread atual (inclusive em threads
+        de executores, para chamadas que trocam de thread)"""
+
+        previous = self.current()
+        self.local.record = record
+
+        try:
+            yield record
+        finally:
+            self.local.record = previous
+
+
+    @contextmanager
+    def stage(self, name):
+        """Mede o tempo de uma etapa, somado em '<name>_seconds' do registro
+        ativo. Fora de uma chamada o tempo vai direto para o histograma."""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            record = self.current()
+
+            if record is None:
+                self.observe(f"""{name}_seconds""", elapsed)
+            else:
+                key = f"""{name}_seconds"""
+                record[key] = record.get(key, 0.0) + elapsed
+
+
+    def set(self, **values):
+        """Grava contagens no registro ativo (e.g: retrieved_chunks=4)"""
+
+        record = self.current()
+
+        if record is not None:
+            record.update(values)
+
+
+    def finish(self, record):
+        """Finaliza um registro: calcula o tempo total e os tokens/s e
+        alimenta os histogramas
+
+        Args:
+            record (dict): Registro criado pelo start
+
+        Returns:
+            dict: Registro final (sem chaves internas)
+        """
+
+        start = record.pop("_start", None)
+        if start is not None:
+            record["total_seconds"] = time.perf_counter() - start
+
+        if record.get("generation_seconds") and record.get("generated_tokens"):
+            record["tokens_per_second"] = record["generated_tokens"] / record["generation_seconds"]
+
+        for name, value in record.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.observe(name, value)
+
+        self.last = record
+
+        return record
+
+
+    @contextmanager
+    def trace(self,):
+        """Registro de uma chamada inteira na thread atual (start + bind + finish).
+        Chamadas que levantam erro tambem sao finalizadas, marcadas com 'failed'"""
+
+        record = self.start()
+        record["failed"] = False
+
+        try:
+            with self.bind(record):
+                yield record
+
+        except BaseException as e:
+            record["failed"] = True
+            record["error"] = type(e).__name__
+            raise
+
+        finally:
+            self.finish(record)
+
+
+    def summary(self,):
+        """Resumo de todos os histogramas
+
+        Returns:
+            dict: Nome -> {"count", "mean", "p50", "p95", "p99", "max"}
+        """
+
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+
+    def prometheus(self, prefix = "rag"):
+        """Exporta os histogramas no formato texto do Prometheus
+
+        Args:
+            prefix (str, optional): Prefixo das metricas. Padrao "rag".
+
+        Returns:
+            str: Metricas no formato de exposicao do Prometheus
+        """
+
+        lines = []
+
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"""{prefix}_{name}"""
+                lines.append(f"""# TYPE {metric} histogram""")
+
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"""{metric}_bucket{{le="{bound:.6g}"}} {cumulative}""")
+
+                lines.append(f"""{metric}_bucket{{le="+Inf"}} {histogram.count}""")
+                lines.append(f"""{metric}_sum {histogram.sum}""")
+                lines.append(f"""{metric}_count {histogram.count}""")
+
+        return "\n".join(lines) + "\n"
+
+
+    def reset(self,):
+        """Apaga todos os histogramas"""
+
+        with self.lock:
+            self.histograms = {}
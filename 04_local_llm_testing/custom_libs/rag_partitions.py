@@ -0,0 +1,295 @@
+# Imports de libs padrao
+import os
+import re
+import json
+
+
+# Pasta (dentro do storage) com os indices de cada particao
+PARTITIONS_DIR = "partitions"
+
+# Arquivo com as particoes existentes e a quantidade de chunks de cada uma
+PARTITIONS_FILE = "partitions.json"
+
+# Metadados que geram particoes
+PARTITION_FIELDS = ("product", "doc_type")
+
+# Tipos de documento reconhecidos pelo prefixo do nome do arquivo (o mais
+# longo primeiro), e.g: leaflet_LANNATE.txt, price_description_nutrien.txt
+DOC_TYPES = ("price_description", "leaflet", "price")
+
+
+def extract_metadata(file_name):
+    """Extrai os metadados estruturados de um arquivo pelo nome
+
+    e.g:
+        "leaflet_LANNATE.txt" => {"file": "leaflet_LANNATE.txt",
+                                  "doc_type": "leaflet", "product": "LANNATE"}
+
+    Args:
+        file_name (str): Nome do arquivo dentro da pasta de documentos
+
+    Returns:
+        dict: {"file", "doc_type", "product"} (product None quando o nome
+        nao segue o padrao <tipo>_<produto>.txt)
+    """
+
+    stem = os.path.splitext(file_name)[0]
+
+    for doc_type in DOC_TYPES:
+        if stem.lower().startswith(doc_type + "_"):
+            product = stem[len(doc_type) + 1:]
+            return {"file": file_name, "doc_type": doc_type, "product": product.upper() or None}
+
+    return {"file": file_name, "doc_type": "document", "product": None}
+
+
+def partition_name(field, value):
+    """Nome dos arquivos de uma particao, e.g: product__LANNATE"""
+
+    return f"""{field}__{re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value))}"""
+
+
+class Partitioned_Index:
+    """Indices FAISS por particao de metadados (produto e tipo de documento).
+
+    Cada particao tem um indice flat so com os vetores dos seus chunks e o
+    mapeamento linha da particao -> linha do indice principal, entao uma
+    pergunta filtrada por produto so compara a pergunta com os vetores
+    daquele produto, sem varrer a base inteira e descartar os resultados.
+    """
+
+    def __init__(self, storage_path, mmap = False):
+
+        # [ATRIB] Pasta com os indices das particoes
+        self.path = os.path.join(storage_path, PARTITIONS_DIR)
+
+        # [ATRIB] Abre os indices via memory-map somente leitura
+        self.mmap = mmap
+
+        # [ATRIB] Particoes existentes, campo -> {valor: quantidade de chunks}
+        with open(os.path.join(self.path, PARTITIONS_FILE), "r", encoding="utf-8") as f:
+            self.partitions = json.load(f)
+
+        # [ATRIB] Particoes ja carregadas, (campo, valor) -> (indice, linhas)
+        self.loaded = {}
+
+        # [ATRIB] Linhas das particoes lidas sem o indice, (campo, valor) -> linhas
+        self.loaded_rows = {}
+
+
+    @staticmethod
+    def exists(storage_path):
+        """Indica se a base tem os indices das particoes gravados"""
+
+        return os.path.isfile(os.path.join(storage_path, PARTITIONS_DIR, PARTITIONS_FILE))
+
+
+    @staticmethod
+    def write(storage_path, flat_index, chunk_store, fields = PARTITION_FIELDS):
+        """Grava um indice flat por valor de cada campo de metadado
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+            flat_index (faiss.Index): Indice com os vetores originais (reconstruct)
+            chunk_store (Chunk_Store): Chunks na ordem das linhas do indice
+            fields (tuple, optional): Campos particionados. Padrao PARTITION_FIELDS.
+        """
+
+        import faiss
+        import numpy as np
+
+        from custom_libs.rag_index import write_index
+
+        path = os.path.join(storage_path, PARTITIONS_DIR)
+        os.makedirs(path, exist_ok=True)
+
+        # Arquivos gravados nesta versao, os demais sao descartados no final
+        written = {PARTITIONS_FILE}
+
+        # Os metadados sao comuns a todos os chunks de uma origem, entao as
+        # linhas de cada particao saem da coluna de origem
+        sources = np.asarray(chunk_store.sources)
+        partitions = {}
+
+        for field in fields:
+            values = {}
+            for source, entry in enumerate(chunk_store.source_table):
+                value = entry["metadata"].get(field)
+                if value is not None:
+                    values.setdefault(value, []).append(source)
+
+            partitions[field] = {}
+
+            for value, value_sources in values.items():
+                rows = np.flatnonzero(np.isin(sources, value_sources)).astype(np.int64)
+                if not len(rows):
+                    continue
+
+                index = faiss.IndexFlatL2(flat_index.d)
+                index.add(flat_index.reconstruct_batch(rows))
+
+                # Arquivos substituidos de forma atomica, leitores com a
+                # particao mapeada nunca veem um arquivo pela metade
+                name = partition_name(field, value)
+                write_index(index, os.path.join(path, name + ".faiss"))
+
+                rows_path = os.path.join(path, name + ".npy")
+                with open(rows_path + ".tmp", "wb") as f:
+                    np.save(f, rows)
+                os.replace(rows_path + ".tmp", rows_path)
+
+                written.update((name + ".faiss", name + ".npy"))
+                partitions[field][value] = len(rows)
+
+        tmp_path = os.path.join(path, PARTITIONS_FILE) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(partitions, f)
+        os.replace(tmp_path, os.path.join(path, PARTITIONS_FILE))
+
+        # Descarta as particoes da versao anterior da base
+        for name in os.listdir(path):
+            if name not in written:
+                os.remove(os.path.join(path, name))
+
+
+    def values(self, field):
+        """Valores existentes de um campo, e.g: produtos da base"""
+
+        return list(self.partitions.get(field, {}))
+
+
+    def __get(self, field, value):
+        """Carrega (uma unica vez) o indice e as linhas de uma particao"""
+
+        import numpy as np
+
+        from custom_libs.rag_index import read_index
+
+        key = (field, value)
+
+        if key not in self.loaded:
+            name = os.path.join(self.path, partition_name(field, value))
+
+            self.loaded[key] = (read_index(name + ".faiss", mmap=self.mmap),
+                                np.load(name + ".npy", mmap_mode="r"))
+
+        return self.loaded[key]
+
+
+    def __rows(self, field, value):
+        """Linhas do indice principal de uma particao, sem carregar o indice"""
+
+        import numpy as np
+
+        key = (field, value)
+
+        if key in self.loaded:
+            return self.loaded[key][1]
+
+        if key not in self.loaded_rows:
+            self.loaded_rows[key] = np.load(os.path.join(self.path, partition_name(field, value)) + ".npy",
+                                            mmap_mode="r")
+
+        return self.loaded_rows[key]
+
+
+    def __wanted(self, filters):
+        """Normaliza o filtro (campo -> lista de valores) e valida os campos"""
+
+        wanted = {field: [value] if isinstance(value, str) else list(value)
+                  for field, value in filters.items()}
+
+        for field in wanted:
+            if field not in self.partitions:
+                raise ValueError(f"""Campo sem particao: {field}, disponiveis: {list(self.partitions)}""")
+
+        return wanted
+
+
+    def __field_rows(self, field, values):
+        """Uniao das linhas das particoes de um campo"""
+
+        import numpy as np
+
+        return np.concatenate([self.__rows(field, value) for value in values
+                               if value in self.partitions[field]] or [np.zeros(0, dtype=np.int64)])
+
+
+    def rows(self, filters):
+        """Linhas do indice principal que passam no filtro (uniao dos valores
+        de um campo, intersecao entre campos), lidas somente dos .npy das
+        particoes, e.g: candidatos da busca lexica filtrada
+
+        Args:
+            filters (dict): Campo -> valor ou lista de valores
+
+        Returns:
+            np.ndarray: Linhas do indice principal em ordem crescente
+        """
+
+        import numpy as np
+
+        selected = None
+
+        for field, values in self.__wanted(filters).items():
+            field_rows = self.__field_rows(field, values)
+            selected = np.unique(field_rows) if selected is None else np.intersect1d(selected, field_rows)
+
+        return np.zeros(0, dtype=np.int64) if selected is None else selected
+
+
+    def search(self, vector, k, filters):
+        """Busca os k vetores mais proximos somente nas particoes do filtro
+
+        Cada campo do filtro aceita um valor ou uma lista de valores (uniao).
+        A busca roda nas particoes do campo mais seletivo e os demais campos
+        restringem as linhas via IDSelector, sem ler outros vetores.
+
+        Args:
+            vector (np.ndarray): Pergunta embedada, shape (1, dim)
+            k (int): Quantidade de chunks
+            filters (dict): Campo -> valor ou lista de valores
+
+        Returns:
+            list: [(linha do indice principal, distancia), ...] em ordem de proximidade
+        """
+
+        import faiss
+        import numpy as np
+
+        wanted = self.__wanted(filters)
+
+        # Campo com menos chunks e o que define quais particoes sao lidas
+        def size(field):
+            return sum(self.partitions[field].get(value, 0) for value in wanted[field])
+
+        search_field = min(wanted, key=size)
+
+        # Linhas permitidas pelos demais campos
+        allowed = [self.__field_rows(field, values) for field, values in wanted.items() if field != search_field]
+
+        results = []
+
+        for value in wanted[search_field]:
+            if value not in self.partitions[search_field]:
+                continue
+
+            index, rows = self.__get(search_field, value)
+
+            params = None
+            if allowed:
+                local = np.ones(len(rows), dtype=bool)
+                for allowed_rows in allowed:
+                    local &= np.isin(rows, allowed_rows)
+
+                if not local.any():
+                    continue
+
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.flatnonzero(local).astype(np.int64)))
+
+            scores, local_rows = index.search(vector, min(k, index.ntotal), params=params)
+
+            results.extend((int(rows[row]), float(score))
+                           for score, row in zip(scores[0], local_rows[0]) if row != -1)
+
+        return sorted(results, key=lambda item: item[1])[:k]
@@ -0,0 +1,173 @@
+# Imports de libs padrao
+import os
+import json
+import hashlib
+
+# Import da extracao de metadados pelo nome do arquivo
+from custom_libs.rag_partitions import extract_metadata
+
+
+# Pasta (dentro do storage) com uma base completa por shard
+SHARDS_DIR = "shards"
+
+# Arquivo com a configuracao dos shards, gravado no storage
+SHARDS_FILE = "shards.json"
+
+# Versao do formato da configuracao, incrementar caso o layout mude
+SHARDS_VERSION = 1
+
+
+def shard_name(file_name, shard_by = "file", n_shards = 4):
+    """Shard de um arquivo da pasta de documentos. A divisao depende so do
+    nome do arquivo, entao o shard dono de um chunk sai do proprio id
+
+    e.g:
+        shard_name("leaflet_LANNATE.txt", "product") => "product_LANNATE"
+        shard_name("leaflet_LANNATE.txt", "file", 4)  => "shard_002"
+
+    Args:
+        file_name (str): Nome do arquivo
+        shard_by (str, optional): "file" (hash do nome) ou "product". Padrao "file".
+        n_shards (int, optional): Quantidade de shards na divisao por hash. Padrao 4.
+
+    Returns:
+        str: Nome do shard (pasta dentro de SHARDS_DIR)
+    """
+
+    if shard_by == "product":
+        return f"""product_{extract_metadata(file_name)["product"] or "NONE"}"""
+
+    digest = int(hashlib.sha256(file_name.encode("utf-8")).hexdigest(), 16)
+
+    return f"""shard_{digest % n_shards:03d}"""
+
+
+def save_shard_config(storage_path, shard_by, n_shards, names, paths = None):
+    """Grava a configuracao dos shards de forma atomica
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+        shard_by (str): "file" ou "product"
+        n_shards (int): Quantidade de shards na divisao por hash
+        names (list): Nomes dos shards existentes
+        paths (dict, optional): Nome do shard -> pasta dentro de SHARDS_DIR,
+            shards fora do dict utilizam a pasta com o proprio nome. Padrao None.
+    """
+
+    os.makedirs(storage_path, exist_ok=True)
+
+    path = os.path.join(storage_path, SHARDS_FILE)
+    tmp_path = path + ".tmp"
+
+    paths = {name: folder for name, folder in (paths or {}).items() if name in names and folder != name}
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SHARDS_VERSION, "shard_by": shard_by,
+                   "n_shards": n_shards, "names": sorted(names), "paths": paths}, f)
+
+    os.replace(tmp_path, path)
+
+
+def load_shard_config(storage_path):
+    """Carrega a configuracao dos shards
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+
+    Returns:
+        dict: {"shard_by", "n_shards", "names", "paths"} ou None caso a
+        base nao seja dividida em shards
+    """
+
+    path = os.path.join(storage_path, SHARDS_FILE)
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        content = json.load(f)
+
+    if content.get("version") != SHARDS_VERSION:
+        return None
+
+    content.setdefault("paths", {})
+
+    return content
+
+
+def shard_path(storage_path, name, shard_config = None):
+    """Pasta de um shard: a gravada na configuracao (o rebuild_shard cria
+    o shard novo em outra pasta) ou SHARDS_DIR/<nome>
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+        name (str): Nome do shard
+        shard_config (dict, optional): Saida do load_shard_config. Padrao None.
+
+    Returns:
+        str: Caminho da pasta do shard
+    """
+
+    folder = (shard_config or {}).get("paths", {}).get(name, name)
+
+    return os.path.join(storage_path, SHARDS_DIR, folder)
+
+
+class Sharded_Docstore:
+    """Docstore que encaminha a busca por id para o shard dono do chunk
+    (o nome do arquivo e o inicio do id gerado por chunk_id)"""
+
+    def __init__(self, sharded_store):
+
+        self.sharded_store = sharded_store
+
+
+    def search(self, search):
+        """Busca um chunk pelo id (interface do Docstore do langchain)
+
+        Args:
+            search (str): Id do chunk
+
+        Returns:
+            Document: Chunk encontrado ou mensagem de erro (como o InMemoryDocstore)
+        """
+
+        name = shard_name(search.split(":")[0], self.sharded_store.shard_by,
+                          self.sharded_store.n_shards)
+        shard = self.sharded_store.shards.get(name)
+
+        if shard is None:
+            return f"""ID {search} not found."""
+
+        return shard.vectorstore.docstore.search(search)
+
+
+class Sharded_Store:
+    """Vectorstore formada pelos shards carregados, utilizada no lugar da
+    vectorstore FAISS do objeto principal (a busca em si e feita pelo
+    LLM_With_Rag, que distribui a pergunta entre os shards)"""
+
+    def __init__(self, shards, shard_by, n_shards, embedding_function):
+
+        # [ATRIB] Shards carregados, nome -> LLM_With_Rag do shard
+        self.shards = shards
+
+        # [ATRIB] Divisao utilizada ("file" ou "product") e quantidade de shards
+        self.shard_by = shard_by
+        self.n_shards = n_shards
+
+        # [ATRIB] Modelo de embedding compartilhado pelos shards
+        self.embedding_function = embedding_function
+
+        # [ATRIB] Docstore que encaminha as buscas para o shard dono
+        self.docstore = Sharded_Docstore(self)
+
+
+    def __len__(self,):
+
+        return len(self.shards)
+
+
+    def __bool__(self,):
+
+        return bool(self.shards)
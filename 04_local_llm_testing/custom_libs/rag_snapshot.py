@@ -0,0 +1,252 @@
+# Imports de libs padrao
+import os
+import json
+import time
+import hashlib
+import platform
+
+# Imports da versao da base e da configuracao dos shards
+from custom_libs.rag_storage import index_version
+from custom_libs.rag_shards import load_shard_config, shard_path
+
+
+# Arquivo do snapshot de warm start, gravado no storage
+SNAPSHOT_FILE = "warm_snapshot.json"
+
+# Arquivo com o estado do llama.cpp do prefixo do prompt, gravado no storage
+PREFIX_STATE_FILE = "warm_prefix_state.npz"
+
+# Versao do formato do snapshot, incrementar caso o layout mude
+SNAPSHOT_VERSION = 1
+
+
+def config_hash(config):
+    """Hash de uma configuracao serializavel em json (objetos que nao sao
+    serializaveis, como a classe do loader, entram pelo repr)
+
+    Args:
+        config (dict): Configuracao
+
+    Returns:
+        str: Hash da configuracao
+    """
+
+    content = json.dumps(config, sort_keys=True, default=repr)
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def data_fingerprint(rag_data_path, file_names):
+    """Versao da pasta de documentos a partir do nome, tamanho e data de
+    modificacao dos arquivos (nao le o conteudo, entao custa so um stat
+    por arquivo)
+
+    Args:
+        rag_data_path (str): Pasta de documentos
+        file_names (list): Arquivos que entram na base
+
+    Returns:
+        str: Versao dos documentos
+    """
+
+    digest = hashlib.sha256()
+
+    for name in sorted(file_names):
+        stat = os.stat(os.path.join(rag_data_path, name))
+        digest.update(f"""{name}:{stat.st_size}:{stat.st_mtime_ns};""".encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+def storage_version(storage_path):
+    """Versao da base persistida sem carrega-la, igual ao index_version do
+    LLM_With_Rag depois do __get_db (inclusive com shards)
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+
+    Returns:
+        str: Versao da base ou None caso a base (ou algum shard) nao exista
+    """
+
+    shard_config = load_shard_config(storage_path)
+
+    if shard_config is None:
+        return index_version(storage_path)
+
+    digest = hashlib.sha256()
+
+    for name in sorted(shard_config["names"]):
+        version = index_version(shard_path(storage_path, name, shard_config))
+
+        if version is None:
+            return None
+
+        digest.update(f"""{name}:{version};""".encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+def file_identity(path):
+    """Identidade de um arquivo (tamanho e data de modificacao)
+
+    Args:
+        path (str): Caminho do arquivo
+
+    Returns:
+        str: Identidade ou None caso o arquivo nao exista
+    """
+
+    if not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+
+    return f"""{stat.st_size}:{stat.st_mtime_ns}"""
+
+
+def machine_key():
+    """Identifica a maquina (hostname e quantidade de CPUs), a configuracao
+    resolvida pelo hardware so e reaproveitada na mesma maquina"""
+
+    return f"""{platform.node()}:{os.cpu_count()}"""
+
+
+class Warm_Snapshot:
+    """Snapshot do ultimo start_model que terminou com sucesso.
+
+    Guarda a configuracao resolvida (device e parametros do llama.cpp
+    escolhidos pelo hardware), o hash da configuracao da base, a versao
+    dos documentos e a versao da base gravada, alem da chave do estado do
+    prefixo do prompt. Um processo reiniciado compara esses valores com os
+    atuais (somente stats de arquivos) e, se nada mudou, pula a criacao da
+    base e restaura o prefixo do disco em vez de avalia-lo de novo.
+    """
+
+    def __init__(self, storage_path):
+
+        # [ATRIB] Pasta da base de vetores, onde o snapshot e gravado
+        self.storage_path = storage_path
+
+        # [ATRIB] Arquivos do snapshot e do estado do prefixo
+        self.path = os.path.join(storage_path, SNAPSHOT_FILE)
+        self.prefix_path = os.path.join(storage_path, PREFIX_STATE_FILE)
+
+        # [ATRIB] Conteudo carregado (None = sem snapshot valido)
+        self.content = None
+
+
+    def load(self,):
+        """Carrega o snapshot gravado
+
+        Returns:
+            dict: Conteudo do snapshot ou None caso nao exista ou seja de
+            outra versao do formato
+        """
+
+        self.content = None
+
+        if not os.path.isfile(self.path):
+            return None
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if content.get("version") == SNAPSHOT_VERSION:
+            self.content = content
+
+        return self.content
+
+
+    def resolved(self, requested):
+        """Configuracao resolvida pelo hardware no ultimo start, caso os
+        parametros pedidos e a maquina sejam os mesmos
+
+        Args:
+            requested (dict): Parametros pedidos (ex: device="auto")
+
+        Returns:
+            dict: {"device", "llm_config"} ou None
+        """
+
+        if (self.content is None or self.content["requested"] != requested
+                or self.content["machine"] != machine_key()):
+            return None
+
+        return self.content["resolved"]
+
+
+    def is_fresh(self, db_config, data_version, db_version):
+        """Indica se a base gravada ainda corresponde a configuracao e aos
+        documentos atuais, ou seja, se a criacao da base pode ser pulada
+
+        Args:
+            db_config (dict): Configuracao que define o conteudo da base
+            data_version (str): Saida do data_fingerprint
+            db_version (str): Saida do storage_version
+
+        Returns:
+            bool: True caso nada tenha mudado desde o snapshot
+        """
+
+        return (self.content is not None and data_version is not None and db_version is not None
+                and self.content["db_config"] == config_hash(db_config)
+                and self.content["data_version"] == data_version
+                and self.content["db_version"] == db_version)
+
+
+    def prefix_fresh(self, llm_key):
+        """Indica se o estado do prefixo gravado e do mesmo modelo, com os
+        mesmos parametros e o mesmo prefixo
+
+        Args:
+            llm_key (dict): Modelo, parametros do llama.cpp e prefixo
+
+        Returns:
+            bool: True caso o estado gravado possa ser restaurado
+        """
+
+        return (self.content is not None
+                and self.content.get("prefix_state") == config_hash(llm_key)
+                and os.path.isfile(self.prefix_path))
+
+
+    def save(self, requested, resolved, db_config, data_version, db_version,
+             llm_key = None, ready_seconds = None):
+        """Grava o snapshot de forma atomica
+
+        Args:
+            requested (dict): Parametros pedidos
+            resolved (dict): Configuracao resolvida ({"device", "llm_config"})
+            db_config (dict): Configuracao que define o conteudo da base
+            data_version (str): Saida do data_fingerprint
+            db_version (str): Saida do storage_version
+            llm_key (dict, optional): Chave do estado do prefixo gravado em
+                prefix_path (None = sem estado do prefixo). Padrao None.
+            ready_seconds (float, optional): Tempo ate o objeto ficar pronto. Padrao None.
+        """
+
+        os.makedirs(self.storage_path, exist_ok=True)
+
+        content = {"version": SNAPSHOT_VERSION,
+                   "created": time.time(),
+                   "machine": machine_key(),
+                   "requested": requested,
+                   "resolved": resolved,
+                   "db_config": config_hash(db_config),
+                   "data_version": data_version,
+                   "db_version": db_version,
+                   "prefix_state": config_hash(llm_key) if llm_key is not None else None,
+                   "ready_seconds": ready_seconds}
+
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f)
+
+        os.replace(tmp_path, self.path)
+
+        self.content = content
@@ -0,0 +1,713 @@
+# Imports de libs padrao
+import os
+import re
+import json
+import hashlib
+
+
+
+# Nome do arquivo de manifesto gravado ao lado do index.faiss/index.pkl
+MANIFEST_FILE = "manifest.json"
+
+# Versao do formato do manifesto, incrementar caso o layout mude
+MANIFEST_VERSION = 1
+
+# Pasta (dentro do storage) onde fica o cache de embeddings
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+# Arquivos do armazenamento colunar de chunks (substitui o index.pkl):
+# textos em um unico blob UTF-8 e arrays com o offset, a origem e a
+# posicao de cada chunk, todos lidos via memory-map
+CHUNKS_BLOB_FILE = "chunks.bin"
+CHUNKS_OFFSETS_FILE = "chunks_offsets.npy"
+CHUNKS_SOURCE_FILE = "chunks_source.npy"
+CHUNKS_POSITION_FILE = "chunks_position.npy"
+CHUNKS_LOOKUP_FILE = "chunks_lookup.npy"
+CHUNKS_SOURCES_FILE = "chunks_sources.json"
+CHUNKS_FILES = (CHUNKS_BLOB_FILE, CHUNKS_OFFSETS_FILE, CHUNKS_SOURCE_FILE,
+                CHUNKS_POSITION_FILE, CHUNKS_LOOKUP_FILE, CHUNKS_SOURCES_FILE)
+
+
+class ReadOnlyStoreError(TypeError):
+    """Tentativa de alterar um Chunk_Store, que e somente leitura. Alteracoes
+    incrementais carregam a base com um docstore editavel
+    (__load_db(writable=True), feito pelo __update_db do LLM_With_Rag)"""
+
+
+def file_hash(path, block_size = 1 << 20):
+    """Calcula o hash sha256 do conteudo de um arquivo lendo em blocos,
+    assim arquivos grandes nao precisam ser carregados inteiros em memoria
+
+    Args:
+        path (str): Caminho do arquivo
+        block_size (int, optional): Tamanho do bloco de leitura. Padrao 1MB.
+
+    Returns:
+        str: Hash hexadecimal do conteudo do arquivo
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    """Calcula o hash sha256 de um texto (utilizado como chave de cache)
+
+    Args:
+        text (str): Texto do chunk
+
+    Returns:
+        str: Hash hexadecimal do texto em UTF-8
+    """
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(file_name, content_hash, position):
+    """Gera o id estavel de um chunk dentro da base FAISS
+
+    O id carrega o nome do arquivo, parte do hash do conteudo e a
+    posicao do chunk, assim um mesmo arquivo alterado gera ids novos
+    e nunca colide com os vetores da versao anterior.
+
+    Args:
+        file_name (str): Nome do arquivo de origem
+        content_hash (str): Hash do conteudo do arquivo
+        position (int): Posicao do chunk dentro do arquivo
+
+    Returns:
+        str: Id do chunk
+    """
+
+    return f"""{file_name}:{content_hash[:12]}:{position}"""
+
+
+def index_version(storage_path):
+    """Calcula a versao da base FAISS persistida a partir do tamanho e da
+    data de modificacao dos arquivos do indice e dos chunks. Qualquer escrita feita
+    pelo __create_db (completa ou incremental) gera uma versao nova.
+
+    Args:
+        storage_path (str): Pasta da base de vetores
+
+    Returns:
+        str: Versao da base ou None caso a base nao exista
+    """
+
+    digest = hashlib.sha256()
+
+    # Bases antigas guardam os chunks no index.pkl
+    chunk_files = CHUNKS_FILES if Chunk_Store.exists(storage_path) else ("index.pkl",)
+
+    for file_name in ("index.faiss",) + chunk_files:
+        path = os.path.join(storage_path, file_name)
+
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        digest.update(f"""{file_name}:{stat.st_size}:{stat.st_mtime_ns};""".encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+class Storage_Manifest:
+    """Essa classe guarda o manifesto da base de vetores, ou seja,
+    para cada arquivo indexado guardamos o hash do conteudo e os ids
+    dos chunks que foram inseridos no FAISS.
+
+    Com o manifesto conseguimos saber quais arquivos sao novos, quais
+    mudaram e quais foram removidos desde a ultima indexacao, evitando
+    re-embedar a biblioteca inteira a cada arquivo novo.
+
+    O manifesto tambem guarda as configuracoes da ingestao (modelo de
+    embedding, tamanho e sobreposicao dos chunks). Vetores de outro modelo
+    ou chunks de outro tamanho nao podem ser misturados na mesma base,
+    entao um manifesto com configuracoes diferentes nao e carregado e a
+    base e recriada do zero.
+    """
+
+    def __init__(self, storage_path, settings = None):
+
+        # [ATRIB] Pasta onde o manifesto e gravado (mesma do index.faiss)
+        self.storage_path = storage_path
+
+        # [ATRIB] Caminho completo do arquivo de manifesto
+        self.path = os.path.join(storage_path, MANIFEST_FILE)
+
+        # [ATRIB] Dicionario nome do arquivo -> {"hash": ..., "ids": [...]}
+        self.files = {}
+
+        # [ATRIB] Configuracoes da ingestao, e.g: {"embedding_model": ...,
+        # "chunk_size": 120, "chunk_overlap": 0}
+        self.settings = settings or {}
+
+
+    def exists(self,):
+        """Indica se ja existe um manifesto gravado em disco
+
+        Returns:
+            bool: True caso o arquivo de manifesto exista
+        """
+
+        return os.path.isfile(self.path)
+
+
+    def load(self,):
+        """Carrega o manifesto do disco, caso o formato seja de uma
+        versao diferente ou as configuracoes da ingestao tenham mudado o
+        manifesto e descartado
+
+        Returns:
+            bool: True caso o manifesto tenha sido carregado
+        """
+
+        if not self.exists():
+            return False
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+
+        # Manifesto de outra versao nao e confiavel, forca rebuild
+        if content.get("version") != MANIFEST_VERSION:
+            return False
+
+        # Base criada com outro modelo de embedding ou outro chunking
+        if content.get("settings", {}) != self.settings:
+            return False
+
+        self.files = content.get("files", {})
+
+        return True
+
+
+    def save(self,):
+        """Persiste o manifesto em disco de forma atomica (grava em um
+        arquivo temporario e depois renomeia)
+        """
+
+        os.makedirs(self.storage_path, exist_ok=True)
+
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "settings": self.settings,
+                       "files": self.files}, f)
+
+        os.replace(tmp_path, self.path)
+
+
+    def set_file(self, file_name, content_hash, ids):
+        """Registra (ou substitui) um arquivo no manifesto
+
+        Args:
+            file_name (str): Nome do arquivo
+            content_hash (str): Hash do conteudo do arquivo
+            ids (list): Ids dos chunks inseridos no FAISS
+        """
+
+        self.files[file_name] = {"hash": content_hash, "ids": list(ids)}
+
+
+    def remove_file(self, file_name):
+        """Remove um arquivo do manifesto
+
+        Args:
+            file_name (str): Nome do arquivo
+
+        Returns:
+            list: Ids dos chunks que pertenciam ao arquivo
+        """
+
+        entry = self.files.pop(file_name, None)
+
+        return entry["ids"] if entry else []
+
+
+    def diff(self, current_hashes):
+        """Compara o manifesto com o estado atual da pasta de documentos
+
+        Args:
+            current_hashes (dict): Nome do arquivo -> hash atual
+
+        Returns:
+            tuple: (novos, alterados, removidos) com listas de nomes
+        """
+
+        new_files = sorted(name for name in current_hashes
+                           if name not in self.files)
+
+        changed_files = sorted(name for name in current_hashes
+                               if name in self.files
+                               and self.files[name]["hash"] != current_hashes[name])
+
+        removed_files = sorted(name for name in self.files
+                               if name not in current_hashes)
+
+        return new_files, changed_files, removed_files
+
+
+class Embedding_Cache:
+    """Cache em disco de embeddings ja calculados.
+
+    Os vetores ficam em uma matriz float32 continua ('vectors.f32') lida
+    via memory-map e um indice json guarda hash do texto -> linha da
+    matriz. Cada modelo de embedding tem a sua propria pasta, entao
+    trocar de modelo nunca reaproveita vetores errados.
+    """
+
+    def __init__(self, storage_path, model_name):
+
+        # [ATRIB] Nome do modelo de embedding dono dos vetores
+        self.model_name = model_name
+
+        # [ATRIB] Pasta do cache para esse modelo (nome normalizado)
+        self.path = os.path.join(storage_path, EMBEDDING_CACHE_DIR,
+                                 re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+
+        # [ATRIB] Caminhos da matriz de vetores e do indice de linhas
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.index_path = os.path.join(self.path, "index.json")
+
+        # [ATRIB] Dimensao dos vetores e indice hash -> linha
+        self.dim = None
+        self.rows = {}
+
+        # [ATRIB] Vetores novos ainda nao gravados em disco
+        self.pending = []
+
+        # [ATRIB] Matriz memory-mapped (aberta sob demanda)
+        self.matrix = None
+
+        self.__load()
+
+
+    def __load(self,):
+        """Carrega o indice do cache, caso exista"""
+
+        if not (os.path.isfile(self.index_path) and os.path.isfile(self.vectors_path)):
+            return
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+
+        self.dim = content["dim"]
+        self.rows = content["rows"]
+
+        # Indice e matriz fora de sincronia (ex: processo morto no meio
+        # da escrita), o cache e descartado
+        if os.path.getsize(self.vectors_path) < len(self.rows) * self.dim * 4:
+            self.dim, self.rows = None, {}
+            os.remove(self.vectors_path)
+
+
+    def __get_matrix(self,):
+        """Abre a matriz de vetores em memory-map somente leitura
+
+        Returns:
+            np.memmap: Matriz (linhas, dim) float32
+        """
+
+        import numpy as np
+
+        if self.matrix is None and self.dim and os.path.isfile(self.vectors_path):
+            n_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            if n_rows:
+                self.matrix = np.memmap(self.vectors_path, dtype=np.float32,
+                                        mode="r", shape=(n_rows, self.dim))
+
+        return self.matrix
+
+
+    def get(self, key):
+        """Busca um vetor no cache
+
+        Args:
+            key (str): Hash do texto
+
+        Returns:
+            list: Vetor do texto ou None caso nao esteja no cache
+        """
+
+        row = self.rows.get(key)
+
+        if row is None:
+            return None
+
+        # Vetor adicionado nessa execucao e ainda nao gravado
+        n_saved = len(self.rows) - len(self.pending)
+        if row >= n_saved:
+            return self.pending[row - n_saved]
+
+        return self.__get_matrix()[row].tolist()
+
+
+    def add(self, key, vector):
+        """Adiciona um vetor ao cache (gravado apenas no save)
+
+        Args:
+            key (str): Hash do texto
+            vector (list): Vetor de embedding
+        """
+
+        if key in self.rows:
+            return
+
+        if self.dim is None:
+            self.dim = len(vector)
+
+        self.rows[key] = len(self.rows)
+        self.pending.append(list(vector))
+
+
+    def save(self,):
+        """Grava em disco os vetores pendentes (append na matriz) e o indice"""
+
+        import numpy as np
+
+        if not self.pending:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Descarta linhas orfas no final da matriz (escrita interrompida
+        # antes do indice ser gravado) e adiciona as linhas novas
+        n_saved = len(self.rows) - len(self.pending)
+        if os.path.isfile(self.vectors_path):
+            os.truncate(self.vectors_path, n_saved * self.dim * 4)
+
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.asarray(self.pending, dtype=np.float32).tobytes())
+
+        # Grava o indice de forma atomica
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim,
+                       "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+
+        # Libera os pendentes e forca reabrir o memory-map com o novo tamanho
+        self.pending = []
+        self.matrix = None
+
+
+class Chunk_Ids:
+    """Mapeamento linha do indice FAISS -> id do chunk (index_to_docstore_id)
+    calculado a partir das colunas do Chunk_Store, sem um dict por linha"""
+
+    def __init__(self, chunk_store):
+
+        self.chunk_store = chunk_store
+
+
+    def __getitem__(self, row):
+
+        if not 0 <= row < len(self.chunk_store):
+            raise KeyError(row)
+
+        return self.chunk_store.chunk_id(row)
+
+
+    def __len__(self,):
+
+        return len(self.chunk_store)
+
+
+    def __iter__(self,):
+
+        return iter(range(len(self.chunk_store)))
+
+
+    def __contains__(self, row):
+
+        return isinstance(row, int) and 0 <= row < len(self.chunk_store)
+
+
+    def keys(self,):
+
+        return range(len(self.chunk_store))
+
+
+    def values(self,):
+
+        return [self[row] for row in self.keys()]
+
+
+    def items(self,):
+
+        return [(row, self[row]) for row in self.keys()]
+
+
+class Chunk_Store:
+    """Armazenamento colunar e somente leitura dos chunks da base, utilizado
+    como docstore da vectorstore FAISS no lugar do index.pkl. Alteracoes
+    (add/delete) levantam ReadOnlyStoreError, atualizacoes incrementais
+    passam pelo __update_db, que carrega um docstore editavel.
+
+    - textos: um unico blob UTF-8 ('chunks.bin') e o offset de cada chunk;
+    - origem: indice de cada chunk em uma tabela de arquivos de origem, com
+      o prefixo do id e os metadados comuns a todos os chunks do arquivo;
+    - posicao: posicao do chunk no arquivo (metadado 'chunk' e sufixo do id);
+    - busca por id: chave (origem, posicao) ordenada, via busca binaria.
+
+    Todos os arrays sao lidos via memory-map, entao a carga nao depende do
+    tamanho da base, varios processos compartilham as paginas e nenhum
+    pickle e lido. Os Documents so sao criados para os chunks buscados.
+    """
+
+    def __init__(self, storage_path):
+
+        import numpy as np
+
+        # [ATRIB] Pasta da base de vetores
+        self.storage_path = storage_path
+
+        # [ATRIB] Blob com os textos (o numpy nao mapeia arquivos vazios)
+        blob_path = os.path.join(storage_path, CHUNKS_BLOB_FILE)
+        self.blob = (np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path)
+                     else np.zeros(0, dtype=np.uint8))
+
+        # [ATRIB] Colunas: offsets (n + 1), origem e posicao de cada linha e
+        # pares (chave, linha) ordenados pela chave origem << 32 | posicao
+        self.offsets = np.load(os.path.join(storage_path, CHUNKS_OFFSETS_FILE), mmap_mode="r")
+        self.sources = np.load(os.path.join(storage_path, CHUNKS_SOURCE_FILE), mmap_mode="r")
+        self.positions = np.load(os.path.join(storage_path, CHUNKS_POSITION_FILE), mmap_mode="r")
+        self.lookup = np.load(os.path.join(storage_path, CHUNKS_LOOKUP_FILE), mmap_mode="r")
+
+        # [ATRIB] Tabela de origens: {"prefix", "metadata", "chunk"} por arquivo
+        with open(os.path.join(storage_path, CHUNKS_SOURCES_FILE), "r", encoding="utf-8") as f:
+            self.source_table = json.load(f)
+
+        # [ATRIB] Prefixo do id -> origens com esse prefixo
+        self.prefixes = {}
+        for source, entry in enumerate(self.source_table):
+            self.prefixes.setdefault(entry["prefix"], []).append(source)
+
+
+    @staticmethod
+    def exists(storage_path):
+        """Indica se a base tem o armazenamento de chunks gravado
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+
+        Returns:
+            bool: True caso todos os arquivos existam
+        """
+
+        return all(os.path.isfile(os.path.join(storage_path, name)) for name in CHUNKS_FILES)
+
+
+    @staticmethod
+    def write(storage_path, vectorstore):
+        """Grava os chunks de uma vectorstore FAISS na ordem das linhas do
+        indice, os textos sao escritos em streaming no blob
+
+        Os ids precisam seguir o formato '<prefixo>:<posicao>' gerado por
+        chunk_id, o prefixo e guardado uma unica vez por arquivo.
+
+        Args:
+            storage_path (str): Pasta da base de vetores
+            vectorstore (FAISS): Base com o docstore do langchain
+        """
+
+        import numpy as np
+
+        os.makedirs(storage_path, exist_ok=True)
+
+        n_rows = vectorstore.index.ntotal
+        offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        sources = np.zeros(n_rows, dtype=np.int32)
+        positions = np.zeros(n_rows, dtype=np.int32)
+
+        # (prefixo, metadados sem 'chunk', tem 'chunk') -> indice da origem
+        source_keys = {}
+        source_table = []
+
+        blob_path = os.path.join(storage_path, CHUNKS_BLOB_FILE)
+        with open(blob_path + ".tmp", "wb") as f:
+            for row in range(n_rows):
+                chunk = vectorstore.index_to_docstore_id[row]
+                document = vectorstore.docstore.search(chunk)
+
+                prefix, _, position = chunk.rpartition(":")
+                if not (prefix and position.isdigit()):
+                    raise ValueError(f"""Id de chunk fora do formato <prefixo>:<posicao>: {chunk}""")
+
+                metadata = {key: value for key, value in document.metadata.items() if key != "chunk"}
+                key = (prefix, json.dumps(metadata, sort_keys=True), "chunk" in document.metadata)
+
+                if key not in source_keys:
+                    source_keys[key] = len(source_table)
+                    source_table.append({"prefix": prefix, "metadata": metadata, "chunk": key[2]})
+
+                data = document.page_content.encode("utf-8")
+                f.write(data)
+
+                offsets[row + 1] = offsets[row] + len(data)
+                sources[row] = source_keys[key]
+                positions[row] = int(position)
+
+        keys = (sources.astype(np.int64) << 32) | positions.astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        lookup = np.stack([keys[order], order.astype(np.int64)], axis=1)
+
+        arrays = {CHUNKS_OFFSETS_FILE: offsets, CHUNKS_SOURCE_FILE: sources,
+                  CHUNKS_POSITION_FILE: positions, CHUNKS_LOOKUP_FILE: lookup}
+
+        for name, array in arrays.items():
+            with open(os.path.join(storage_path, name) + ".tmp", "wb") as f:
+                np.save(f, array)
+
+        with open(os.path.join(storage_path, CHUNKS_SOURCES_FILE) + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(source_table, f)
+
+        for name in CHUNKS_FILES:
+            os.replace(os.path.join(storage_path, name) + ".tmp", os.path.join(storage_path, name))
+
+
+    def __len__(self,):
+
+        return len(self.sources)
+
+
+    def chunk_id(self, row):
+        """Id de um chunk a partir da origem e da posicao
+
+        Args:
+            row (int): Linha do chunk no indice
+
+        Returns:
+            str: Id do chunk
+        """
+
+        return f"""{self.source_table[self.sources[row]]["prefix"]}:{self.positions[row]}"""
+
+
+    def text(self, row):
+        """Texto de um chunk lido direto do blob
+
+        Args:
+            row (int): Linha do chunk no indice
+
+        Returns:
+            str: Texto do chunk
+        """
+
+        return bytes(self.blob[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+
+    def document(self, row):
+        """Cria o Document de um chunk
+
+        Args:
+            row (int): Linha do chunk no indice
+
+        Returns:
+            Document: Texto e metadados do chunk
+        """
+
+        from langchain_core.documents import Document
+
+        entry = self.source_table[self.sources[row]]
+
+        metadata = dict(entry["metadata"])
+        if entry["chunk"]:
+            metadata["chunk"] = int(self.positions[row])
+
+        return Document(page_content=self.text(row), metadata=metadata)
+
+
+    def row(self, chunk):
+        """Linha de um chunk pelo id (busca binaria nas chaves ordenadas)
+
+        Args:
+            chunk (str): Id do chunk
+
+        Returns:
+            int: Linha do chunk ou None caso nao exista
+        """
+
+        import numpy as np
+
+        prefix, _, position = chunk.rpartition(":")
+
+        if not position.isdigit():
+            return None
+
+        for source in self.prefixes.get(prefix, []):
+            key = (source << 32) | int(position)
+            found = int(np.searchsorted(self.lookup[:, 0], key))
+
+            if found < len(self.lookup) and self.lookup[found, 0] == key:
+                return int(self.lookup[found, 1])
+
+        return None
+
+
+    def index_to_docstore_id(self,):
+        """Mapeamento linha -> id utilizado pela vectorstore FAISS
+
+        Returns:
+            Chunk_Ids: Mapeamento calculado a partir das colunas
+        """
+
+        return Chunk_Ids(self)
+
+
+    def search(self, search):
+        """Busca um chunk pelo id (interface do Docstore do langchain)
+
+        Args:
+            search (str): Id do chunk
+
+        Returns:
+            Document: Chunk encontrado ou mensagem de erro (como o InMemoryDocstore)
+        """
+
+        row = self.row(search)
+
+        if row is None:
+            return f"""ID {search} not found."""
+
+        return self.document(row)
+
+
+    def to_dict(self,):
+        """Materializa todos os chunks, utilizado somente para atualizar a
+        base (o FAISS do langchain precisa de um docstore editavel)
+
+        Returns:
+            tuple: ({id: Document}, {linha: id})
+        """
+
+        documents, index_to_id = {}, {}
+
+        for row in range(len(self)):
+            index_to_id[row] = self.chunk_id(row)
+            documents[index_to_id[row]] = self.document(row)
+
+        return documents, index_to_id
+
+
+    def add(self, texts):
+        """Armazenamento somente leitura, para adicionar chunks a base e
+        carregada com um docstore editavel (__load_db(writable=True), ver
+        __update_db do LLM_With_Rag), sempre levanta ReadOnlyStoreError"""
+
+        raise ReadOnlyStoreError("Chunk_Store e somente leitura, atualize a base pelo __update_db "
+                                 "(docstore editavel via __load_db(writable=True))")
+
+
+    def delete(self, ids):
+        """Armazenamento somente leitura, para remover chunks a base e
+        carregada com um docstore editavel (__load_db(writable=True), ver
+        __update_db do LLM_With_Rag), sempre levanta ReadOnlyStoreError"""
+
+        raise ReadOnlyStoreError("Chunk_Store e somente leitura, atualize a base pelo __update_db "
+                                 "(docstore editavel via __load_db(writable=True))")
@@ -0,0 +1,73 @@
+# Imports de libs padrao
+import os
+import sys
+
+# Imports de libs de teste
+import pytest
+
+# Os testes importam a lib como os notebooks, a partir de 04_local_llm_testing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_libs.custom_llm import register_embedding_model
+from custom_libs.rag_benchmark import BENCHMARK_EMBEDDING_MODEL, new_rag
+from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+
+
+# Documentos pequenos (poucos chunks cada) no formato <tipo>_<PRODUTO>.txt
+DOCUMENTS = {
+    "leaflet_ALFA.txt": "ALFA e um inseticida. A dose de ALFA e de 2 litros por hectare. " * 6,
+    "leaflet_BETA.txt": "BETA e um fungicida. A dose de BETA e de 500 ml por hectare. " * 6,
+    "price_ALFA.txt": "O preco do ALFA e de 120 reais o litro na revenda. " * 6,
+}
+
+
+class Counting_Embeddings(Hash_Embeddings):
+    """Embedder deterministico do benchmark que conta os textos embedados"""
+
+    def __init__(self, dim = 256):
+
+        super().__init__(dim)
+
+        # [ATRIB] Quantidade de textos embedados pelo embed_documents
+        self.documents = 0
+
+
+    def embed_documents(self, texts):
+
+        self.documents += len(texts)
+
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embeddings():
+    """Embedder do benchmark registrado no lugar do HuggingFace"""
+
+    embedding_function = Counting_Embeddings()
+    register_embedding_model(BENCHMARK_EMBEDDING_MODEL, embedding_function)
+
+    return embedding_function
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    """Pasta de documentos com os DOCUMENTS"""
+
+    path = tmp_path / "data"
+    path.mkdir()
+
+    for name, text in DOCUMENTS.items():
+        (path / name).write_text(text, encoding="utf-8")
+
+    return str(path)
+
+
+@pytest.fixture
+def make_rag(tmp_path, data_path, embeddings):
+    """Cria LLM_With_Rag com os stubs do benchmark (embedder e LLM), sem
+    download de pesos nem llama.cpp"""
+
+    def make(**params):
+        return new_rag(str(tmp_path / "storage"), data_path, **params)
+
+    return make
@@ -0,0 +1,13 @@
+from custom_libs.rag_benchmark import DEFAULT_IMPORT_BUDGET, check_import_budget
+
+
+def test_custom_llm_import_budget():
+    # Cada medicao roda em um processo novo (bench_import), sem os imports do pytest
+    within_budget, result = check_import_budget(repeats=3)
+
+    for module in ("torch", "faiss", "langchain", "langchain_core", "llama_cpp"):
+        assert module not in result["heavy_modules"]
+    assert not result["heavy_modules"]
+
+    assert result["seconds"] <= DEFAULT_IMPORT_BUDGET, result["runs"]
+    assert within_budget
@@ -0,0 +1,32 @@
+# Imports de libs de teste
+import pytest
+
+from custom_libs import llm_runtime
+from custom_libs.llm_runtime import FALLBACK_MAX_MODELS, LLM_Pool
+
+
+def test_pool_max_models_evicts_least_recent():
+    evicted = []
+    pool = LLM_Pool(lambda model_name, params: object(), max_models=2,
+                    on_evict=lambda model_name, params: evicted.append(model_name))
+
+    pool.get("a", pin=True)
+    pool.get("b")
+    pool.get("c")
+
+    assert pool.loaded() == ["a", "c"]
+    assert evicted == ["b"]
+
+
+def test_pool_budget_without_psutil_falls_back_to_count(monkeypatch):
+    monkeypatch.setattr(llm_runtime, "resident_memory", lambda: None)
+
+    with pytest.warns(RuntimeWarning):
+        pool = LLM_Pool(lambda model_name, params: object(), memory_budget=1 << 30)
+
+    assert pool.max_models == FALLBACK_MAX_MODELS
+
+    for name in "abcdef":
+        pool.get(name)
+
+    assert len(pool.loaded()) == FALLBACK_MAX_MODELS
@@ -0,0 +1,21 @@
+# Imports de libs padrao
+import asyncio
+
+
+def test_aanswer_filters_match_answer(make_rag):
+    rag = make_rag()
+    rag.start_model()
+
+    filters = {"product": "BETA"}
+
+    async def ask():
+        try:
+            return await rag.aanswer("qual a dose?", filters=filters)
+        finally:
+            await rag.stop_async_worker()
+
+    result = asyncio.run(ask())
+
+    assert {doc.metadata["product"] for doc in result["sources"]} == {"BETA"}
+    assert ([doc.page_content for doc in result["sources"]]
+            == [doc.page_content for doc in rag.answer("qual a dose?", filters=filters)["sources"]])
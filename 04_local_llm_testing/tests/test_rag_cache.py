@@ -0,0 +1,77 @@
+from custom_libs.rag_cache import Answer_Cache
+from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+
+
+class Query_Counting_Embeddings(Hash_Embeddings):
+    """Embedder deterministico que conta as perguntas embedadas"""
+
+    def __init__(self, dim = 256):
+
+        super().__init__(dim)
+
+        # [ATRIB] Quantidade de chamadas ao embed_query
+        self.queries = 0
+
+
+    def embed_query(self, text):
+
+        self.queries += 1
+
+        return super().embed_query(text)
+
+
+def test_exact_hit_does_not_embed():
+    embeddings = Query_Counting_Embeddings()
+    cache = Answer_Cache(embedding_function=embeddings)
+
+    cache.put("Qual a dose de ALFA?", "2 L/ha")
+    embeddings.queries = 0
+
+    assert cache.lookup("qual a dose de alfa", None) == ("2 L/ha", None)
+    assert embeddings.queries == 0
+
+
+def test_miss_embeds_once_and_put_reuses_vector():
+    embeddings = Query_Counting_Embeddings()
+    cache = Answer_Cache(embedding_function=embeddings)
+
+    answer, vector = cache.lookup("Qual a dose de BETA?")
+    assert answer is None and vector is not None
+
+    cache.put("Qual a dose de BETA?", "500 ml/ha", vector=vector)
+    assert embeddings.queries == 1
+    assert cache.get("Qual a dose de BETA?") == "500 ml/ha"
+
+
+def test_stale_entries_are_ignored_and_dropped_on_put(monkeypatch):
+    cache = Answer_Cache(ttl=10)
+    now = 1000.0
+    monkeypatch.setattr("custom_libs.rag_cache.time.time", lambda: now)
+
+    cache.put("antiga", "a", version="v1")
+    cache.put("expira", "b", version="v1")
+
+    # Outra versao e entradas expiradas nao saem, mas so sao removidas no put
+    assert cache.get("antiga", version="v2") is None
+    now = 1011.0
+    assert cache.get("expira", version="v1") is None
+    assert len(cache.entries) == 2
+
+    cache.put("nova", "c", version="v2")
+    assert list(cache.entries) == ["nova"]
+
+
+def test_answer_miss_embeds_question_once(make_rag, embeddings, monkeypatch):
+    rag = make_rag(answer_cache=True)
+    rag.start_model()
+
+    queries = []
+    original = embeddings.embed_query
+    monkeypatch.setattr(embeddings, "embed_query", lambda text: queries.append(text) or original(text))
+
+    # Cache de respostas, recuperacao e put usam o mesmo vetor
+    rag.answer("Qual a dose de ALFA?")
+    assert queries == ["Qual a dose de ALFA?"]
+
+    assert rag.answer("qual a dose de alfa")["timings"]["cached"]
+    assert queries == ["Qual a dose de ALFA?"]
@@ -0,0 +1,86 @@
+from langchain_core.documents import Document
+
+from custom_libs.rag_context import Context_Packer, approx_tokens
+
+
+def doc(text, source = "a.txt", chunk = None):
+    """Document com o metadado 'chunk' opcional"""
+
+    metadata = {"source": source}
+    if chunk is not None:
+        metadata["chunk"] = chunk
+
+    return Document(page_content=text, metadata=metadata)
+
+
+def words(n, word = "palavra"):
+    """Texto com n palavras distintas (sem duplicatas entre chamadas)"""
+
+    return " ".join(f"""{word}{i}""" for i in range(n))
+
+
+def count_words(text):
+    """Contador de tokens exato para os testes: uma palavra = um token"""
+
+    return len(text.split())
+
+
+def test_pack_respects_budget():
+    packer = Context_Packer(count_tokens=count_words, separator="\n\n")
+    docs = [doc(words(10, "a")), doc(words(10, "b")), doc(words(10, "c"))]
+
+    packed = packer.pack(docs, 25)
+
+    assert [d.page_content for d in packed] == [docs[0].page_content, docs[1].page_content]
+    assert sum(count_words(d.page_content) for d in packed) <= 25
+
+
+def test_pack_counts_separator_tokens():
+    packer = Context_Packer(count_tokens=count_words, separator=" sep ")
+    docs = [doc(words(10, "a")), doc(words(10, "b"))]
+
+    # 10 + 1 (separador) + 10 nao cabe em 20
+    assert len(packer.pack(docs, 20)) == 1
+    assert len(packer.pack(docs, 21)) == 2
+
+
+def test_pack_skips_oversized_but_keeps_smaller():
+    packer = Context_Packer(count_tokens=count_words)
+    docs = [doc(words(5, "a")), doc(words(50, "b")), doc(words(3, "c"))]
+
+    packed = packer.pack(docs, 10)
+
+    assert [d.page_content for d in packed] == [docs[0].page_content, docs[2].page_content]
+    assert packer.pack(docs, 0) == []
+
+
+def test_pack_dedupes_and_merges_neighbours():
+    packer = Context_Packer(count_tokens=count_words)
+    docs = [doc(words(8, "x"), "f.txt", 3),
+            doc(words(8, "x"), "g.txt", 9),
+            doc(words(4, "y"), "f.txt", 4)]
+
+    packed = packer.pack(docs, 100)
+
+    # A quase duplicata sai e os chunks 3 e 4 do mesmo arquivo viram um trecho
+    assert len(packed) == 1
+    assert packed[0].page_content == f"""{words(8, "x")} {words(4, "y")}"""
+    assert packed[0].metadata["chunk"] == 3
+    assert packed[0].metadata["chunk_end"] == 4
+
+
+def test_approx_tokens():
+    assert approx_tokens("") == 1
+    assert approx_tokens("a" * 40) == 10
+
+
+def test_context_packing_is_opt_in(make_rag):
+    rag = make_rag(top_k=2, warm_snapshot=False)
+    rag.start_model()
+    assert len(rag.answer("dose de ALFA")["sources"]) == 2
+
+    rag = make_rag(top_k=2, warm_snapshot=False, context_packing=True,
+                   context_candidates=8, context_token_budget=40)
+    rag.start_model(new_db=False)
+    sources = rag.answer("dose de BETA")["sources"]
+    assert sum(approx_tokens(d.page_content) for d in sources) <= 40
@@ -0,0 +1,79 @@
+# Imports de libs padrao
+import threading
+
+# Imports de libs de teste
+import pytest
+
+from custom_libs.custom_llm import register_embedding_model
+from custom_libs.rag_benchmark import BENCHMARK_EMBEDDING_MODEL
+from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+from custom_libs.rag_embeddings import Parallel_Embeddings, embed_queries
+
+
+class Instruct_Embeddings(Hash_Embeddings):
+    """Embedder com instrucao de pergunta (como Instruct, BGE e e5):
+    embed_query e diferente de embed_documents para o mesmo texto"""
+
+    def embed_query(self, text):
+
+        return super().embed_query(f"""pergunta sobre dose preco: {text}""")
+
+    def embed_documents(self, texts):
+
+        return [Hash_Embeddings.embed_query(self, text) for text in texts]
+
+
+def test_embed_queries_matches_embed_query():
+    embedding_function = Instruct_Embeddings()
+    questions = ["dose de ALFA", "preco do BETA"]
+
+    assert embed_queries(embedding_function, questions) == [embedding_function.embed_query(q) for q in questions]
+    assert embed_queries(Hash_Embeddings(), questions) == Hash_Embeddings().embed_documents(questions)
+
+
+def test_answer_many_retrieves_like_answer(make_rag):
+    register_embedding_model(BENCHMARK_EMBEDDING_MODEL, Instruct_Embeddings())
+
+    rag = make_rag()
+    rag.start_model()
+
+    questions = ["qual a dose de ALFA?", "qual o preco do ALFA?", "BETA e um fungicida?"]
+    batch = [result["sources"] for result in rag.answer_many(questions)]
+
+    rag.retrieval_cache.clear()
+    single = [rag.answer(question)["sources"] for question in questions]
+
+    assert ([[doc.page_content for doc in sources] for sources in batch]
+            == [[doc.page_content for doc in sources] for sources in single])
+
+
+class Unpicklable_Embeddings(Hash_Embeddings):
+    """Embedder registrado que nao pode ser enviado aos workers"""
+
+    def __init__(self, dim = 256):
+
+        super().__init__(dim)
+
+        self.lock = threading.Lock()
+
+
+def test_embed_workers_use_registered_model(make_rag):
+    register_embedding_model(BENCHMARK_EMBEDDING_MODEL, Hash_Embeddings())
+
+    # Workers spawn recebem o modelo registrado em vez de carregar o nome do HuggingFace
+    parallel = make_rag(embed_workers=2, embed_batch_size=4, warm_snapshot=False)
+    parallel.start_model()
+
+    single = make_rag(embed_workers=1, warm_snapshot=False)
+    single.start_model()
+
+    assert ([doc.page_content for doc in parallel.retrieve("dose de ALFA", k=6)]
+            == [doc.page_content for doc in single.retrieve("dose de ALFA", k=6)])
+
+
+def test_embed_workers_reject_unpicklable_model():
+    parallel = Parallel_Embeddings(Unpicklable_Embeddings(), "unpicklable", batch_size=1, workers=2,
+                                   worker_model=Unpicklable_Embeddings())
+
+    with pytest.raises(ValueError, match="embed_workers=1"):
+        parallel.embed_documents(["a", "b"])
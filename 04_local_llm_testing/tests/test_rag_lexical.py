@@ -0,0 +1,53 @@
+from custom_libs.rag_lexical import BM25_Index, reciprocal_rank_fusion
+
+
+def test_rrf_orders_by_rank_not_score():
+    # Scores de escalas diferentes (distancia L2 e BM25) sao ignorados
+    vector = [("a", 0.1), ("b", 0.2), ("c", 0.3)]
+    lexical = [("b", 42.0), ("c", 10.0), ("d", 1.0)]
+
+    fused = reciprocal_rank_fusion([vector, lexical], k=4)
+
+    assert [doc_id for doc_id, _ in fused] == ["b", "c", "a", "d"]
+    assert fused[0][1] == 1 / 62 + 1 / 61
+
+
+def test_rrf_ties_keep_first_seen_order():
+    fused = reciprocal_rank_fusion([[("a", 0)], [("b", 0)]], k=2)
+
+    assert [doc_id for doc_id, _ in fused] == ["a", "b"]
+    assert fused[0][1] == fused[1][1]
+
+
+def test_rrf_truncates_to_k_and_uses_constant():
+    results = [("a", 0), ("b", 0), ("c", 0)]
+
+    fused = reciprocal_rank_fusion([results], k=2, constant=0)
+
+    assert fused == [("a", 1.0), ("b", 0.5)]
+    assert reciprocal_rank_fusion([], k=3) == []
+
+
+def test_bm25_search_restricted_to_ids():
+    index = BM25_Index()
+    index.add(["a", "b", "c"], ["dose de ALFA", "dose de BETA", "preco do ALFA"])
+
+    full = index.search("dose ALFA", 3)
+
+    # Mesmos scores da busca completa (IDF da base inteira), somente dos candidatos
+    assert index.search("dose ALFA", 3, ids={"b", "c"}) == [item for item in full if item[0] != "a"]
+    assert index.search("dose ALFA", 1, ids={"a"}) == [item for item in full if item[0] == "a"]
+    assert index.search("dose ALFA", 3, ids=set()) == []
+
+
+def test_filtered_lexical_search_uses_partitions(make_rag):
+    rag = make_rag(retrieval_mode="lexical")
+    rag.start_model()
+
+    result = rag.answer("dose de ALFA por hectare", filters={"doc_type": "leaflet", "product": "ALFA"})
+
+    assert {doc.metadata["file"] for doc in result["sources"]} == {"leaflet_ALFA.txt"}
+    assert "search_seconds" in result["timings"]
+
+    # Filtro sem chunks na base
+    assert rag.retrieve("dose", filters={"product": "GAMA"}) == []
@@ -0,0 +1,46 @@
+# Imports de libs de teste
+import pytest
+
+from custom_libs.rag_metrics import Pipeline_Metrics
+
+
+def total_count(rag):
+    """Chamadas registradas no histograma do tempo total"""
+
+    return rag.metrics.summary().get("total_seconds", {}).get("count", 0)
+
+
+def test_interrupted_stream_is_recorded(make_rag):
+    rag = make_rag(n_tokens=16)
+    rag.start_model()
+
+    stream = rag.stream_answer("dose de ALFA")
+    next(stream)
+    stream.close()
+
+    assert total_count(rag) == 1
+    assert rag.metrics.last["interrupted"]
+
+    assert list(rag.stream_answer("dose de BETA"))
+    assert total_count(rag) == 2
+    assert not rag.metrics.last["interrupted"]
+
+
+def test_trace_records_failed_calls():
+    metrics = Pipeline_Metrics()
+
+    with pytest.raises(RuntimeError):
+        with metrics.trace():
+            with metrics.stage("retrieval"):
+                raise RuntimeError("falha")
+
+    assert metrics.last["failed"]
+    assert metrics.last["error"] == "RuntimeError"
+    assert metrics.summary()["total_seconds"]["count"] == 1
+    assert metrics.summary()["retrieval_seconds"]["count"] == 1
+
+    with metrics.trace():
+        pass
+
+    assert not metrics.last["failed"]
+    assert metrics.summary()["total_seconds"]["count"] == 2
@@ -0,0 +1,46 @@
+# Imports de libs padrao
+import gc
+import os
+
+from custom_libs.rag_lexical import reciprocal_rank_fusion
+from custom_libs.rag_shards import load_shard_config, shard_path
+
+
+def test_lexical_fan_out_fuses_shard_rankings(make_rag):
+    rag = make_rag(shards=True, shard_by="product", retrieval_mode="lexical")
+    rag.start_model()
+    question = "dose por hectare"
+
+    # Scores BM25 de shards diferentes nao sao comparados, somente as posicoes
+    rankings = [shard.lexical_index.search(question, 4) for shard in rag.shard_stores.values()]
+    expected = [rag.vectorstore.docstore.search(doc_id) for doc_id, _ in reciprocal_rank_fusion(rankings, 4)]
+
+    assert len(rankings) == 2
+    assert rag.retrieve(question, k=4) == expected
+
+
+def test_rebuild_shard_swaps_to_new_folder(make_rag):
+    rag = make_rag(shards=True, shard_by="product")
+    rag.start_model()
+
+    old_shard = rag.shard_stores["product_BETA"]
+    old_path = old_shard.storage_path
+
+    assert rag.rebuild_shard("product_BETA")
+
+    # O shard antigo continua com os seus arquivos ate ser liberado
+    new_path = shard_path(rag.storage_path, "product_BETA", load_shard_config(rag.storage_path))
+    assert new_path != old_path
+    assert rag.shard_stores["product_BETA"].storage_path == new_path
+    assert os.path.isdir(old_path)
+    assert old_shard.retrieve("fungicida BETA")
+
+    del old_shard
+    gc.collect()
+    assert not os.path.isdir(old_path)
+
+    # Um novo processo carrega o shard da pasta nova
+    rag = make_rag()
+    rag.start_model(new_db=False)
+    assert rag.shard_stores["product_BETA"].storage_path == new_path
+    assert "leaflet_BETA.txt" in {doc.metadata["file"] for doc in rag.retrieve("fungicida BETA")}
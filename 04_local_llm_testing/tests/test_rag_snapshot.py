@@ -0,0 +1,145 @@
+# Imports de libs padrao
+import os
+import time
+
+from custom_libs.rag_snapshot import Warm_Snapshot, config_hash, data_fingerprint
+
+
+def test_data_fingerprint_tracks_size_and_mtime(data_path):
+    names = sorted(os.listdir(data_path))
+    version = data_fingerprint(data_path, names)
+
+    assert data_fingerprint(data_path, list(reversed(names))) == version
+
+    path = os.path.join(data_path, names[0])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert data_fingerprint(data_path, names) != version
+
+    assert data_fingerprint(data_path, names[1:]) != version
+
+
+def test_is_fresh_compares_config_data_and_db(tmp_path):
+    snapshot = Warm_Snapshot(str(tmp_path))
+    snapshot.save({"device": "cpu"}, {"device": "cpu", "llm_config": {}}, {"top_k": 4}, "data-1", "db-1")
+
+    snapshot = Warm_Snapshot(str(tmp_path))
+    snapshot.load()
+
+    assert snapshot.is_fresh({"top_k": 4}, "data-1", "db-1")
+    assert not snapshot.is_fresh({"top_k": 8}, "data-1", "db-1")
+    assert not snapshot.is_fresh({"top_k": 4}, "data-2", "db-1")
+    assert not snapshot.is_fresh({"top_k": 4}, "data-1", "db-2")
+    assert not snapshot.is_fresh({"top_k": 4}, "data-1", None)
+
+    assert snapshot.resolved({"device": "cpu"}) == {"device": "cpu", "llm_config": {}}
+    assert snapshot.resolved({"device": "auto"}) is None
+
+
+def test_config_hash_is_order_independent():
+    assert config_hash({"a": 1, "b": [1, 2]}) == config_hash({"b": [1, 2], "a": 1})
+    assert config_hash({"a": 1}) != config_hash({"a": 2})
+
+
+def test_start_model_skips_rebuild_when_fresh(make_rag, embeddings):
+    make_rag(warm_snapshot=True).start_model()
+    assert embeddings.documents > 0
+
+    embeddings.documents = 0
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model()
+
+    assert rag.start_stats["snapshot_hit"]
+    assert not rag.start_stats["db_rebuilt"]
+    assert embeddings.documents == 0
+    assert rag.retrieve("dose ALFA")
+
+
+def test_start_model_rebuilds_when_data_changes(make_rag, data_path):
+    make_rag(warm_snapshot=True).start_model()
+
+    # Garante uma data de modificacao diferente mesmo em sistemas de arquivos com baixa resolucao
+    time.sleep(0.01)
+    with open(os.path.join(data_path, "leaflet_GAMA.txt"), "w", encoding="utf-8") as f:
+        f.write("GAMA e um herbicida aplicado na soja. ")
+
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model()
+
+    assert not rag.start_stats["snapshot_hit"]
+    assert "leaflet_GAMA.txt" in {doc.metadata["file"] for doc in rag.retrieve("GAMA herbicida soja", k=12)}
+
+    # O snapshot gravado ja corresponde aos documentos novos
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model()
+    assert rag.start_stats["snapshot_hit"]
+
+
+def test_start_model_rebuilds_when_db_config_changes(make_rag, data_path):
+    make_rag(warm_snapshot=True).start_model()
+
+    # Mesmos arquivos listados explicitamente: documentos iguais, configuracao diferente
+    rag = make_rag(warm_snapshot=True, rag_files=sorted(os.listdir(data_path)))
+    rag.start_model()
+    assert not rag.start_stats["snapshot_hit"]
+
+    # Parametros somente de consulta nao fazem parte da configuracao da base
+    rag = make_rag(warm_snapshot=True, rag_files=sorted(os.listdir(data_path)), top_k=8)
+    rag.start_model()
+    assert rag.start_stats["snapshot_hit"]
+
+
+def test_force_rebuild_bypasses_snapshot(make_rag, embeddings):
+    make_rag(warm_snapshot=True).start_model()
+
+    embeddings.documents = 0
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model(force_rebuild=True)
+
+    assert not rag.start_stats["snapshot_hit"]
+    assert rag.start_stats["db_rebuilt"]
+    assert embeddings.documents > 0
+
+
+def test_start_without_new_db_does_not_save_snapshot(make_rag, data_path):
+    make_rag().start_model()
+
+    with open(os.path.join(data_path, "leaflet_GAMA.txt"), "w", encoding="utf-8") as f:
+        f.write("GAMA e um herbicida aplicado na soja. ")
+
+    # Carregar a base sem cria-la nao pode marcar os documentos novos como indexados
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model(new_db=False)
+    assert not os.path.isfile(rag.warm_snapshot.path)
+
+    rag = make_rag(warm_snapshot=True)
+    rag.start_model()
+    assert not rag.start_stats["snapshot_hit"]
+
+
+def test_snapshot_is_opt_in(make_rag, embeddings):
+    make_rag(warm_snapshot=True).start_model()
+
+    embeddings.documents = 0
+    rag = make_rag()
+    rag.start_model()
+
+    assert rag.warm_snapshot is None
+    assert rag.start_stats["db_rebuilt"]
+    assert embeddings.documents > 0
+
+
+def test_second_start_in_same_process_hits(make_rag, monkeypatch):
+    import langchain.document_loaders
+    from langchain_community.document_loaders import TextLoader
+
+    # Leitor padrao (document_loader=None) sem depender do unstructured
+    monkeypatch.setattr(langchain.document_loaders, "UnstructuredFileLoader", TextLoader)
+
+    rag = make_rag(warm_snapshot=True)
+    rag.document_loader = None
+    rag.start_model()
+    rag.start_model()
+
+    assert rag.start_stats["snapshot_hit"]
+    assert rag.document_loader is None
@@ -0,0 +1,159 @@
+# Imports de libs padrao
+import os
+import json
+
+# Imports de libs de teste
+import pytest
+
+from custom_libs.rag_storage import MANIFEST_FILE, Storage_Manifest, Chunk_Store, ReadOnlyStoreError, chunk_id
+
+
+def retrieved_files(rag, question, k = 12):
+    """Arquivos dos chunks recuperados para uma pergunta"""
+
+    return {doc.metadata["file"] for doc in rag.retrieve(question, k=k)}
+
+
+def test_manifest_diff():
+    manifest = Storage_Manifest("unused")
+    manifest.set_file("a.txt", "h1", ["a:0"])
+    manifest.set_file("b.txt", "h2", ["b:0"])
+
+    assert manifest.diff({"a.txt": "h1", "b.txt": "changed", "c.txt": "h3"}) == (["c.txt"], ["b.txt"], [])
+    assert manifest.diff({"a.txt": "h1"}) == ([], [], ["b.txt"])
+    assert manifest.remove_file("b.txt") == ["b:0"]
+    assert manifest.remove_file("b.txt") == []
+
+
+def test_manifest_settings_mismatch_is_not_loaded(tmp_path):
+    settings = {"embedding_model": "a", "chunk_size": 120, "chunk_overlap": 0}
+
+    manifest = Storage_Manifest(str(tmp_path), settings)
+    manifest.set_file("a.txt", "h1", ["a:0"])
+    manifest.save()
+
+    assert Storage_Manifest(str(tmp_path), dict(settings)).load()
+    assert not Storage_Manifest(str(tmp_path), dict(settings, chunk_size=60)).load()
+    assert not Storage_Manifest(str(tmp_path), dict(settings, embedding_model="b")).load()
+
+
+def test_incremental_add_embeds_only_new_file(make_rag, embeddings, data_path):
+    rag = make_rag(incremental_db=True, warm_snapshot=False)
+    rag.start_model()
+    full = embeddings.documents
+
+    with open(os.path.join(data_path, "leaflet_GAMA.txt"), "w", encoding="utf-8") as f:
+        f.write("GAMA e um herbicida aplicado na soja. ")
+
+    embeddings.documents = 0
+    rag.start_model()
+
+    # Somente o chunk do arquivo novo e embedado
+    assert 0 < embeddings.documents < full
+    assert "leaflet_GAMA.txt" in retrieved_files(rag, "GAMA herbicida soja")
+
+    with open(os.path.join(rag.storage_path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        assert "leaflet_GAMA.txt" in json.load(f)["files"]
+
+
+def test_incremental_delete_removes_chunks(make_rag, embeddings, data_path):
+    rag = make_rag(incremental_db=True, warm_snapshot=False)
+    rag.start_model()
+    assert "leaflet_BETA.txt" in retrieved_files(rag, "BETA fungicida")
+
+    os.remove(os.path.join(data_path, "leaflet_BETA.txt"))
+
+    embeddings.documents = 0
+    rag.start_model()
+
+    assert embeddings.documents == 0
+    assert "leaflet_BETA.txt" not in retrieved_files(rag, "BETA fungicida")
+
+
+def test_chunking_change_rebuilds(make_rag, embeddings):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    rag = make_rag(incremental_db=True, warm_snapshot=False)
+    rag.start_model()
+    assert os.path.isfile(os.path.join(rag.storage_path, MANIFEST_FILE))
+
+    # Mesmos documentos com chunks menores: a base inteira e embedada de novo
+    rag = make_rag(incremental_db=True, warm_snapshot=False)
+    rag.text_splitter = RecursiveCharacterTextSplitter(chunk_size=60, chunk_overlap=0)
+    embeddings.documents = 0
+    rag.start_model()
+
+    assert embeddings.documents > 0
+    assert all(len(doc.page_content) <= 60 for doc in rag.retrieve("dose ALFA", k=8))
+
+
+def small_vectorstore():
+    """FAISS em memoria com ids no formato do chunk_id, chunks com e sem
+    o metadado 'chunk' e textos com acentos"""
+
+    from langchain_community.vectorstores import FAISS
+
+    from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+
+    texts = ["Dose de ALFA: 2 L/ha", "Aplicação à noite", "", "Preço do BETA"]
+    metadatas = [{"file": "a.txt", "chunk": 0}, {"file": "a.txt", "chunk": 1},
+                 {"file": "b.txt", "chunk": 0}, {"file": "c.txt"}]
+    ids = [chunk_id("a.txt", "ab" * 32, 0), chunk_id("a.txt", "ab" * 32, 1),
+           chunk_id("b.txt", "cd" * 32, 0), chunk_id("c.txt", "ef" * 32, 7)]
+
+    return FAISS.from_texts(texts, Hash_Embeddings(), metadatas=metadatas, ids=ids)
+
+
+def test_chunk_store_round_trip(tmp_path):
+    vectorstore = small_vectorstore()
+    Chunk_Store.write(str(tmp_path), vectorstore)
+
+    assert Chunk_Store.exists(str(tmp_path))
+    store = Chunk_Store(str(tmp_path))
+    assert len(store) == vectorstore.index.ntotal
+
+    for row in range(len(store)):
+        chunk = vectorstore.index_to_docstore_id[row]
+        original = vectorstore.docstore.search(chunk)
+
+        assert store.chunk_id(row) == chunk
+        assert store.index_to_docstore_id()[row] == chunk
+        assert store.row(chunk) == row
+
+        document = store.search(chunk)
+        assert document.page_content == original.page_content
+        assert document.metadata == original.metadata
+
+
+def test_chunk_store_lookup_misses(tmp_path):
+    Chunk_Store.write(str(tmp_path), small_vectorstore())
+    store = Chunk_Store(str(tmp_path))
+
+    # Prefixo existente com outra posicao, prefixo desconhecido e id fora do formato
+    missing = chunk_id("a.txt", "ab" * 32, 5)
+    assert store.row(missing) is None
+    assert store.search(missing) == f"""ID {missing} not found."""
+    assert store.row(chunk_id("z.txt", "00" * 32, 0)) is None
+    assert store.row("sem-posicao") is None
+    assert len(store.index_to_docstore_id()) not in store.index_to_docstore_id()
+
+
+def test_chunk_store_is_read_only(tmp_path):
+    Chunk_Store.write(str(tmp_path), small_vectorstore())
+    store = Chunk_Store(str(tmp_path))
+
+    with pytest.raises(ReadOnlyStoreError):
+        store.add({"x": None})
+    with pytest.raises(TypeError):
+        store.delete([store.chunk_id(0)])
+
+
+def test_chunk_store_rejects_foreign_ids(tmp_path):
+    from langchain_community.vectorstores import FAISS
+
+    from custom_libs.rag_benchmark_stubs import Hash_Embeddings
+
+    vectorstore = FAISS.from_texts(["texto"], Hash_Embeddings(), ids=["sem-posicao"])
+
+    with pytest.raises(ValueError):
+        Chunk_Store.write(str(tmp_path), vectorstore)